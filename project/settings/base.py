@@ -14,8 +14,9 @@ APPEND_SLASH = False
 # Application definition
 
 INSTALLED_APPS = [
-    'daphne',
+    # racetime comes first so that its runserver command is used.
     'racetime',
+    'daphne',
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -35,12 +36,14 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'debug_toolbar.middleware.DebugToolbarMiddleware',
+    'racetime.middleware.InstrumentationMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'racetime.middleware.ReplicaMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'oauth2_provider.middleware.OAuth2TokenMiddleware',
@@ -72,15 +75,26 @@ FORM_RENDERER = 'django.forms.renderers.TemplatesSetting'
 
 SILENCED_SYSTEM_CHECKS = ['django_recaptcha.recaptcha_test_key_error']
 
+# Race events are fanned out through Redis pub/sub. More Redis hosts may be
+# listed to spread race groups over them.
 CHANNEL_LAYERS = {
     'default': {
-        'BACKEND': 'racetime.utils.RedisChannelLayer',
+        'BACKEND': 'racetime.utils.RedisPubSubChannelLayer',
         'CONFIG': {
             "hosts": [('racetime.redis', 6379)],
         },
     },
 }
 
+# The cache must be shared by the web, WebSocket and race bot processes, as
+# they clear each other's cached data and report metrics through it.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://racetime.redis:6379/1',
+    },
+}
+
 CORS_ORIGIN_ALLOW_ALL = True
 REAL_IP_HEADER = None
 
@@ -104,8 +118,35 @@ DATABASES = {
         'OPTIONS': {
             'charset': 'utf8mb4',
         },
+        # Requests each run in a new thread under ASGI, so can't keep their
+        # connections. WebSocket consumers keep theirs (see RT_DB_POOL_*).
+        'CONN_MAX_AGE': 0,
+        'CONN_HEALTH_CHECKS': True,
+    },
+}
+
+# Read replicas are added to DATABASES and listed in RT_REPLICAS. Reads for
+# public pages and APIs, and in WebSocket consumers, are sent to them.
+#
+# The "replica" alias is only used if listed in RT_REPLICAS. In tests it
+# mirrors the default database, so that routing can be tested without one.
+DATABASES['replica'] = {
+    **DATABASES['default'],
+    'TEST': {
+        'MIRROR': 'default',
     },
 }
+DATABASE_ROUTERS = ['racetime.replicas.ReplicaRouter']
+RT_REPLICAS = ()
+RT_REPLICA_STICKY_SECONDS = 10
+
+# WebSocket consumers run database work on a fixed pool of threads per
+# process, each with its own connections. Calls wait up to RT_DB_POOL_TIMEOUT
+# seconds for a thread, in a queue of at most RT_DB_POOL_QUEUE_SIZE.
+RT_DB_POOL_THREADS = 8
+RT_DB_POOL_QUEUE_SIZE = 200
+RT_DB_POOL_TIMEOUT = 10
+RT_DB_POOL_CONN_MAX_AGE = 300
 
 # Authentication
 
@@ -182,6 +223,11 @@ LOGGING = {
             'level': 'INFO',
             'propagate': False,
         },
+        'racetime.instrumentation': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
     }
 }
 
@@ -219,10 +265,42 @@ RT_SITE_INFO = {
     'extra_scripts': [],
 }
 
+# Addresses allowed to read the Prometheus metrics endpoint.
+RT_METRICS_IPS = ('127.0.0.1', '::1')
+
+# Most SQL queries a view (by URL name), WebSocket action or race bot task
+# should make. Anything over budget is logged. For example: {'race_data': 5}
+RT_QUERY_BUDGETS = {}
+
+# Most messages that may wait to be sent to one race WebSocket, and the most
+# seconds one may wait, before the client is disconnected as too slow.
+RT_WS_QUEUE_SIZE = 100
+RT_WS_SEND_TIMEOUT = 30
+
+# Compress WebSocket messages with permessage-deflate, when clients offer it.
+RT_WS_DEFLATE = True
+# Deflate window size (as a power of 2, from 9 to 15) and zlib memory level
+# (1 to 9) for each WebSocket. The zlib defaults of 15 and 8 need about 256KB
+# per connection to compress, and 14 and 4 about 72KB. Keeping the context
+# between messages only helps while the previous message fits in the window,
+# so a window too small for a typical race.data message (around 10KB) makes
+# each one several times larger once compressed.
+RT_WS_DEFLATE_WINDOW_BITS = 14
+RT_WS_DEFLATE_MEM_LEVEL = 4
+# Set to True to compress each message on its own, for example to test
+# clients that don't keep context. Compression is much worse.
+RT_WS_DEFLATE_NO_CONTEXT_TAKEOVER = False
+
 RT_CACHE_TIMEOUT = {
     'RaceListData': 30,
     'CategoryData': 60,
+    'CategoryDataFragment': 600,
     'CategoryListData': 60,
+    'CategoryRaceCount': 300,
+    'CategoryUsedSlugs': 3600,
     'RaceData': 5,
+    'RacePage': 30,
     'RaceRenders': 15,
+    'RaceRoleRenders': 60,
+    'RaceVersion': 15,
 }
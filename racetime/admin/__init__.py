@@ -171,6 +171,7 @@ class RaceAdmin(options.ModelAdmin):
         ):
             race.update_entrant_ratings()
         race.recalculate_places()
+        race.update_user_stats()
         with options.frontend_urlconf():
             race.broadcast_data()
 
@@ -238,6 +239,42 @@ class UserActionAdmin(options.ModelAdmin):
         return False
 
 
+class UserDeletionAdmin(options.ModelAdmin):
+    fields = readonly_fields = (
+        'user',
+        'email',
+        'stage',
+        'cursor',
+        'name_window',
+        'created_at',
+        'updated_at',
+        'completed_at',
+    )
+    list_display = (
+        'email',
+        'stage',
+        'created_at',
+        'updated_at',
+        'completed_at',
+    )
+    list_filter = (
+        'stage',
+    )
+    ordering = ('-created_at',)
+    search_fields = (
+        'email',
+    )
+
+    def has_add_permission(self, *args, **kwargs):
+        return False
+
+    def has_change_permission(self, *args, **kwargs):
+        return False
+
+    def has_delete_permission(self, *args, **kwargs):
+        return False
+
+
 class UserAdmin(options.ModelAdmin):
     actions = [
         'disconnect_twitch_account',
@@ -388,6 +425,7 @@ admin.site.register(models.Race, RaceAdmin)
 admin.site.register(models.Team, TeamAdmin)
 admin.site.register(models.UserAction, UserActionAdmin)
 admin.site.register(models.User, UserAdmin)
+admin.site.register(models.UserDeletion, UserDeletionAdmin)
 admin.site.site_url = settings.RT_SITE_URI
 admin.site.site_title = '%(site)s admin' % {'site': settings.RT_SITE_INFO['title']}
 admin.site.site_header = '%(site)s admin' % {'site': settings.RT_SITE_INFO['title']}
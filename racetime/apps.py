@@ -1,6 +1,6 @@
 from django.apps import AppConfig as BaseAppConfig, apps
 from django.conf import settings
-from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
 from urllib.parse import quote
 
 
@@ -16,10 +16,7 @@ class AppConfig(BaseAppConfig):
 def context_processor(request):
     Bulletin = apps.get_model('racetime', 'Bulletin')
     return {
-        'bulletins': Bulletin.objects.filter(
-            visible_from__lte=timezone.now(),
-            visible_to__gte=timezone.now(),
-        ),
+        'bulletins': SimpleLazyObject(Bulletin.objects.get_visible),
         'emotes': {},
         'login_next': request.GET.get('next', request.get_full_path),
         'site_info': settings.RT_SITE_INFO,
@@ -0,0 +1,169 @@
+"""
+Targeted cache invalidation.
+
+Models that feed cached data declare the keys they affect with a
+cache_dependencies() method, which returns a list of CacheKey tuples. When
+such a model is saved or deleted, its keys are scheduled to be cleared once
+the current transaction commits (see signals.invalidate_caches). Keys that are
+scheduled several times in one transaction are only cleared once. Each
+transaction's keys are flushed by a single on_commit callback, so if the
+transaction rolls back, they are discarded with it.
+
+A CacheKey may have a refresh function, in which case the key is written
+through with fresh data instead of being deleted. Refresh functions are
+skipped when the model instance has been deleted.
+
+Each key belongs to a family (e.g. "race_data"), which is used to keep count
+of how many keys are invalidated and refreshed. See get_metrics().
+
+All of this relies on every process using the same cache. See is_shared().
+"""
+import weakref
+from collections import Counter, namedtuple
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+from .utils import notice_exception
+
+CacheKey = namedtuple('CacheKey', ['family', 'key', 'refresh'], defaults=[None])
+
+FAMILIES = (
+    'bulletins',
+    'category_data',
+    'category_fragment',
+    'category_list',
+    'race_data',
+    'race_page',
+    'race_renders',
+    'race_summary',
+)
+
+# The pending batch of CacheKeys for each connection, see _batch.
+_batches = weakref.WeakKeyDictionary()
+
+
+def schedule(cache_keys):
+    """
+    Schedule the given CacheKeys to be invalidated (or refreshed) when the
+    current transaction commits, or immediately if there isn't one.
+    """
+    connection = transaction.get_connection()
+    batch = _batches.get(connection)
+    flush_batch = batch and batch()
+    if flush_batch is None:
+        pending = {}
+        _add(pending, cache_keys)
+        if pending:
+            flush_batch = _batch(connection, pending)
+            _batches[connection] = weakref.ref(flush_batch)
+            transaction.on_commit(flush_batch, robust=True)
+    else:
+        _add(flush_batch.cache_keys, cache_keys)
+
+
+def _add(pending, cache_keys):
+    for cache_key in cache_keys:
+        scheduled = pending.get(cache_key.key)
+        if scheduled and (scheduled.refresh or not cache_key.refresh):
+            # Keep any refresh function already scheduled for this key.
+            continue
+        pending[cache_key.key] = cache_key
+
+
+def _batch(connection, pending):
+    """
+    Return an on_commit callback that flushes the given dict of pending
+    CacheKeys.
+
+    Only Django keeps hold of the callback, so when it is discarded by a
+    rollback the weak reference to it in _batches dies too, and the next key
+    scheduled on the connection starts a new batch. Keys scheduled in a
+    savepoint that is later rolled back may still be in a batch that
+    commits; clearing them is harmless, as refreshes read from the database.
+    """
+    def flush_batch():
+        # Stop any more keys being added to this batch once it has run.
+        _batches.pop(connection, None)
+        flush(pending.values())
+    flush_batch.cache_keys = pending
+    return flush_batch
+
+
+def flush(cache_keys):
+    """
+    Invalidate or refresh the given CacheKeys.
+
+    Refreshes are done first, so that composed data (e.g. category data)
+    cannot be rebuilt from stale parts after it has been deleted.
+    """
+    cache_keys = list(cache_keys)
+    if not cache_keys:
+        return
+
+    invalidated = Counter()
+    refreshed = Counter()
+    to_delete = []
+    for cache_key in cache_keys:
+        if cache_key.refresh:
+            try:
+                cache_key.refresh()
+            except Exception as ex:
+                notice_exception(ex)
+                to_delete.append(cache_key.key)
+                invalidated[cache_key.family] += 1
+            else:
+                refreshed[cache_key.family] += 1
+        else:
+            to_delete.append(cache_key.key)
+            invalidated[cache_key.family] += 1
+    cache.delete_many(to_delete)
+
+    _count('invalidated', invalidated)
+    _count('refreshed', refreshed)
+
+
+def is_shared():
+    """
+    Return False if the cache is private to this process, so that nothing
+    written to it can be seen by (or cleared for) any other process.
+    """
+    return not isinstance(caches['default'], (DummyCache, LocMemCache))
+
+
+def _count(action, counter):
+    for family, value in counter.items():
+        key = 'cache_metrics/%s/%s' % (family, action)
+        try:
+            cache.incr(key, value)
+        except ValueError:
+            cache.set(key, value, None)
+
+
+def get_metrics():
+    """
+    Return a dict of invalidation and refresh counts for each key family.
+    """
+    keys = {
+        (family, action): 'cache_metrics/%s/%s' % (family, action)
+        for family in FAMILIES
+        for action in ('invalidated', 'refreshed')
+    }
+    values = cache.get_many(keys.values())
+    metrics = {}
+    for (family, action), key in keys.items():
+        metrics.setdefault(family, {})[action] = values.get(key, 0)
+    return metrics
+
+
+def reset_metrics():
+    """
+    Reset all invalidation and refresh counts to zero.
+    """
+    cache.delete_many([
+        'cache_metrics/%s/%s' % (family, action)
+        for family in FAMILIES
+        for action in ('invalidated', 'refreshed')
+    ])
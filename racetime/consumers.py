@@ -1,17 +1,26 @@
+import asyncio
 import json
+import logging
+from collections import deque
+from time import monotonic
+from urllib.parse import parse_qs
 
-from channels.db import database_sync_to_async
+import msgpack
 from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
 from django.core.serializers.json import DjangoJSONEncoder
 from django.template.loader import render_to_string
 from django.utils import timezone
 from oauth2_provider.settings import oauth2_settings
 from websockets import ConnectionClosed
 
-from . import race_actions, race_bot_actions
+from . import instrumentation, race_actions, race_bot_actions, replicas
+from .dbpool import PoolBusy, database_sync_to_async
 from .models import Bot, Category, Race, Message
 from .utils import SafeException, exception_to_msglist, get_chat_history, get_hashids, get_action_button
 
+logger = logging.getLogger('racetime.consumers')
+
 
 class OAuthConsumerMixin:
     """
@@ -22,6 +31,7 @@ class OAuthConsumerMixin:
     scope = NotImplemented
 
     @database_sync_to_async
+    @instrumentation.measured('consumer')
     def get_oauth_state(self, scopes=None):
         """
         Try and authenticate the user using their OAuth2 token.
@@ -47,12 +57,69 @@ class OAuthConsumerMixin:
 
 
 class RaceConsumer(AsyncWebsocketConsumer):
+    """
+    Race room WebSocket.
+
+    Outgoing messages are queued and sent by a separate writer task, so a
+    slow client never holds up this consumer reading from the channel layer.
+    Only the latest race.data and race.renders are worth sending, so a new
+    one replaces any still waiting in the queue. Clients that fall behind by
+    more than RT_WS_QUEUE_SIZE messages or RT_WS_SEND_TIMEOUT seconds are
+    disconnected (with close code 4013), and may reconnect to get the
+    current state.
+
+    Clients may pick which broadcasts they receive, either with a "channels"
+    query parameter (e.g. ?channels=data,chat) or a subscribe action.
+    Replies to the client's own requests, and errors, are always sent.
+
+    Messages are JSON text frames by default. With ?format=msgpack they are
+    sent as MessagePack binary frames instead, and binary frames from the
+    client are read as MessagePack.
+    """
+    encodings = ('json', 'msgpack')
+    json_encoder = DjangoJSONEncoder()
+    collapsible_types = ('race.data', 'race.renders')
+    # Broadcast message types, by the subscription channel they belong to.
+    subscription_channels = {
+        'chat': ('chat.message', 'chat.delete', 'chat.purge', 'chat.pin', 'chat.unpin'),
+        'data': ('race.data',),
+        'dms': ('chat.dm',),
+        'renders': ('race.renders',),
+        'splits': ('race.split',),
+    }
+    message_channels = {
+        message_type: channel
+        for channel, message_types in subscription_channels.items()
+        for message_type in message_types
+    }
+    default_subscriptions = ('chat', 'data', 'dms', 'renders', 'splits')
+    # Close code telling a dropped client to reconnect later. Autobahn won't
+    # send 1013 (try again later), so this is its private-range equivalent.
+    try_again_code = 4013
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.state = {}
+        self.outbox = deque()
+        self.outbox_ready = asyncio.Event()
+        self.writer = None
+        self.dropped = False
+        self.subscriptions = set(self.default_subscriptions)
+        self.encoding = 'json'
 
     async def connect(self):
-        await self.load_race()
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        if query.get('channels'):
+            self.subscriptions = set(query['channels'][0].split(',')) & set(self.subscription_channels)
+        if query.get('format', [None])[0] in self.encodings:
+            self.encoding = query['format'][0]
+
+        try:
+            await self.load_race()
+        except PoolBusy:
+            # Not yet accepted, so this rejects the connection.
+            await self.close()
+            return
 
         if self.state.get('race_slug'):
             await self.channel_layer.group_add(self.state.get('race_slug'), self.channel_name)
@@ -60,48 +127,187 @@ class RaceConsumer(AsyncWebsocketConsumer):
             await self.send_race()
 
     async def disconnect(self, close_code):
+        if self.writer:
+            self.writer.cancel()
         if self.state.get('race_slug'):
             await self.channel_layer.group_discard(self.state.get('race_slug'), self.channel_name)
 
     async def receive(self, text_data=None, bytes_data=None):
         try:
-            message_data = json.loads(text_data)
-        except json.JSONDecodeError:
+            message_data = self.decode(text_data, bytes_data)
+        except (TypeError, ValueError):
             await self.whoops(
                 'Unable to process that message (encountered invalid or '
                 'possibly corrupted data). Sorry about that.'
             )
         else:
-            action = message_data.get('action')
-
-            if action == 'ping':
-                await self.pong()
-            elif action == 'getrace':
-                await self.send_race()
-            elif action == 'gethistory':
-                last_message_id = None
-                hashid = message_data.get('data', {}).get('last_message')
-                if hashid:
-                    try:
-                        last_message_id, = get_hashids(Message).decode(hashid)
-                    except ValueError:
-                        pass
-                await self.send_chat_history(last_message_id)
-            else:
-                await self.do_receive(message_data)
+            try:
+                await self.handle_action(message_data)
+            except PoolBusy as ex:
+                await self.whoops(*exception_to_msglist(ex))
+
+    async def handle_action(self, message_data):
+        action = message_data.get('action')
+
+        if action == 'ping':
+            await self.pong()
+        elif action == 'getrace':
+            await self.send_race()
+        elif action == 'getsplits':
+            await self.send_splits()
+        elif action == 'subscribe':
+            await self.subscribe(message_data.get('data', {}).get('channels'))
+        elif action == 'gethistory':
+            last_message_id = None
+            hashid = message_data.get('data', {}).get('last_message')
+            if hashid:
+                try:
+                    last_message_id, = get_hashids(Message).decode(hashid)
+                except ValueError:
+                    pass
+            await self.send_chat_history(last_message_id)
+        else:
+            await self.do_receive(message_data)
 
     async def do_receive(self, message_data):
         pass
 
     async def deliver(self, event_type, **kwargs):
+        """
+        Queue a message to be sent to the client.
+        """
+        if self.dropped:
+            return
+        if event_type in self.collapsible_types:
+            for queued in self.outbox:
+                if queued[1]['type'] == event_type:
+                    self.outbox.remove(queued)
+                    instrumentation.record('websocket', 'collapsed')
+                    break
+        if len(self.outbox) >= settings.RT_WS_QUEUE_SIZE:
+            await self.drop_slow_client()
+            return
+
+        self.outbox.append((monotonic(), {
+            'type': event_type,
+            'date': timezone.now().isoformat(),
+            **kwargs,
+        }))
+        if not self.writer:
+            self.writer = asyncio.create_task(self.write_outbox())
+        self.outbox_ready.set()
+
+    async def broadcast(self, message_type, **kwargs):
+        """
+        Deliver a broadcast message, if the client is subscribed to it.
+        """
+        if self.is_subscribed(message_type):
+            await self.deliver(message_type, **kwargs)
+
+    def is_subscribed(self, message_type):
+        return self.message_channels.get(message_type) in self.subscriptions
+
+    async def subscribe(self, channels):
+        """
+        Change which broadcasts the client receives. The current race data
+        and renders are sent straight away if newly subscribed to.
+        """
+        if not isinstance(channels, list) or not all(
+            isinstance(channel, str) and channel in self.subscription_channels
+            for channel in channels
+        ):
+            await self.whoops(
+                'Subscribe to a list of channels from: %s.'
+                % ', '.join(sorted(self.subscription_channels))
+            )
+            return
+        added = set(channels) - self.subscriptions
+        self.subscriptions = set(channels)
+        await self.deliver('subscribed', channels=sorted(self.subscriptions))
+        if added & {'data', 'renders'}:
+            await self.send_race()
+
+    async def write_outbox(self):
+        """
+        Send queued messages to the client, for as long as it is connected.
+
+        Each message waits until the client's send buffer has drained (see
+        racetime.server), so a slow client's messages back up in the outbox,
+        where they may be collapsed or the client dropped, rather than in the
+        server's transport buffer.
+        """
         try:
-            await self.send(text_data=json.dumps({
-                'type': event_type,
-                'date': timezone.now().isoformat(),
-                **kwargs,
-            }, cls=DjangoJSONEncoder))
-        except ConnectionClosed as ex:
-            await self.websocket_disconnect({'code': ex.code})
+            while True:
+                await self.outbox_ready.wait()
+                self.outbox_ready.clear()
+                while self.outbox and not self.dropped:
+                    queued_at = self.outbox[0][0]
+                    timeout = settings.RT_WS_SEND_TIMEOUT - (monotonic() - queued_at)
+                    try:
+                        if timeout <= 0:
+                            raise asyncio.TimeoutError
+                        await asyncio.wait_for(self.send_buffer_drained(), timeout)
+                    except asyncio.TimeoutError:
+                        await self.drop_slow_client()
+                        return
+                    if not self.outbox or self.dropped:
+                        break
+                    queued_at, message = self.outbox.popleft()
+                    try:
+                        text_data, bytes_data = self.encode(message)
+                    except (TypeError, ValueError):
+                        logger.exception('Unable to encode %s message.', message['type'])
+                        instrumentation.record('websocket', 'encode_error')
+                        continue
+                    instrumentation.record('delivery', message['type'], payload=len(text_data or bytes_data))
+                    try:
+                        await self.send(text_data=text_data, bytes_data=bytes_data)
+                    except ConnectionClosed:
+                        # The server will tell this consumer it has disconnected.
+                        self.outbox.clear()
+                        return
+        finally:
+            self.writer = None
+
+    async def send_buffer_drained(self):
+        """
+        Wait until the client's connection can take more data, if the server
+        says when it can't.
+        """
+        send_buffer = self.scope.get('extensions', {}).get('racetime.send_buffer')
+        if send_buffer:
+            await send_buffer.writable.wait()
+
+    def encode(self, message):
+        """
+        Encode a message in the client's chosen format, returning a
+        (text_data, bytes_data) tuple to send.
+        """
+        if self.encoding == 'msgpack':
+            return None, msgpack.packb(message, default=self.json_encoder.default)
+        return self.json_encoder.encode(message), None
+
+    def decode(self, text_data, bytes_data):
+        """
+        Decode a message received from the client.
+        """
+        if bytes_data is not None and self.encoding == 'msgpack':
+            return msgpack.unpackb(bytes_data)
+        return json.loads(text_data if text_data is not None else bytes_data)
+
+    async def drop_slow_client(self):
+        """
+        Discard queued messages and close the connection to a client that
+        can't keep up.
+        """
+        if self.dropped:
+            return
+        for _ in self.outbox:
+            instrumentation.record('websocket', 'dropped')
+        instrumentation.record('websocket', 'slow_disconnect')
+        self.outbox.clear()
+        self.dropped = True
+        await self.close(code=self.try_again_code)
 
     async def whoops(self, *errors):
         await self.deliver('error', errors=errors)
@@ -110,42 +316,54 @@ class RaceConsumer(AsyncWebsocketConsumer):
         """
         Handler for chat.delete type event.
         """
-        await self.deliver(event['type'], delete=event['delete'])
+        await self.broadcast(event['type'], delete=event['delete'])
 
     async def chat_purge(self, event):
         """
         Handler for chat.purge type event.
         """
-        await self.deliver(event['type'], purge=event['purge'])
+        await self.broadcast(event['type'], purge=event['purge'])
 
     async def chat_message(self, event):
         """
         Handler for chat.message type event.
         """
-        await self.deliver(event['type'], message=event['message'])
+        await self.broadcast(event['type'], message=event['message'])
 
     async def chat_dm(self, event):
         """
         Handler for chat.dm type event.
         """
-        await self.deliver(event['type'], **{
+        await self.broadcast(event['type'], **{
             'message': event['message'],
             'from_user': event['from_user'],
             'from_bot': event['from_bot'],
             'to': event['to'],
         })
 
+    async def chat_dms(self, event):
+        """
+        Handler for chat.dms type event.
+
+        DMs are broadcast in batches, but delivered to the client one at a
+        time as chat.dm messages.
+        """
+        if not self.is_subscribed('chat.dm'):
+            return
+        for message in event['messages']:
+            await self.deliver('chat.dm', **message)
+
     async def chat_pin(self, event):
         """
         Handler for chat.pin type event.
         """
-        await self.deliver(event['type'], message=event['message'])
+        await self.broadcast(event['type'], message=event['message'])
 
     async def chat_unpin(self, event):
         """
         Handler for chat.unpin type event.
         """
-        await self.deliver(event['type'], message=event['message'])
+        await self.broadcast(event['type'], message=event['message'])
 
     async def error(self, event):
         """
@@ -164,29 +382,46 @@ class RaceConsumer(AsyncWebsocketConsumer):
         self.state['race_renders'] = event['renders']
         self.state['race_version'] = event['version']
 
-        await self.deliver('race.data', race=event['race'], version=event['version'])
-        await self.deliver('race.renders', renders=event['renders'], version=event['version'])
+        await self.broadcast('race.data', race=event['race'], version=event['version'])
+        await self.broadcast('race.renders', renders=event['renders'], version=event['version'])
 
-    async def race_split(self, event):
-        await self.deliver(event['type'], split=event['split'])
+    async def race_splits(self, event):
+        """
+        Handler for race.splits type event.
+
+        Splits are broadcast in batches, but delivered to the client one at a
+        time as race.split messages.
+        """
+        if not self.is_subscribed('race.split'):
+            return
+        for split in event['splits']:
+            await self.deliver('race.split', split=split)
 
     async def send_race(self):
         """
-        Send pre-loaded race data (assuming we have it).
+        Send pre-loaded race data and renders (assuming we have them), as
+        subscribed to.
         """
         if self.state.get('race_dict'):
-            await self.deliver(
+            await self.broadcast(
                 'race.data',
                 race=self.state.get('race_dict'),
                 version=self.state.get('race_version'),
             )
         if self.state.get('race_renders'):
-            await self.deliver(
+            await self.broadcast(
                 'race.renders',
                 renders=self.state.get('race_renders'),
                 version=self.state.get('race_version'),
             )
 
+    async def send_splits(self):
+        """
+        Send all splits recorded so far in this race.
+        """
+        splits = await self.get_splits()
+        await self.deliver('race.splits', splits=splits)
+
     async def send_chat_history(self, last_message_id=None):
         messages = await self.get_chat_history(last_message_id)
         await self.deliver('chat.history', messages=messages)
@@ -198,38 +433,62 @@ class RaceConsumer(AsyncWebsocketConsumer):
         """
         if not self.state.get('race_slug'):
             return
-        action = action_class()
-        race = Race.objects.get(
-            slug=self.state.get('race_slug'),
-            category__slug=self.state.get('category_slug'),
-        )
-        action.action(race, user, data)
+        with instrumentation.measure('consumer', action_class.__name__):
+            action = action_class()
+            race = Race.objects.get(
+                slug=self.state.get('race_slug'),
+                category__slug=self.state.get('category_slug'),
+            )
+            action.action(race, user, data)
+        if not isinstance(user, Bot):
+            replicas.stick_to_primary(user.id)
 
     @database_sync_to_async
+    @instrumentation.measured('consumer')
     def get_chat_history(self, last_message_id=None):
         user = self.scope.get('user') if self.scope.get('user').is_authenticated else None
-        return list(get_chat_history(self.state.get('race_id'), user, last_message_id).values())
+        with self.replica_reads():
+            return list(get_chat_history(self.state.get('race_id'), user, last_message_id).values())
+
+    @database_sync_to_async
+    @instrumentation.measured('consumer')
+    def get_splits(self):
+        with self.replica_reads():
+            race = Race.objects.get(id=self.state.get('race_id'))
+            return [split.as_dict() for split in race.get_splits()]
 
     @database_sync_to_async
+    @instrumentation.measured('consumer')
     def load_race(self):
         """
         Load race information from the DB.
         """
-        race = Race.objects.filter(
-            slug=self.scope['url_route']['kwargs']['race'],
-        ).order_by('-opened_at').first()
-        if race is None:
-            self.state = {}
-        else:
-            self.state['category_slug'] = race.category.slug
-            self.state['race_id'] = race.id
-            self.state['race_dict'] = race.as_dict
-            self.state['race_renders'] = race.get_renders_stateless()
-            self.state['race_slug'] = race.slug
-            self.state['race_version'] = race.version
+        with self.replica_reads():
+            race = Race.objects.filter(
+                slug=self.scope['url_route']['kwargs']['race'],
+            ).order_by('-opened_at').first()
+            if race is None:
+                self.state = {}
+            else:
+                self.state['category_slug'] = race.category.slug
+                self.state['race_id'] = race.id
+                self.state['race_dict'] = race.as_dict
+                self.state['race_renders'] = race.get_renders_stateless()
+                self.state['race_slug'] = race.slug
+                self.state['race_version'] = race.version
+
+    def replica_reads(self):
+        """
+        Read from a replica, unless the connected user has written recently.
+        """
+        user = self.scope.get('user')
+        return replicas.replica_reads(user.id if user and user.is_authenticated else None)
 
 
 class OauthRaceConsumer(RaceConsumer, OAuthConsumerMixin):
+    # HTML renders are only sent to clients that ask for them.
+    default_subscriptions = ('chat', 'data', 'dms', 'splits')
+
     def parse_data(self, message_data):
         """
         Read incoming data and process it so we know what to do.
@@ -282,16 +541,20 @@ class OauthRaceConsumer(RaceConsumer, OAuthConsumerMixin):
                 await self.whoops(*exception_to_msglist(ex))
 
     @database_sync_to_async
+    @instrumentation.measured('consumer')
     def get_user_summary(self, user):
         category_slug = self.state.get('category_slug')
-        if category_slug:
-            category = Category.objects.get(slug=category_slug)
-        else:
-            category = None
-        return user.api_dict_summary(category=category)
+        with replicas.replica_reads(user.id):
+            if category_slug:
+                category = Category.objects.get(slug=category_slug)
+            else:
+                category = None
+            return user.api_dict_summary(category=category)
 
 
 class BotRaceConsumer(RaceConsumer, OAuthConsumerMixin):
+    default_subscriptions = ('chat', 'data', 'dms', 'splits')
+
     def parse_data(self, message_data):
         """
         Read incoming data and process it so we know what to do.
@@ -324,6 +587,7 @@ class BotRaceConsumer(RaceConsumer, OAuthConsumerMixin):
                 await self.whoops(*exception_to_msglist(ex))
 
     @database_sync_to_async
+    @instrumentation.measured('consumer')
     def get_bot(self, application):
         """
         Returns the Bot object associated to the given OAuth2 application, if
@@ -0,0 +1,202 @@
+"""
+A bounded pool of threads for database work done by WebSocket consumers.
+
+channels' database_sync_to_async runs every call on one shared thread, and
+with connections closed after each call (CONN_MAX_AGE = 0, as requests need
+under ASGI) every call opens a new one. Calls wrapped with this module's
+database_sync_to_async instead run on a fixed set of RT_DB_POOL_THREADS
+threads, each keeping its connections open for RT_DB_POOL_CONN_MAX_AGE
+seconds. Each WebSocket process therefore holds at most RT_DB_POOL_THREADS
+connections per database for its consumers.
+
+When every thread is busy, calls wait for one to come free. Calls that wait
+longer than RT_DB_POOL_TIMEOUT seconds, or would join a queue that already
+has RT_DB_POOL_QUEUE_SIZE calls in it, fail with PoolBusy rather than piling
+up.
+
+Each process publishes its pool usage to the cache (see get_stats() and
+views.Metrics), and counts calls that were queued, timed out or rejected as
+("dbpool", ...) instrumentation.
+
+Settings:
+    RT_DB_POOL_THREADS: number of threads, and so connections per database.
+    RT_DB_POOL_QUEUE_SIZE: most calls that may wait for a thread.
+    RT_DB_POOL_TIMEOUT: seconds a call may wait for a thread.
+    RT_DB_POOL_CONN_MAX_AGE: seconds a pool thread keeps a connection open.
+"""
+import asyncio
+import os
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from time import monotonic
+
+from channels.db import DatabaseSyncToAsync
+from django.conf import settings
+from django.core.cache import cache
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from . import instrumentation
+from .utils import SafeException
+
+PUBLISH_INTERVAL = 10
+PIDS_KEY = 'dbpool/pids'
+
+_thread = threading.local()
+
+
+class PoolBusy(SafeException):
+    """
+    Raised when no database thread came free in time.
+    """
+    def __init__(self):
+        super().__init__('The server is busy right now. Please try again in a moment.')
+
+
+class DatabasePool:
+    """
+    The threads that run consumer database work in this process, and how
+    busy they are.
+
+    Counts are only changed from the event loop, so need no locking.
+    """
+    def __init__(self):
+        self.pid = os.getpid()
+        self.executor = None
+        self.semaphores = weakref.WeakKeyDictionary()
+        self.busy = 0
+        self.waiting = 0
+        self.reset_peaks()
+        self.last_publish = None
+
+    def reset_peaks(self):
+        self.peak_busy = self.busy
+        self.peak_waiting = self.waiting
+        self.max_wait = 0.0
+
+    def get_executor(self):
+        if not self.executor:
+            self.executor = ThreadPoolExecutor(
+                max_workers=settings.RT_DB_POOL_THREADS,
+                thread_name_prefix='dbpool',
+                initializer=_mark_pool_thread,
+            )
+        return self.executor
+
+    def get_semaphore(self):
+        loop = asyncio.get_running_loop()
+        if loop not in self.semaphores:
+            self.semaphores[loop] = asyncio.Semaphore(settings.RT_DB_POOL_THREADS)
+        return self.semaphores[loop]
+
+    @asynccontextmanager
+    async def thread(self):
+        """
+        Wait for a thread to come free, and keep it for the block.
+        """
+        semaphore = self.get_semaphore()
+        if semaphore.locked():
+            if self.waiting >= settings.RT_DB_POOL_QUEUE_SIZE:
+                instrumentation.record('dbpool', 'rejected')
+                raise PoolBusy
+            instrumentation.record('dbpool', 'queued')
+            self.waiting += 1
+            self.peak_waiting = max(self.peak_waiting, self.waiting)
+            start = monotonic()
+            try:
+                await asyncio.wait_for(semaphore.acquire(), settings.RT_DB_POOL_TIMEOUT)
+            except asyncio.TimeoutError:
+                instrumentation.record('dbpool', 'timeout')
+                raise PoolBusy
+            finally:
+                self.waiting -= 1
+                self.max_wait = max(self.max_wait, monotonic() - start)
+        else:
+            await semaphore.acquire()
+
+        self.busy += 1
+        self.peak_busy = max(self.peak_busy, self.busy)
+        try:
+            yield
+        finally:
+            self.busy -= 1
+            semaphore.release()
+            self.publish()
+
+    def publish(self):
+        """
+        Write this process's pool usage to the cache in a thread, if due.
+        Peaks are since the last time it was published.
+        """
+        now = monotonic()
+        if self.last_publish and now - self.last_publish < PUBLISH_INTERVAL:
+            return
+        self.last_publish = now
+        stats = {
+            'pid': self.pid,
+            'threads': settings.RT_DB_POOL_THREADS,
+            'busy': self.busy,
+            'waiting': self.waiting,
+            'peak_busy': self.peak_busy,
+            'peak_waiting': self.peak_waiting,
+            'max_wait': self.max_wait,
+        }
+        self.reset_peaks()
+        # Keep cache calls off the event loop, and out of the pool's threads.
+        asyncio.get_running_loop().run_in_executor(None, self.write_stats, stats)
+
+    def write_stats(self, stats):
+        cache.set(_key(self.pid), stats, PUBLISH_INTERVAL * 6)
+        pids = cache.get(PIDS_KEY, [])
+        if self.pid not in pids:
+            cache.set(PIDS_KEY, pids + [self.pid], None)
+
+
+pool = DatabasePool()
+
+
+class PooledDatabaseSyncToAsync(DatabaseSyncToAsync):
+    """
+    DatabaseSyncToAsync version that runs on the consumer database pool.
+    """
+    def __init__(self, func):
+        super().__init__(func, thread_sensitive=False, executor=pool.get_executor())
+
+    async def __call__(self, *args, **kwargs):
+        async with pool.thread():
+            return await super().__call__(*args, **kwargs)
+
+
+database_sync_to_async = PooledDatabaseSyncToAsync
+
+
+def get_stats():
+    """
+    Return a list of the pool usage last published by each running process.
+    """
+    pids = cache.get(PIDS_KEY, [])
+    stats = cache.get_many([_key(pid) for pid in pids])
+    running = [pid for pid in pids if _key(pid) in stats]
+    if running != pids:
+        cache.set(PIDS_KEY, running, None)
+    return [stats[_key(pid)] for pid in running]
+
+
+@receiver(connection_created)
+def keep_pool_connection(sender, connection, **kwargs):
+    """
+    Keep connections opened by pool threads for RT_DB_POOL_CONN_MAX_AGE
+    seconds. Django's own handling still closes them sooner if they break.
+    """
+    if getattr(_thread, 'pooled', False):
+        connection.close_at = monotonic() + settings.RT_DB_POOL_CONN_MAX_AGE
+
+
+def _mark_pool_thread():
+    _thread.pooled = True
+
+
+def _key(pid):
+    return 'dbpool/stats/%d' % pid
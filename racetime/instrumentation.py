@@ -0,0 +1,215 @@
+"""
+Always-on measurement of what requests, WebSocket actions and race bot work
+cost.
+
+Work is measured in a measure() block, which counts the queries made and time
+spent in the database, plus any template render time and payload bytes
+reported inside it. Totals are kept per (kind, name) pair, e.g. ("view",
+"race_data") or ("consumer", "Ready"), and are added to the cache every
+FLUSH_INTERVAL seconds, so that the web, WebSocket and race bot processes can
+all be reported together (see get_metrics() and views.Metrics).
+
+Settings:
+    RT_QUERY_BUDGETS: dict of name to the most queries one call of it should
+        make. Calls that go over budget are logged and counted.
+"""
+import asyncio
+import functools
+import logging
+import threading
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+from time import monotonic, perf_counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+logger = logging.getLogger('racetime.instrumentation')
+
+# Totals kept for each (kind, name). Times are kept in microseconds so they
+# can be incremented in the cache.
+FIELDS = ('calls', 'queries', 'db_us', 'render_us', 'bytes', 'over_budget')
+FLUSH_INTERVAL = 10
+NAMES_KEY = 'instrumentation/names'
+
+_lock = threading.Lock()
+_totals = defaultdict(lambda: dict.fromkeys(FIELDS, 0))
+_known_names = set()
+_last_flush = monotonic()
+_local = threading.local()
+
+
+class Measurement:
+    """
+    The cost of one measured block. Installed as a database execute wrapper
+    to count queries.
+
+    The name may be changed inside the block, e.g. once a request's view is
+    known.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.queries = 0
+        self.db_time = 0.0
+        self.render_time = 0.0
+        self.payload = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_time += perf_counter() - start
+
+
+@contextmanager
+def measure(kind, name):
+    """
+    Measure the block, recording its cost against the given kind and name.
+
+    Only queries made from the current thread are counted, so for async code
+    this must be used inside the sync function run by database_sync_to_async.
+    """
+    measurement = Measurement(name)
+    outer = getattr(_local, 'measurement', None)
+    _local.measurement = measurement
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(measurement))
+            yield measurement
+    finally:
+        _local.measurement = outer
+        record(kind, measurement.name, measurement)
+
+
+def measured(kind, name=None):
+    """
+    Decorator version of measure(), using the function name by default.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with measure(kind, name or func.__name__):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def rendering():
+    """
+    Count the block as template render time in the current measurement.
+    """
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        add_render_time(perf_counter() - start)
+
+
+def add_render_time(seconds):
+    """
+    Add template render time to the current measurement, if there is one.
+    """
+    measurement = getattr(_local, 'measurement', None)
+    if measurement:
+        measurement.render_time += seconds
+
+
+def record(kind, name, measurement=None, payload=0):
+    """
+    Add a call to the totals for the given kind and name.
+
+    Payload bytes may be given by themselves (e.g. for messages sent to a
+    WebSocket) instead of a Measurement. When called from async code, any
+    flush that is due is run in a thread.
+    """
+    global _last_flush
+    over_budget = False
+    if measurement:
+        payload += measurement.payload
+        budget = settings.RT_QUERY_BUDGETS.get(name)
+        if budget is not None and measurement.queries > budget:
+            over_budget = True
+            logger.warning(
+                '%(kind)s %(name)s made %(queries)d queries (budget is %(budget)d).'
+                % {'kind': kind, 'name': name, 'queries': measurement.queries, 'budget': budget}
+            )
+
+    with _lock:
+        totals = _totals[kind, name]
+        totals['calls'] += 1
+        totals['bytes'] += payload
+        if measurement:
+            totals['queries'] += measurement.queries
+            totals['db_us'] += round(measurement.db_time * 1_000_000)
+            totals['render_us'] += round(measurement.render_time * 1_000_000)
+        totals['over_budget'] += over_budget
+        due = monotonic() - _last_flush >= FLUSH_INTERVAL
+        if due:
+            _last_flush = monotonic()
+    if due:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            flush()
+        else:
+            # Keep cache calls off the event loop.
+            loop.run_in_executor(None, flush)
+
+
+def flush():
+    """
+    Add the totals collected by this process to the cache, and reset them.
+    """
+    global _last_flush
+    with _lock:
+        totals = dict(_totals)
+        _totals.clear()
+        _last_flush = monotonic()
+        _known_names.update(totals)
+        known_names = set(_known_names)
+    if not totals:
+        return
+
+    # Another process may have written the list of names at the same time
+    # and lost some, so put back any this process knows about.
+    names = set(map(tuple, cache.get(NAMES_KEY, [])))
+    if not known_names <= names:
+        cache.set(NAMES_KEY, sorted(names | known_names), None)
+
+    for (kind, name), values in totals.items():
+        for field, value in values.items():
+            if not value:
+                continue
+            key = _key(kind, name, field)
+            try:
+                cache.incr(key, value)
+            except ValueError:
+                cache.set(key, value, None)
+
+
+def get_metrics():
+    """
+    Return a dict of (kind, name) to totals for everything measured so far.
+    """
+    names = [tuple(name) for name in cache.get(NAMES_KEY, [])]
+    values = cache.get_many([
+        _key(kind, name, field)
+        for kind, name in names
+        for field in FIELDS
+    ])
+    return {
+        (kind, name): {
+            field: values.get(_key(kind, name, field), 0)
+            for field in FIELDS
+        }
+        for kind, name in names
+    }
+
+
+def _key(kind, name, field):
+    return 'instrumentation/%s/%s/%s' % (kind, name, field)
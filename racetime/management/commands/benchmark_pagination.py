@@ -0,0 +1,68 @@
+from statistics import median
+from time import perf_counter
+
+from django.core.management import BaseCommand
+
+from ... import models
+from ...utils import KeysetPaginator
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the time taken to fetch past race pages of a category by '
+        'page number (OFFSET) and by cursor (keyset) at increasing depths.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'category',
+        )
+        parser.add_argument(
+            '--per-page', type=int, default=10,
+            help='Number of races per page (default: 10).',
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help='Number of times to fetch each page (default: 5).',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            category = models.Category.objects.get(slug=options['category'])
+        except models.Category.DoesNotExist:
+            self.stderr.write('Could not find category with slug "%s"' % options['category'])
+            return
+
+        queryset = category.race_set.filter(
+            state=models.RaceStates.finished.value,
+            unlisted=False,
+        ).order_by('-ended_at', '-id')
+        paginator = KeysetPaginator(queryset, options['per_page'])
+        self.stdout.write(
+            '%s: %d races, %d pages.'
+            % (category.short_name, paginator.count, paginator.num_pages)
+        )
+
+        self.stdout.write('%8s %12s %12s' % ('page', 'offset (ms)', 'cursor (ms)'))
+        number = 1
+        while number <= paginator.num_pages:
+            if number > 1:
+                previous = paginator.page(number - 1)
+                cursor = paginator.next_cursor(previous)
+            else:
+                cursor = None
+            offset_time = self.time(lambda: list(paginator.page(number).object_list), options['repeat'])
+            cursor_time = self.time(lambda: paginator.cursor_page(cursor), options['repeat'])
+            self.stdout.write('%8d %12.2f %12.2f' % (number, offset_time, cursor_time))
+            number *= 10
+
+    def time(self, func, repeat):
+        """
+        Return the median time taken to call func, in milliseconds.
+        """
+        timings = []
+        for _ in range(repeat):
+            start = perf_counter()
+            func()
+            timings.append((perf_counter() - start) * 1000)
+        return median(timings)
@@ -0,0 +1,26 @@
+from django.core.management import BaseCommand
+
+from ... import caching
+
+
+class Command(BaseCommand):
+    help = 'Show how many cache keys have been invalidated or refreshed, per key family.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset', action='store_true', dest='reset',
+            help='Reset all counts to zero after showing them.',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write('%-20s %12s %12s' % ('family', 'invalidated', 'refreshed'))
+        for family, counts in caching.get_metrics().items():
+            self.stdout.write('%-20s %12d %12d' % (
+                family,
+                counts['invalidated'],
+                counts['refreshed'],
+            ))
+
+        if options['reset']:
+            caching.reset_metrics()
+            self.stdout.write('Counts have been reset.')
@@ -0,0 +1,248 @@
+import asyncio
+import json
+import random
+import secrets
+from collections import Counter, defaultdict
+from datetime import timedelta
+from statistics import quantiles
+from time import perf_counter
+from urllib.parse import urlsplit
+from uuid import uuid4
+
+import requests
+import websockets
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.utils import timezone
+from oauth2_provider.models import AccessToken, Application
+
+from ... import models
+
+
+class LoadTest:
+    """
+    Drives a race room on a running server through many WebSocket
+    connections, while polling its HTTP endpoints.
+
+    Each client authenticates as a different user, joins the race, readies
+    up, chats every so often and finally sends .done. Timings are collected
+    in milliseconds.
+    """
+    def __init__(self, base_url, race, tokens, options):
+        self.base_url = base_url.rstrip('/')
+        split = urlsplit(self.base_url)
+        self.ws_url = '%s://%s%s' % (
+            'wss' if split.scheme == 'https' else 'ws',
+            split.netloc,
+            race.get_ws_oauth_url(),
+        )
+        self.paths = {
+            'race page': race.get_absolute_url(),
+            'race data': race.get_data_url(),
+            'race renders': race.get_renders_url(),
+            'category data': race.category.get_data_url(),
+        }
+        self.tokens = tokens
+        self.options = options
+        self.rng = random.Random(options['seed'])
+        self.sent = {}
+        self.timings = defaultdict(list)
+        self.received = Counter()
+        self.errors = Counter()
+        self.end = None
+
+    async def run(self):
+        self.end = perf_counter() + self.options['duration']
+        tasks = [
+            self.client(index, token)
+            for index, token in enumerate(self.tokens)
+        ] + [
+            self.poll(name, path)
+            for name, path in self.paths.items()
+            for _ in range(self.options['pollers'])
+        ]
+        await asyncio.gather(*tasks)
+
+    async def client(self, index, token):
+        await asyncio.sleep(index / self.options['connect_rate'])
+        start = perf_counter()
+        try:
+            async with websockets.connect(self.ws_url, max_size=None, open_timeout=60) as ws:
+                self.timings['ws connect'].append((perf_counter() - start) * 1000)
+                receiver = asyncio.create_task(self.receive(ws))
+                await self.send(ws, 'authenticate', oauth_token=token)
+                await self.send(ws, 'join')
+                await asyncio.sleep(self.rng.uniform(0, 1))
+                await self.send(ws, 'ready')
+
+                sent = 0
+                while True:
+                    delay = self.rng.uniform(0.5, 1.5) * self.options['chat_interval']
+                    if perf_counter() + delay >= self.end:
+                        break
+                    await asyncio.sleep(delay)
+                    text = 'load %d-%d' % (index, sent)
+                    self.sent[text] = perf_counter()
+                    await self.send(ws, 'message', message=text, guid=str(uuid4()))
+                    sent += 1
+
+                await asyncio.sleep(max(0, self.end - perf_counter()))
+                await self.send(ws, 'done')
+                # Give the final broadcasts time to arrive.
+                await asyncio.sleep(5)
+                receiver.cancel()
+        except (OSError, asyncio.TimeoutError, websockets.WebSocketException) as ex:
+            self.errors[type(ex).__name__] += 1
+
+    async def send(self, ws, action, **data):
+        await ws.send(json.dumps({'action': action, 'data': data}))
+
+    async def receive(self, ws):
+        async for raw in ws:
+            now = perf_counter()
+            data = json.loads(raw)
+            self.received[data['type']] += 1
+            if data['type'] == 'chat.message':
+                sent = self.sent.get(data['message']['message'])
+                if sent:
+                    self.timings['chat broadcast'].append((now - sent) * 1000)
+            elif data['type'] == 'error':
+                for error in data['errors']:
+                    self.errors[error] += 1
+
+    async def poll(self, name, path):
+        session = requests.Session()
+        while perf_counter() < self.end:
+            start = perf_counter()
+            try:
+                resp = await asyncio.to_thread(session.get, self.base_url + path, timeout=60)
+            except requests.RequestException as ex:
+                self.errors[type(ex).__name__] += 1
+            else:
+                self.timings['GET ' + name].append((perf_counter() - start) * 1000)
+                if resp.status_code >= 400:
+                    self.errors['HTTP %d from %s' % (resp.status_code, name)] += 1
+            await asyncio.sleep(self.options['poll_interval'])
+
+
+class Command(BaseCommand):
+    help = (
+        'Open WebSocket connections to a race room on a running server, and '
+        'drive join, ready, chat and done actions through them while polling '
+        'the race\'s HTTP endpoints. Reports latency percentiles for chat '
+        'broadcasts and HTTP requests (dev only).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'race',
+            help='Race to load, as category/race-slug. It should be open.',
+        )
+        parser.add_argument(
+            '--url', default='http://localhost:8000',
+            help='Base URL of the server (default: http://localhost:8000).',
+        )
+        parser.add_argument(
+            '--clients', type=int, default=1000,
+            help='Number of WebSocket clients, each a different user (default: 1000).',
+        )
+        parser.add_argument(
+            '--connect-rate', type=float, default=100,
+            help='Number of clients to connect per second (default: 100).',
+        )
+        parser.add_argument(
+            '--duration', type=int, default=60,
+            help='Seconds to chat for, once clients start connecting (default: 60).',
+        )
+        parser.add_argument(
+            '--chat-interval', type=float, default=30,
+            help='Average seconds between chat messages from each client (default: 30).',
+        )
+        parser.add_argument(
+            '--pollers', type=int, default=5,
+            help='Number of concurrent pollers for each HTTP endpoint (default: 5).',
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=1,
+            help='Seconds between each poller\'s requests (default: 1).',
+        )
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Random seed for client timings (default: 0).',
+        )
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG:
+            raise CommandError('Dev only.')
+        try:
+            category_slug, race_slug = options['race'].split('/')
+            race = models.Race.objects.get(category__slug=category_slug, slug=race_slug)
+        except (ValueError, models.Race.DoesNotExist):
+            raise CommandError('Could not find race "%s".' % options['race'])
+
+        users = list(models.User.objects.filter(
+            active=True,
+        ).exclude(
+            email=models.User.SYSTEM_USER,
+        ).order_by('-id')[:options['clients']])
+        if len(users) < options['clients']:
+            self.stderr.write(
+                'Only %d users are available, see the dev_scale_fixtures command.'
+                % len(users)
+            )
+
+        application, _ = Application.objects.get_or_create(
+            name='Load test',
+            defaults={
+                'client_type': Application.CLIENT_CONFIDENTIAL,
+                'authorization_grant_type': Application.GRANT_CLIENT_CREDENTIALS,
+            },
+        )
+        tokens = AccessToken.objects.bulk_create([
+            AccessToken(
+                user=user,
+                application=application,
+                token=secrets.token_urlsafe(30),
+                expires=timezone.now() + timedelta(seconds=options['duration'] + 3600),
+                scope='chat_message race_action',
+            )
+            for user in users
+        ])
+
+        load_test = LoadTest(options['url'], race, [token.token for token in tokens], options)
+        self.stdout.write(
+            'Connecting %d clients to %s...' % (len(tokens), load_test.ws_url)
+        )
+        try:
+            asyncio.run(load_test.run())
+        finally:
+            AccessToken.objects.filter(application=application).delete()
+
+        self.report(load_test)
+
+    def report(self, load_test):
+        self.stdout.write('%-20s %8s %10s %10s %10s %10s' % (
+            'timing', 'count', 'p50 (ms)', 'p90 (ms)', 'p99 (ms)', 'max (ms)',
+        ))
+        for name, values in sorted(load_test.timings.items()):
+            if len(values) < 2:
+                continue
+            percentiles = quantiles(values, n=100, method='inclusive')
+            self.stdout.write('%-20s %8d %10.1f %10.1f %10.1f %10.1f' % (
+                name,
+                len(values),
+                percentiles[49],
+                percentiles[89],
+                percentiles[98],
+                max(values),
+            ))
+
+        self.stdout.write('')
+        self.stdout.write('Messages received:')
+        for message_type, count in load_test.received.most_common():
+            self.stdout.write('  %-18s %8d' % (message_type, count))
+        if load_test.errors:
+            self.stdout.write('')
+            self.stdout.write('Errors:')
+            for error, count in load_test.errors.most_common():
+                self.stdout.write('  %8d  %s' % (count, error))
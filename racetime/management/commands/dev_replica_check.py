@@ -0,0 +1,204 @@
+import sqlite3
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.management import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from ... import models, replicas
+from ...consumers import RaceConsumer
+
+
+class Command(BaseCommand):
+    help = (
+        'Check that reads are routed to the read replica and writes to the '
+        'primary, and that users stick to the primary after writing (dev '
+        'only). The first database in RT_REPLICAS should be a copy of the '
+        'default database that is not kept in sync, so that reads from it '
+        'can be told apart.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--copy', action='store_true',
+            help='Copy the default SQLite database to the replica first.',
+        )
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG:
+            raise CommandError('Dev only.')
+        if not settings.RT_REPLICAS:
+            raise CommandError(
+                'Add a replica to DATABASES and RT_REPLICAS first, for example '
+                'a second SQLite database, and run again with --copy.'
+            )
+        self.replica = settings.RT_REPLICAS[0]
+        if options['copy']:
+            self.copy_database()
+
+        self.failures = 0
+        self.check_router()
+        self.check_lag()
+        self.check_views()
+        self.check_cache_fills()
+        self.check_consumer()
+        if self.failures:
+            raise CommandError('%d check(s) failed.' % self.failures)
+        self.stdout.write('All checks passed.')
+
+    def copy_database(self):
+        source = settings.DATABASES[DEFAULT_DB_ALIAS]
+        target = settings.DATABASES[self.replica]
+        if not all('sqlite3' in db['ENGINE'] for db in (source, target)):
+            raise CommandError('--copy only works for SQLite databases.')
+        connections[self.replica].close()
+        with sqlite3.connect(source['NAME']) as src, sqlite3.connect(target['NAME']) as dst:
+            src.backup(dst)
+        self.stdout.write('Copied %s to %s.' % (source['NAME'], target['NAME']))
+
+    def result(self, ok, description):
+        if not ok:
+            self.failures += 1
+        self.stdout.write('%-4s %s' % ('ok' if ok else 'FAIL', description))
+
+    def check_router(self):
+        router = replicas.ReplicaRouter()
+        self.result(
+            router.db_for_read(models.Race) == DEFAULT_DB_ALIAS,
+            'Reads go to the primary by default.',
+        )
+        with replicas.replica_reads():
+            self.result(
+                router.db_for_read(models.Race) in settings.RT_REPLICAS,
+                'Reads go to a replica inside replica_reads().',
+            )
+            self.result(
+                router.db_for_write(models.Race) == DEFAULT_DB_ALIAS,
+                'Writes go to the primary inside replica_reads().',
+            )
+            with transaction.atomic():
+                self.result(
+                    router.db_for_read(models.Race) == DEFAULT_DB_ALIAS,
+                    'Reads go to the primary inside a transaction.',
+                )
+
+    def check_lag(self):
+        """
+        Write a row that the replica won't have, and check who can see it.
+        """
+        user = self.get_user()
+        replicas.stick_to_primary(user.id)
+        cache_key = replicas._sticky_key(user.id)
+        action = models.UserAction.objects.create(user=user, action='replica_check')
+        try:
+            exists = models.UserAction.objects.filter(id=action.id).exists
+            with replicas.replica_reads():
+                self.result(not exists(), 'New rows are not read from the replica.')
+            with replicas.replica_reads(user.id):
+                self.result(exists(), 'A user who just wrote reads from the primary.')
+            cache.delete(cache_key)
+            with replicas.replica_reads(user.id):
+                self.result(not exists(), 'The same user reads from the replica afterwards.')
+        finally:
+            action.delete()
+
+    def check_views(self):
+        user = self.get_user()
+        category = models.Category.objects.filter(active=True).first()
+        if not category:
+            raise CommandError('No active categories to check with.')
+        search_url = reverse('search') + '?q=' + category.slug[:2]
+        client = Client()
+        # Bulletins are cached from the primary, so have them cached already.
+        models.Bulletin.objects.get_visible()
+
+        default_queries, replica_queries = self.count_queries(client.get, search_url)
+        self.result(
+            replica_queries and not default_queries,
+            'Anonymous search reads from the replica (%d queries).' % replica_queries,
+        )
+
+        client.force_login(user)
+        client.post(reverse('star', args=(category.slug,)))
+        try:
+            default_queries, replica_queries = self.count_queries(client.get, search_url)
+            self.result(
+                default_queries and not replica_queries,
+                'Search after starring a category reads from the primary '
+                '(%d queries).' % default_queries,
+            )
+        finally:
+            client.post(reverse('unstar', args=(category.slug,)))
+
+        cache.delete(replicas._sticky_key(user.id))
+        default_queries, replica_queries = self.count_queries(client.get, search_url)
+        self.result(
+            replica_queries and default_queries == 1,
+            'Logged in search reads the session from the primary and the '
+            'rest from the replica (%d queries).' % replica_queries,
+        )
+
+        default_queries, replica_queries = self.count_queries(
+            client.post, reverse('star', args=(category.slug,)),
+        )
+        client.post(reverse('unstar', args=(category.slug,)))
+        self.result(
+            default_queries and not replica_queries,
+            'POST requests read from the primary (%d queries).' % default_queries,
+        )
+        cache.delete(replicas._sticky_key(user.id))
+
+    def check_cache_fills(self):
+        category = models.Category.objects.filter(active=True).first()
+        data_url = reverse('category_data', args=(category.slug,))
+        cache.delete_many(
+            [cache_key.key for cache_key in category.cache_dependencies()]
+            + [models.Bulletin.objects.cache_key]
+        )
+        client = Client()
+
+        default_queries, replica_queries = self.count_queries(client.get, data_url)
+        self.result(
+            default_queries and not replica_queries,
+            'Category data is cached from the primary (%d queries).' % default_queries,
+        )
+        default_queries, replica_queries = self.count_queries(client.get, data_url)
+        self.result(
+            not default_queries and not replica_queries,
+            'Cached category data makes no queries.',
+        )
+
+    def check_consumer(self):
+        race = models.Race.objects.order_by('-id').first()
+        if not race:
+            raise CommandError('No races to check with.')
+        consumer = RaceConsumer()
+        consumer.scope = {
+            'url_route': {'kwargs': {'race': race.slug}},
+            'user': AnonymousUser(),
+        }
+        # Call the wrapped function, so that queries are made in this thread.
+        load_race = RaceConsumer.__dict__['load_race'].func
+        default_queries, replica_queries = self.count_queries(load_race, consumer)
+        self.result(
+            replica_queries and not default_queries,
+            'Race WebSockets load races from the replica (%d queries).' % replica_queries,
+        )
+
+    def count_queries(self, func, *args):
+        with CaptureQueriesContext(connections[DEFAULT_DB_ALIAS]) as default_queries:
+            with CaptureQueriesContext(connections[self.replica]) as replica_queries:
+                func(*args)
+        return len(default_queries), len(replica_queries)
+
+    def get_user(self):
+        user = models.User.objects.filter(active=True).exclude(
+            email=models.User.SYSTEM_USER,
+        ).order_by('id').first()
+        if not user:
+            raise CommandError('No users to check with.')
+        return user
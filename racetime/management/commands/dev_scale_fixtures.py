@@ -0,0 +1,289 @@
+import random
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from ... import models
+from ...slugs import SlugSpace
+from ...utils import set_bulk_ids
+
+chat_words = [
+    'gl', 'hf', 'gg', 'wp', 'seed', 'route', 'reset', 'split', 'pb', 'rip',
+    'nice', 'lag', 'skip', 'clip', 'boss', 'dungeon', 'item', 'warp', 'go',
+]
+
+
+@contextmanager
+def backdating(*fields):
+    """
+    Allow auto_now_add fields to be given past dates while inside this
+    context, as they are otherwise always set to the current time.
+    """
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate users, categories and finished races (with entrants, chat '
+        'messages, leaderboard rankings and user stats) at production scale, '
+        'for load testing (dev only). The same seed always generates the same '
+        'data.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Random seed (default: 0).',
+        )
+        parser.add_argument(
+            '--prefix', default='scale',
+            help='Prefix for generated user names and category slugs (default: scale).',
+        )
+        parser.add_argument(
+            '--users', type=int, default=10000,
+            help='Number of users to create (default: 10000).',
+        )
+        parser.add_argument(
+            '--categories', type=int, default=20,
+            help='Number of categories to create (default: 20).',
+        )
+        parser.add_argument(
+            '--races', type=int, default=100000,
+            help='Number of finished races to create (default: 100000).',
+        )
+        parser.add_argument(
+            '--max-entrants', type=int, default=20,
+            help='Maximum number of entrants per race (default: 20).',
+        )
+        parser.add_argument(
+            '--messages', type=int, default=10,
+            help='Average number of chat messages per race (default: 10).',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=2000,
+            help='Number of races to insert per transaction (default: 2000).',
+        )
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG:
+            raise CommandError('Dev only.')
+        if options['max_entrants'] < 2 or options['max_entrants'] > options['users']:
+            raise CommandError('--max-entrants must be between 2 and the number of users.')
+        prefix = options['prefix']
+        if models.Category.objects.filter(slug=prefix + '0').exists():
+            raise CommandError(
+                'Scale fixtures with the prefix "%s" already exist. Use a '
+                'different prefix, or delete them first.' % prefix
+            )
+
+        self.rng = random.Random(options['seed'])
+        self.now = timezone.now().replace(microsecond=0)
+
+        with backdating(
+            models.User._meta.get_field('date_joined'),
+            models.Race._meta.get_field('opened_at'),
+            models.Message._meta.get_field('posted_at'),
+        ):
+            with transaction.atomic():
+                user_ids = self.create_users(prefix, options['users'])
+                goals = self.create_categories(prefix, options['categories'], user_ids)
+            self.create_races(goals, user_ids, options)
+            self.create_stats({category for category, _ in goals})
+
+    def create_users(self, prefix, count):
+        """
+        Create users, returning their IDs. Every user has the password "pass".
+        """
+        password = make_password('pass')
+        before = models.User.objects.aggregate(Max('id'))['id__max'] or 0
+        for start in range(0, count, 5000):
+            models.User.objects.bulk_create([
+                models.User(
+                    email='%s%d@example.com' % (prefix, i),
+                    password=password,
+                    name='%s%d' % (prefix, i),
+                    discriminator='%04d' % self.rng.randint(0, 9999),
+                    date_joined=self.now - timedelta(days=self.rng.randint(0, 2000)),
+                )
+                for i in range(start, min(start + 5000, count))
+            ])
+        user_ids = list(models.User.objects.filter(
+            id__gt=before,
+            email__startswith=prefix,
+        ).order_by('id').values_list('id', flat=True))
+        self.stdout.write('Created %d users.' % len(user_ids))
+        return user_ids
+
+    def create_categories(self, prefix, count, user_ids):
+        """
+        Create categories with a few goals each, returning a list of
+        (category, goal) tuples.
+        """
+        goals = []
+        for i in range(count):
+            category = models.Category.objects.create(
+                name='Scale test category %s%d' % (prefix, i),
+                short_name='%s%d' % (prefix.upper(), i),
+                slug='%s%d' % (prefix, i),
+            )
+            category.owners.add(self.rng.choice(user_ids))
+            category.moderators.add(*self.rng.sample(user_ids, 3))
+            for j in range(self.rng.randint(1, 4)):
+                goals.append((
+                    category,
+                    models.Goal.objects.create(category=category, name='Goal %d' % j),
+                ))
+        self.stdout.write('Created %d categories with %d goals.' % (count, len(goals)))
+        return goals
+
+    def create_races(self, goals, user_ids, options):
+        """
+        Create finished races in batches, then rankings for everyone who
+        raced in each category goal.
+        """
+        space = SlugSpace()
+        slugs = defaultdict(set)
+        categories = {category.id: category for category, _ in goals}
+        # (category ID, goal ID) -> user ID -> [times raced, best time, last raced]
+        raced = defaultdict(dict)
+        created = {'races': 0, 'entrants': 0, 'messages': 0}
+
+        for start in range(0, options['races'], options['batch_size']):
+            size = min(options['batch_size'], options['races'] - start)
+            with transaction.atomic():
+                before = models.Race.objects.aggregate(Max('id'))['id__max'] or 0
+                races = []
+                for _ in range(size):
+                    category, goal = self.rng.choice(goals)
+                    slug = space.slug(self.rng.randrange(space.size))
+                    while slug in slugs[category.id]:
+                        slug = space.slug(self.rng.randrange(space.size))
+                    slugs[category.id].add(slug)
+                    opened_at = self.now - timedelta(minutes=self.rng.randint(60, 60 * 24 * 2000))
+                    started_at = opened_at + timedelta(minutes=self.rng.randint(5, 30))
+                    races.append(models.Race(
+                        category=category,
+                        goal=goal,
+                        slug=slug,
+                        state=models.RaceStates.finished.value,
+                        opened_at=opened_at,
+                        started_at=started_at,
+                        ended_at=started_at + timedelta(hours=self.rng.randint(1, 4)),
+                        recordable=True,
+                        recorded=True,
+                        version=self.rng.randint(10, 100),
+                    ))
+                models.Race.objects.bulk_create(races)
+                set_bulk_ids(races, models.Race.objects.filter(
+                    id__gt=before,
+                    category__in=categories.values(),
+                ))
+
+                entrants = []
+                messages = []
+                for race in races:
+                    race_entrants = self.make_entrants(race, user_ids, options['max_entrants'], raced)
+                    entrants += race_entrants
+                    messages += self.make_messages(race, race_entrants, options['messages'])
+                models.Entrant.objects.bulk_create(entrants, batch_size=5000)
+                models.Message.objects.bulk_create(messages, batch_size=5000)
+
+            created['races'] += len(races)
+            created['entrants'] += len(entrants)
+            created['messages'] += len(messages)
+            self.stdout.write(
+                'Created %(races)d races, %(entrants)d entrants and %(messages)d messages.'
+                % created
+            )
+
+        rankings = []
+        for (category_id, goal_id), users in raced.items():
+            for user_id, (times_raced, best_time, last_raced) in users.items():
+                score = self.rng.gauss(25, 5)
+                confidence = max(0.5, 8.3 / times_raced ** 0.5)
+                rankings.append(models.UserRanking(
+                    user_id=user_id,
+                    category_id=category_id,
+                    goal_id=goal_id,
+                    score=score,
+                    confidence=confidence,
+                    rating=max(0, round((score - 2 * confidence) * 100)),
+                    best_time=best_time,
+                    times_raced=times_raced,
+                    last_raced=last_raced,
+                ))
+        models.UserRanking.objects.bulk_create(rankings, batch_size=5000)
+        self.stdout.write('Created %d rankings.' % len(rankings))
+
+    def create_stats(self, categories):
+        """
+        Calculate the user stats rollups for every generated category.
+        """
+        count = 0
+        for category in sorted(categories, key=lambda category: category.id):
+            count += len(models.UserStats.objects.refresh(category))
+        self.stdout.write('Created %d user stats.' % count)
+
+    def make_entrants(self, race, user_ids, max_entrants, raced):
+        """
+        Return unsaved entrants for a race, with random finish times and a few
+        forfeits.
+        """
+        count = self.rng.randint(2, max_entrants)
+        finish_times = sorted(
+            timedelta(seconds=self.rng.randint(1800, 10800))
+            for _ in range(count)
+        )
+        forfeits = self.rng.randint(0, count // 4)
+        entrants = []
+        rankings = raced[race.category_id, race.goal_id]
+        for place, user_id in enumerate(self.rng.sample(user_ids, count), start=1):
+            finished = place <= count - forfeits
+            finish_time = finish_times[place - 1] if finished else None
+            entrants.append(models.Entrant(
+                user_id=user_id,
+                race=race,
+                state=models.EntrantStates.joined.value,
+                ready=True,
+                dnf=not finished,
+                finish_time=finish_time,
+                place=place if finished else None,
+                rating=self.rng.randint(0, 3000),
+                rating_change=self.rng.randint(-100, 100),
+            ))
+            times_raced, best_time, last_raced = rankings.get(user_id, (0, None, None))
+            if finish_time and (best_time is None or finish_time < best_time):
+                best_time = finish_time
+            # Races are generated in random date order.
+            if last_raced is None or race.ended_at.date() > last_raced:
+                last_raced = race.ended_at.date()
+            rankings[user_id] = (times_raced + 1, best_time, last_raced)
+        return entrants
+
+    def make_messages(self, race, entrants, average):
+        """
+        Return unsaved chat messages for a race, posted by its entrants.
+        """
+        messages = []
+        duration = int((race.ended_at - race.opened_at).total_seconds())
+        for _ in range(self.rng.randint(0, average * 2)):
+            messages.append(models.Message(
+                user_id=self.rng.choice(entrants).user_id,
+                race=race,
+                posted_at=race.opened_at + timedelta(seconds=self.rng.randint(0, duration)),
+                message=' '.join(self.rng.choices(chat_words, k=self.rng.randint(1, 8))),
+            ))
+        return messages
@@ -0,0 +1,31 @@
+from django.core.management import BaseCommand
+
+from ...models import UserDeletion
+from ...utils import notice_exception
+
+
+class Command(BaseCommand):
+    help = 'Carry out pending account deletions.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Number of rows to update in each transaction (default: 500).',
+        )
+
+    def handle(self, *args, **options):
+        for deletion_id in UserDeletion.objects.filter(
+            completed_at__isnull=True,
+        ).order_by('created_at').values_list('id', flat=True):
+            try:
+                while UserDeletion.objects.process_batch(deletion_id, options['batch_size']):
+                    pass
+            except Exception as ex:
+                notice_exception(ex)
+                self.stderr.write('Failed to process deletion #%d: %s' % (deletion_id, ex))
+                continue
+            deletion = UserDeletion.objects.get(id=deletion_id)
+            if deletion.completed_at:
+                self.stdout.write('Completed deletion #%d.' % deletion_id)
+            else:
+                self.stdout.write('Skipped deletion #%d (being processed elsewhere).' % deletion_id)
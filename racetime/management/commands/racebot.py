@@ -3,10 +3,12 @@ import sys
 from datetime import datetime
 
 from django.conf import settings
-from django.core.management import BaseCommand
-from django.utils import autoreload
+from django.core.management import BaseCommand, CommandError
+from django.db.models import Count
+from django.utils import autoreload, timezone
 
-from ...racebot import RaceBot
+from ... import caching
+from ...racebot import BotStats, RaceBot
 
 
 class Command(BaseCommand):
@@ -18,8 +20,19 @@ class Command(BaseCommand):
             '--noreload', action='store_false', dest='use_reloader',
             help='Do not use the auto-reloader.',
         )
+        parser.add_argument(
+            '--stats', action='store_true',
+            help=(
+                'Show races owned, loop timings and scheduling lag for each '
+                'running race bot process, instead of starting one.'
+            ),
+        )
 
     def handle(self, *args, **options):
+        if options['stats']:
+            self.show_stats()
+            return
+
         use_reloader = options['use_reloader']
 
         if use_reloader:
@@ -38,6 +51,12 @@ class Command(BaseCommand):
             "settings": settings.SETTINGS_MODULE,
             "pid": os.getpid(),
         })
+        if not caching.is_shared():
+            self.stderr.write(
+                'Warning: the cache is not shared with other processes, so '
+                'race changes will not clear cached pages and stats cannot '
+                'be read. Set CACHES to a shared cache such as Redis.'
+            )
 
         try:
             bot = RaceBot(os.getpid())
@@ -45,3 +64,65 @@ class Command(BaseCommand):
                 bot.handle()
         except KeyboardInterrupt:
             sys.exit(0)
+
+    def show_stats(self):
+        if not caching.is_shared():
+            raise CommandError(
+                'Race bot stats are published to the cache, which is not '
+                'shared between processes. Set CACHES to a shared cache such '
+                'as Redis.'
+            )
+        owned = dict(
+            RaceBot.queryset.values_list('bot_pid').annotate(Count('id')).order_by()
+        )
+        self.stdout.write('Active races owned per bot process:')
+        for pid, count in sorted(owned.items(), key=lambda item: (item[0] is None, item[0])):
+            self.stdout.write('  %-10s %6d' % (pid or 'none', count))
+
+        now = timezone.now()
+        all_stats = BotStats.get_all()
+        for stats in all_stats:
+            self.stdout.write('')
+            self.stdout.write(
+                'PID %(pid)d: %(races)d race(s) in memory, running since '
+                '%(started)s, updated %(ago)ds ago.' % {
+                    'pid': stats['pid'],
+                    'races': stats['races'],
+                    'started': stats['started_at'].strftime('%Y-%m-%d %H:%M:%S'),
+                    'ago': (now - stats['updated_at']).total_seconds(),
+                }
+            )
+            self.stdout.write('  %-24s %10s %10s %10s' % ('phase', 'count', 'avg (ms)', 'max (ms)'))
+            for name, phase in sorted(stats['phases'].items()):
+                self.stdout.write('  %-24s %10d %10.2f %10.2f' % (
+                    name,
+                    phase['count'],
+                    phase['total'] / phase['count'] * 1000,
+                    phase['max'] * 1000,
+                ))
+            self.write_histograms('action', stats['lag'])
+            self.write_histograms('race', stats['race_lag'])
+
+        if not all_stats:
+            self.stdout.write('')
+            self.stdout.write('No race bot has published stats recently.')
+
+    def write_histograms(self, label, histograms):
+        """
+        Write out scheduling lag histograms, one line each, with a column of
+        counts per bucket.
+        """
+        if not histograms:
+            return
+        bounds = ['<=%gs' % bound for bound in BotStats.BUCKETS] + ['>%gs' % BotStats.BUCKETS[-1]]
+        self.stdout.write('  %-24s %6s %8s %8s  %s' % (
+            label, 'count', 'avg (ms)', 'max (ms)', ' '.join('%7s' % bound for bound in bounds),
+        ))
+        for name, histogram in sorted(histograms.items()):
+            self.stdout.write('  %-24s %6d %8.1f %8.1f  %s' % (
+                name,
+                histogram['count'],
+                histogram['total'] / histogram['count'] * 1000,
+                histogram['max'] * 1000,
+                ' '.join('%7d' % count for count in histogram['buckets']),
+            ))
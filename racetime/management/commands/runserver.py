@@ -0,0 +1,11 @@
+from daphne.management.commands.runserver import Command as BaseCommand
+
+from ...server import Server
+
+
+class Command(BaseCommand):
+    help = (
+        'Start the ASGI server, with permessage-deflate compression for '
+        'WebSockets.'
+    )
+    server_cls = Server
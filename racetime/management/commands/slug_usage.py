@@ -0,0 +1,28 @@
+from django.core.management import BaseCommand
+
+from ... import models
+
+
+class Command(BaseCommand):
+    help = 'Show how much of each category\'s race slug space has been used up.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'category', nargs='*',
+            help='Category slug(s) to check. Defaults to all categories.',
+        )
+
+    def handle(self, *args, **options):
+        categories = models.Category.objects.order_by('slug')
+        if options['category']:
+            categories = categories.filter(slug__in=options['category'])
+
+        self.stdout.write('%-24s %12s %14s %8s' % ('category', 'used', 'available', 'used %'))
+        for category in categories:
+            used, size = category.slug_space_usage()
+            self.stdout.write('%-24s %12d %14d %8.3f' % (
+                category.slug,
+                used,
+                size,
+                100 * used / size,
+            ))
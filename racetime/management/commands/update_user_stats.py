@@ -0,0 +1,63 @@
+from django.core.management import BaseCommand
+
+from ... import models
+
+
+class Command(BaseCommand):
+    help = 'Rebuild (or verify) the user profile stats rollups.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'category', nargs='*',
+            help='Category slug(s) to process. Defaults to all categories.',
+        )
+        parser.add_argument(
+            '--verify', action='store_true', dest='verify',
+            help='Compare stored rollups to race data without changing anything.',
+        )
+
+    def handle(self, *args, **options):
+        categories = models.Category.objects.order_by('slug')
+        if options['category']:
+            categories = categories.filter(slug__in=options['category'])
+
+        mismatches = 0
+        for category in categories:
+            if options['verify']:
+                mismatches += self.verify(category)
+            else:
+                stats = models.UserStats.objects.refresh(category)
+                self.stdout.write(
+                    'Rebuilt %d user stats for %s.'
+                    % (len(stats), category.short_name)
+                )
+
+        if options['verify']:
+            if mismatches:
+                self.stderr.write('Found %d mismatched user stats.' % mismatches)
+            else:
+                self.stdout.write('All user stats are up-to-date.')
+
+    def verify(self, category):
+        """
+        Check stored rollups for a category against freshly calculated ones,
+        returning the number of users whose stats do not match.
+        """
+        stored = {
+            stats.user_id: stats.as_tuple()
+            for stats in models.UserStats.objects.filter(category=category)
+        }
+        expected = {
+            stats.user_id: stats.as_tuple()
+            for stats in models.UserStats.objects.calculate(category)
+        }
+
+        mismatches = 0
+        for user_id in set(stored) | set(expected):
+            if stored.get(user_id) != expected.get(user_id):
+                self.stdout.write(
+                    '%s: user #%d has %s, expected %s.'
+                    % (category.short_name, user_id, stored.get(user_id), expected.get(user_id))
+                )
+                mismatches += 1
+        return mismatches
@@ -1,7 +1,12 @@
+from time import perf_counter
 from urllib.parse import parse_qs
 
 from channels.middleware import BaseMiddleware
+from django.contrib.auth import SESSION_KEY
 from django.middleware import csrf
+from django.urls import Resolver404, resolve
+
+from . import instrumentation, replicas
 
 
 class CsrfViewMiddlewareTwitch(csrf.CsrfViewMiddleware):
@@ -24,6 +29,67 @@ class CsrfViewMiddlewareTwitch(csrf.CsrfViewMiddleware):
         return self._accept(request)
 
 
+class InstrumentationMiddleware:
+    """
+    Measure the queries, database time, template render time and response
+    size of each request, by URL name.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with instrumentation.measure('view', 'unresolved') as measurement:
+            response = self.get_response(request)
+            match = request.resolver_match
+            if match:
+                measurement.name = match.url_name or match.view_name
+            if not response.streaming:
+                measurement.payload = len(response.content)
+        return response
+
+    def process_template_response(self, request, response):
+        start = perf_counter()
+        response.add_post_render_callback(
+            lambda _: instrumentation.add_render_time(perf_counter() - start)
+        )
+        return response
+
+
+class ReplicaMiddleware:
+    """
+    Run GET and HEAD requests for views with read_from_replica = True inside
+    replicas.replica_reads(), and keep users who make other requests on the
+    primary for a while afterwards.
+
+    Must come after the session and authentication middleware.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.method == 'OPTIONS':
+            return self.get_response(request)
+        if request.method not in ('GET', 'HEAD'):
+            response = self.get_response(request)
+            if request.user.is_authenticated:
+                replicas.stick_to_primary(request.user.id)
+            return response
+
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return self.get_response(request)
+        view_class = getattr(match.func, 'view_class', None)
+        if not getattr(view_class, 'read_from_replica', False):
+            return self.get_response(request)
+
+        # The session is always read from the primary, so that a new login
+        # is seen straight away.
+        user_id = request.session.get(SESSION_KEY)
+        with replicas.replica_reads(int(user_id) if user_id else None):
+            return self.get_response(request)
+
+
 class OAuth2TokenMiddleware(BaseMiddleware):
     """
     OAuth2 middleware for ASGI.
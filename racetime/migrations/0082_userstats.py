@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:20
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('racetime', '0081_alter_race_bot_meta'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('times_entered', models.PositiveIntegerField(default=0)),
+                ('times_first', models.PositiveIntegerField(default=0)),
+                ('times_second', models.PositiveIntegerField(default=0)),
+                ('times_third', models.PositiveIntegerField(default=0)),
+                ('times_forfeited', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='racetime.category')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'User stats',
+                'constraints': [models.UniqueConstraint(fields=('user', 'category'), name='unique_user_category_stats')],
+            },
+        ),
+    ]
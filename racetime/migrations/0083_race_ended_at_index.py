@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('racetime', '0082_userstats'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='race',
+            index=models.Index(fields=['category', 'state', 'ended_at'], name='racetime_ra_categor_6e8191_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('racetime', '0083_race_ended_at_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Split',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveIntegerField(help_text='Order in which this entrant reported their splits.')),
+                ('name', models.CharField(max_length=255)),
+                ('split_time', models.CharField(help_text='Split time as reported by the entrant.', max_length=64)),
+                ('duration', models.DurationField(help_text='Split time, if it could be understood.', null=True)),
+                ('delta', models.DurationField(help_text='Difference from the fastest time to this split by another entrant.', null=True)),
+                ('is_undo', models.BooleanField(default=False)),
+                ('is_finish', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('entrant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='racetime.entrant')),
+                ('race', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='racetime.race')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('entrant', 'index'), name='unique_entrant_split_index')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:34
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('racetime', '0084_split'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserDeletion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stage', models.CharField(choices=[('comments', 'comments'), ('message_links', 'message_links'), ('messages', 'messages'), ('user', 'user'), ('email', 'email')], default='comments', max_length=16)),
+                ('cursor', models.PositiveIntegerField(default=0, help_text='ID of the last object processed in the current stage.')),
+                ('name_map', models.JSONField(help_text='Names the user has had, and when they stopped being used. Used to anonymise older system messages.')),
+                ('name_window', models.PositiveSmallIntegerField(default=0)),
+                ('email', models.EmailField(max_length=255)),
+                ('email_subject', models.TextField()),
+                ('email_message', models.TextField()),
+                ('email_html', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('completed_at', models.DateTimeField(db_index=True, null=True)),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
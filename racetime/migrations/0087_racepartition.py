@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('racetime', '0086_user_name_discriminator_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RacePartition',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pairings', models.JSONField(help_text='List of pairings, each a list of user IDs.')),
+                ('cursor', models.PositiveIntegerField(default=0, help_text='Number of pairings that have race rooms.')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('completed_at', models.DateTimeField(db_index=True, null=True)),
+                ('race', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='racetime.race')),
+            ],
+        ),
+    ]
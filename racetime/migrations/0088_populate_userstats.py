@@ -0,0 +1,36 @@
+from django.db import migrations
+from django.db.models import Count, Q
+
+
+def populate_user_stats(apps, schema_editor):
+    Category = apps.get_model('racetime', 'Category')
+    Entrant = apps.get_model('racetime', 'Entrant')
+    UserStats = apps.get_model('racetime', 'UserStats')
+    for category in Category.objects.all():
+        entrants = Entrant.objects.filter(
+            user__isnull=False,
+            race__category=category,
+            race__state='finished',
+            race__unlisted=False,
+        )
+        UserStats.objects.filter(category=category).delete()
+        UserStats.objects.bulk_create([
+            UserStats(category=category, **values)
+            for values in entrants.values('user_id').annotate(
+                times_entered=Count('id'),
+                times_first=Count('id', filter=Q(place=1)),
+                times_second=Count('id', filter=Q(place=2)),
+                times_third=Count('id', filter=Q(place=3)),
+                times_forfeited=Count('id', filter=Q(dnf=True) | Q(dq=True)),
+            ).order_by()
+        ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('racetime', '0087_racepartition'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_user_stats, migrations.RunPython.noop),
+    ]
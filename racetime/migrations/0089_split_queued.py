@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('racetime', '0088_populate_userstats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='split',
+            name='queued',
+            field=models.BooleanField(default=False, help_text='Waiting for the race bot to broadcast it.'),
+        ),
+        migrations.AddIndex(
+            model_name='split',
+            index=models.Index(fields=['race', 'queued'], name='racetime_sp_race_id_452cab_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('racetime', '0089_split_queued'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='userdeletion',
+            name='stage',
+            field=models.CharField(choices=[('comments', 'comments'), ('message_links', 'message_links'), ('messages', 'messages'), ('related', 'related'), ('user', 'user'), ('email', 'email')], default='comments', max_length=16),
+        ),
+    ]
@@ -3,14 +3,16 @@ from .bot import Bot
 from .category import AuditLog, Category, CategoryRequest, Emote, Goal
 from .chat import Message
 from .choices import EntrantStates, RaceStates
-from .race import Entrant, Race
+from .race import Entrant, Race, RacePartition, Split
 from .team import Team, TeamAuditLog, TeamMember
 from .user import (
     Ban,
     User,
     UserAction,
+    UserDeletion,
     UserLog,
     UserRanking,
+    UserStats,
 )
 
 __all__ = [
@@ -32,6 +34,8 @@ __all__ = [
     # race
     'Entrant',
     'Race',
+    'RacePartition',
+    'Split',
     # team
     'Team',
     'TeamAuditLog',
@@ -40,6 +44,8 @@ __all__ = [
     'Ban',
     'User',
     'UserAction',
+    'UserDeletion',
     'UserLog',
     'UserRanking',
+    'UserStats',
 ]
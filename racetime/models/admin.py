@@ -1,8 +1,50 @@
+from django.core.cache import cache
 from django.db import models
+from django.db.models import Min
+from django.utils import timezone
 
+from .. import replicas
+from ..caching import CacheKey
 from ..utils import get_hashids
 
 
+class BulletinManager(models.Manager):
+    """
+    Default manager for the Bulletin model.
+    """
+    cache_key = 'bulletins'
+
+    def get_visible(self):
+        """
+        Return a list of currently visible bulletins.
+
+        The list is cached until the next time a bulletin is due to appear or
+        disappear, and is cleared whenever a bulletin is saved or deleted.
+        """
+        now = timezone.now()
+        cached = cache.get(self.cache_key)
+        if cached is not None:
+            bulletins, expires_at = cached
+            if expires_at is None or now < expires_at:
+                return bulletins
+
+        with replicas.primary_reads():
+            bulletins = list(self.filter(
+                visible_from__lte=now,
+                visible_to__gte=now,
+            ))
+            next_from = self.filter(
+                visible_from__gt=now,
+            ).aggregate(Min('visible_from'))['visible_from__min']
+        boundaries = [bulletin.visible_to for bulletin in bulletins]
+        if next_from:
+            boundaries.append(next_from)
+        expires_at = min(boundaries) if boundaries else None
+
+        cache.set(self.cache_key, (bulletins, expires_at), None)
+        return bulletins
+
+
 class Bulletin(models.Model):
     """
     Bulletins are short messages shown at the top of every page.
@@ -21,6 +63,8 @@ class Bulletin(models.Model):
         auto_now_add=True,
     )
 
+    objects = BulletinManager()
+
     class Meta:
         indexes = [
             models.Index(fields=['visible_from', 'visible_to']),
@@ -30,5 +74,11 @@ class Bulletin(models.Model):
     def hashid(self):
         return get_hashids(self.__class__).encode(self.id)
 
+    def cache_dependencies(self):
+        """
+        Return CacheKeys for cached data that includes this bulletin.
+        """
+        return [CacheKey('bulletins', Bulletin.objects.cache_key)]
+
     def __str__(self):
         return self.visible_from.strftime('%Y-%m-%d') + ' – ' + self.message[:50]
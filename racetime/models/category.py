@@ -1,8 +1,8 @@
 import json
-from functools import partial
 
 from django.apps import apps
 from django.conf import settings
+from django.core.cache import cache
 from django.core.mail import send_mail
 from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import MaxValueValidator, MinValueValidator
@@ -17,7 +17,9 @@ from django.utils.safestring import mark_safe
 from racetime.models.abstract import AbstractAuditLog
 
 from .choices import RaceStates
-from ..utils import SafeException, generate_race_slug, get_hashids
+from ..caching import CacheKey
+from ..slugs import SlugSpace, UsedSlugs
+from ..utils import SafeException, get_hashids
 
 
 class Category(models.Model):
@@ -181,6 +183,9 @@ class Category(models.Model):
         auto_now=True,
     )
 
+    # Separately cached parts of the category data, see get_data_fragment.
+    DATA_FRAGMENTS = ('details', 'staff', 'goals', 'emotes', 'current_races')
+
     class Meta:
         verbose_name_plural = 'Categories'
 
@@ -274,40 +279,130 @@ class Category(models.Model):
     def dump_json_data(self, allow_unlisted=False):
         """
         Return category data as a JSON string.
+
+        The data is composed from separately cached fragments (see
+        get_data_fragment), plus the cached summary of each current race, so
+        that a change to any one part does not require rebuilding the rest.
         """
-        races = self.race_set.exclude(
-            state__in=[RaceStates.finished, RaceStates.cancelled, RaceStates.partitioned],
-        )
-        if not allow_unlisted:
-            races = races.filter(unlisted=False)
-
-        value = json.dumps({
-            **self.api_dict_summary(),
-            'info': self.info,
-            'streaming_required': self.streaming_required,
-            'owners': [
-                user.api_dict_summary(category=self)
-                for user in self.all_owners
-            ],
-            'moderators': [
-                user.api_dict_summary(category=self)
-                for user in self.all_moderators
+        timeout = settings.RT_CACHE_TIMEOUT.get('CategoryDataFragment', 0)
+
+        keys = {
+            fragment: self.data_fragment_key(fragment)
+            for fragment in self.DATA_FRAGMENTS
+        }
+        cached = cache.get_many(keys.values())
+        fragments = {}
+        for fragment, key in keys.items():
+            if key in cached:
+                fragments[fragment] = cached[key]
+            else:
+                fragments[fragment] = self.get_data_fragment(fragment)
+                cache.set(key, fragments[fragment], timeout)
+
+        race_keys = [
+            self.race_summary_key(slug)
+            for slug, unlisted in fragments['current_races']
+            if allow_unlisted or not unlisted
+        ]
+        summaries = cache.get_many(race_keys)
+        missing = [key for key in race_keys if key not in summaries]
+        if missing:
+            Race = apps.get_model('racetime', 'Race')
+            races = Race.objects.filter(
+                category=self,
+                slug__in=[key.split('/')[1] for key in missing],
+            ).select_related('category', 'goal')
+            summaries.update({
+                race.summary_cache_key: race.api_dict_summary()
+                for race in races
+            })
+            cache.set_many({key: summaries[key] for key in missing if key in summaries}, timeout)
+
+        return json.dumps({
+            **fragments['details'],
+            **fragments['staff'],
+            'goals': fragments['goals'],
+            'current_races': [
+                summaries[key] for key in race_keys if key in summaries
             ],
-            'goals': [
+            'emotes': fragments['emotes'],
+        }, cls=DjangoJSONEncoder)
+
+    def data_fragment_key(self, fragment):
+        """
+        Return the cache key for a fragment of category data.
+        """
+        return '%s/data/%s' % (self.slug, fragment)
+
+    def race_summary_key(self, race_slug):
+        """
+        Return the cache key for the summary of a race in this category.
+        """
+        return '%s/%s/summary' % (self.slug, race_slug)
+
+    def get_data_fragment(self, fragment):
+        """
+        Build the given fragment of category data.
+
+        The current_races fragment is a list of (slug, unlisted) pairs, as
+        each race's summary is cached on its own (see Race.summary_cache_key).
+        """
+        if fragment == 'details':
+            return {
+                **self.api_dict_summary(),
+                'info': self.info,
+                'streaming_required': self.streaming_required,
+            }
+        if fragment == 'staff':
+            return {
+                'owners': [
+                    user.api_dict_summary(category=self)
+                    for user in self.all_owners
+                ],
+                'moderators': [
+                    user.api_dict_summary(category=self)
+                    for user in self.all_moderators
+                ],
+            }
+        if fragment == 'goals':
+            return [
                 goal.name
                 for goal in self.goal_set.filter(active=True)
-            ],
-            'current_races': [
-                race.api_dict_summary()
-                for race in races
-            ],
-            'emotes': {
+            ]
+        if fragment == 'emotes':
+            return {
                 emote.name: emote.image.url
                 for emote in self.emote_set.all().order_by('name')
-            },
-        }, cls=DjangoJSONEncoder)
+            }
+        if fragment == 'current_races':
+            return list(self.race_set.exclude(
+                state__in=[RaceStates.finished, RaceStates.cancelled, RaceStates.partitioned],
+            ).order_by('opened_at').values_list('slug', 'unlisted'))
+        raise ValueError('Unknown category data fragment: %s' % fragment)
+
+    def data_cache_keys(self, *fragments):
+        """
+        Return CacheKeys for the given fragments of category data, along with
+        the composed category data that includes them.
+        """
+        return [
+            CacheKey('category_fragment', self.data_fragment_key(fragment))
+            for fragment in fragments
+        ] + [
+            CacheKey('category_data', '%s/data' % self.slug),
+            CacheKey('category_data', 'o/%s/data' % self.slug),
+        ]
 
-        return value
+    def cache_dependencies(self):
+        """
+        Return CacheKeys for cached data that includes this category.
+
+        Race data includes category details too, but is cached briefly enough
+        that it does not need to be cleared.
+        """
+        return self.data_cache_keys('details', 'staff') + [
+            CacheKey('category_list', 'categories/data'),
+        ]
 
     def get_absolute_url(self):
         """
@@ -325,24 +420,73 @@ class Category(models.Model):
         """
         Generate an unused, unique race slug for a new race in this category.
         """
-        if self.slug_words:
-            generator = partial(generate_race_slug, self.slug_words.split('\n'))
-        else:
-            generator = generate_race_slug
+        return self.generate_race_slugs(1)[0]
 
-        slug = generator()
-        attempts_left = 99
-        while self.race_set.filter(slug=slug).exists() and attempts_left > 0:
-            slug = generator()
+    def generate_race_slugs(self, count, exclude=()):
+        """
+        Generate a number of unused, unique race slugs for new races in this
+        category, none of which are in exclude.
+
+        Slugs are drawn from the ones not yet marked as used (see
+        get_used_slugs), and each round of picks is confirmed against
+        existing races with a single query. That check is still needed as
+        other processes may have used slugs since the filter was cached.
+        """
+        cache_key, used = self.get_used_slugs()
+        slugs = set()
+        attempts_left = 10
+        while len(slugs) < count and attempts_left > 0:
+            drawn = self.slug_space.draw(used, count - len(slugs))
+            if not drawn:
+                break
+            candidates = set(drawn) - set(exclude)
+            slugs |= candidates - set(self.race_set.filter(
+                slug__in=candidates,
+            ).values_list('slug', flat=True))
             attempts_left -= 1
+        cache.set(cache_key, used, settings.RT_CACHE_TIMEOUT.get('CategoryUsedSlugs', 0))
 
-        if attempts_left == 0:
+        if len(slugs) < count:
             raise SafeException(
                 'Cannot generate a distinct race slug. There may not be '
                 'enough slug words available.'
             )
 
-        return slug
+        return list(slugs)
+
+    @cached_property
+    def slug_space(self):
+        """
+        Return the SlugSpace of all possible race slugs for this category.
+        """
+        return SlugSpace(self.slug_words.split('\n') if self.slug_words else None)
+
+    def get_used_slugs(self):
+        """
+        Return the cache key and UsedSlugs filter of race slugs used in this
+        category.
+
+        The filter is rebuilt from the database if it is not cached, or has
+        outgrown its capacity.
+        """
+        cache_key = '%s/used_slugs/%s' % (self.slug, self.slug_space.signature)
+        used = cache.get(cache_key)
+        if used is None or used.is_full:
+            slugs = self.race_set.values_list('slug', flat=True)
+            used = UsedSlugs(capacity=max(10000, 2 * slugs.count()))
+            for slug in slugs.iterator():
+                index = self.slug_space.index(slug)
+                if index is not None:
+                    used.add(index)
+        return cache_key, used
+
+    def slug_space_usage(self):
+        """
+        Return the number of race slugs used in this category, and the total
+        number of slugs available.
+        """
+        _, used = self.get_used_slugs()
+        return used.count, self.slug_space.size
 
     def __str__(self):
         return self.name
@@ -584,6 +728,12 @@ class Goal(models.Model):
     def hashid(self):
         return get_hashids(self.__class__).encode(self.id)
 
+    def cache_dependencies(self):
+        """
+        Return CacheKeys for cached data that includes this goal.
+        """
+        return self.category.data_cache_keys('goals')
+
     def __str__(self):
         return self.name
 
@@ -609,6 +759,12 @@ class Emote(models.Model):
             ),
         ]
 
+    def cache_dependencies(self):
+        """
+        Return CacheKeys for cached data that includes this emote.
+        """
+        return self.category.data_cache_keys('emotes')
+
 
 class AuditLog(AbstractAuditLog):
     """
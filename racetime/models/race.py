@@ -1,3 +1,4 @@
+import hashlib
 import json
 import random
 from collections import defaultdict
@@ -8,24 +9,30 @@ from channels.layers import get_channel_layer
 from django.apps import apps
 from django.conf import settings
 from django.contrib.humanize.templatetags.humanize import ordinal
+from django.core.cache import cache
 from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
-from django.db.models import F, Q
-from django.db.transaction import atomic
+from django.db.models import F, Max, Q
+from django.db.transaction import atomic, on_commit
+from django.middleware.csrf import get_token
 from django.template.loader import render_to_string
 from django.urls import reverse
 from django.utils import timezone
+from django.utils.dateparse import parse_duration
 from django.utils.functional import cached_property
 from django.utils.safestring import mark_safe
 from django.utils.text import slugify
-from trueskill import Rating, TrueSkill, quality_1vs1
+from trueskill import Rating
 
 from .choices import EntrantStates, RaceStates
+from .. import caching, instrumentation
+from ..caching import CacheKey
+from ..partition import pair_entrants
 from ..rating import rate_race
 from ..utils import (
     SafeException, ShieldedUser, SyncError, generate_team_name,
-    get_action_button, get_chat_history, timer_html, timer_str,
+    get_action_button, get_chat_history, set_bulk_ids, timer_html, timer_str,
 )
 
 
@@ -296,6 +303,11 @@ class Race(models.Model):
     OPEN_TIME_LIMIT = timedelta(hours=4)
     # Maximum number of race monitors that can be appointed.
     MAX_MONITORS = 5
+    # Race page variants (by template name suffix) that may be cached whole
+    # for anonymous visitors.
+    CACHED_PAGES = ('_detail', '_mini', '_spectate')
+    # Stands in for the CSRF token in renders shared between users.
+    CSRF_PLACEHOLDER = 'RACETIMECSRFTOKENPLACEHOLDER'
 
     class Meta:
         constraints = [
@@ -304,6 +316,9 @@ class Race(models.Model):
                 name='unique_category_slug',
             ),
         ]
+        indexes = [
+            models.Index(fields=('category', 'state', 'ended_at')),
+        ]
 
     def api_dict_summary(self, include_category=False, include_entrants=False):
         summary = {
@@ -339,6 +354,68 @@ class Race(models.Model):
             summary['recorded'] = self.recorded
         return summary
 
+    @property
+    def shell_cache_key(self):
+        """
+        Return the cache key for the parts of the race page that are the same
+        for every visitor.
+        """
+        return str(self) + '/shell'
+
+    @property
+    def version_cache_key(self):
+        """
+        Return the cache key holding this race's current version.
+        """
+        return str(self) + '/version'
+
+    @property
+    def summary_cache_key(self):
+        """
+        Return the cache key for this race's summary in its category's data.
+        """
+        return self.category.race_summary_key(self.slug)
+
+    def update_summary_cache(self):
+        """
+        Write this race's summary, as currently saved in the database,
+        through to the cache.
+
+        The race is read again rather than using this instance, which may
+        hold changes that were never saved or were rolled back.
+        """
+        try:
+            race = Race.objects.select_related('category', 'goal').get(pk=self.pk)
+        except Race.DoesNotExist:
+            cache.delete(self.summary_cache_key)
+            return
+        cache.set(
+            race.summary_cache_key,
+            race.api_dict_summary(),
+            settings.RT_CACHE_TIMEOUT.get('CategoryDataFragment', 0),
+        )
+
+    def cache_dependencies(self, include_category=True):
+        """
+        Return CacheKeys for cached data that includes this race.
+
+        If include_category is False, the category's race list and composed
+        data are left alone, and only this race's own summary is refreshed.
+        """
+        cache_keys = [
+            CacheKey('race_data', str(self) + '/data'),
+            CacheKey('race_page', self.shell_cache_key),
+            CacheKey('race_renders', str(self) + '/renders'),
+            CacheKey('race_renders', self.version_cache_key),
+            CacheKey('race_summary', self.summary_cache_key, self.update_summary_cache),
+        ] + [
+            CacheKey('race_page', '%s/page%s' % (self, suffix))
+            for suffix in self.CACHED_PAGES
+        ]
+        if include_category:
+            cache_keys += self.category.data_cache_keys('current_races')
+        return cache_keys
+
     def entrants_dicts(self):
         return [
             {
@@ -756,18 +833,40 @@ class Race(models.Model):
 
         Called when the race is created.
         """
+        messages = self.get_partition_messages()
+        for message in messages:
+            message.save()
+            message.broadcast()
+        if messages:
+            self.broadcast_data()
+
+    def get_partition_messages(self):
+        """
+        Return unsaved chat messages explaining the partitioning system, or
+        an empty list if this race is not partitionable.
+        """
         if not self.partitionable:
-            return
-        self.add_message(
-            'This is a 1v1 ladder race. Pairings will be picked automatically '
-            'when the room is partitioned by a bot or monitor.',
-            highlight=True,
-            pinned=True,
-        )
-        self.add_message(
-            'Once pairings are decided, you ##bad##cannot## quit this race, '
-            'so do not join unless you are willing to participate.'
-        )
+            return []
+        Message = apps.get_model('racetime', 'Message')
+        return [
+            Message(
+                race=self,
+                message=(
+                    'This is a 1v1 ladder race. Pairings will be picked '
+                    'automatically when the room is partitioned by a bot or '
+                    'monitor.'
+                ),
+                highlight=True,
+                pinned=True,
+            ),
+            Message(
+                race=self,
+                message=(
+                    'Once pairings are decided, you ##bad##cannot## quit this '
+                    'race, so do not join unless you are willing to participate.'
+                ),
+            ),
+        ]
 
     def broadcast_data(self):
         """
@@ -783,13 +882,49 @@ class Race(models.Model):
             'version': self.version,
         })
 
-    def broadcast_split(self, split):
+    def broadcast_splits(self, splits):
+        """
+        Broadcast a batch of new splits to connected WebSocket consumers.
+        """
         channel_layer = get_channel_layer()
         async_to_sync(channel_layer.group_send)(self.slug, {
-            'type': 'race.split',
-            'split': split,
+            'type': 'race.splits',
+            'splits': [split.as_dict() for split in splits],
         })
 
+    def get_splits(self, queued_only=False):
+        """
+        Return a list of this race's splits in the order they were reported,
+        optionally only those queued for the race bot to broadcast.
+        """
+        splits = self.split_set.select_related(
+            'entrant', 'entrant__race', 'entrant__user',
+        ).order_by('id')
+        if queued_only:
+            splits = splits.filter(queued=True)
+        return list(splits)
+
+    @property
+    def splits_queued_key(self):
+        """
+        Return the cache key that is set when this race has splits queued
+        for its race bot to broadcast.
+        """
+        return str(self) + '/splits_queued'
+
+    def broadcast_queued_splits(self):
+        """
+        Broadcast any splits queued for the race bot, and mark them as sent.
+
+        Splits are found by their queued flag rather than by ID, so that one
+        whose transaction commits after a later split is still picked up.
+        """
+        splits = self.get_splits(queued_only=True)
+        if splits:
+            self.broadcast_splits(splits)
+            Split.objects.filter(id__in=[split.id for split in splits]).update(queued=False)
+        return splits
+
     def deanonymise(self):
         """
         If race has hidden entrants, un-hide them and update prior system
@@ -843,23 +978,83 @@ class Race(models.Model):
         These chunks are ones that appear the same for every visitor, logged in
         or not.
         """
-        return {
-            'entrants': render_to_string('racetime/race/entrants.html', {'race': self}),
-            'intro': render_to_string('racetime/race/intro.html', {'race': self}),
-            'status': render_to_string('racetime/race/status.html', {'race': self}),
-            'streams': render_to_string('racetime/race/streams.html', {'race': self}),
-        }
+        with instrumentation.rendering():
+            return {
+                'entrants': render_to_string('racetime/race/entrants.html', {'race': self}),
+                'intro': render_to_string('racetime/race/intro.html', {'race': self}),
+                'status': render_to_string('racetime/race/status.html', {'race': self}),
+                'streams': render_to_string('racetime/race/streams.html', {'race': self}),
+            }
 
     def get_renders(self, user, request):
         """
         Return HTML renders of all important parts of the race screen.
 
         These chunks include some that are context-sensitive to the given user.
+        Renders are shared by every user with the same role in the race (see
+        get_render_role), and cached for the current race version.
+        """
+        role = self.get_render_role(user)
+        key = self.role_renders_cache_key(self.version, role)
+        renders = cache.get(key)
+        if renders is None:
+            with instrumentation.rendering():
+                renders = self.render_role(role, user)
+            cache.set(key, renders, settings.RT_CACHE_TIMEOUT.get('RaceRoleRenders', 0))
+        cache.set(
+            self.user_renders_cache_key(self.version, user.id),
+            key,
+            settings.RT_CACHE_TIMEOUT.get('RaceRoleRenders', 0),
+        )
+        return self.fill_renders(renders, request)
+
+    def get_render_role(self, user):
+        """
+        Return a tuple of everything about the given user that affects how
+        the race screen is rendered for them.
         """
-        can_edit = self.category.can_edit(user)
         can_moderate = self.category.can_moderate(user)
         can_monitor = self.can_monitor(user)
-        available_actions = self.available_actions(user)
+        entrant = self.in_race(user) if can_moderate and can_monitor else None
+        return (
+            tuple(self.available_actions(user)),
+            self.category.can_edit(user),
+            can_moderate,
+            can_monitor,
+            # Moderators may not disqualify themselves, so their renders
+            # differ from other moderators' if they have entered.
+            entrant.user_id if entrant else None,
+        )
+
+    def role_renders_cache_key(self, version, role):
+        """
+        Return the cache key for renders of the given race version and role.
+        """
+        return '%s/renders/%d/role/%s' % (
+            self,
+            version,
+            hashlib.md5(repr(role).encode()).hexdigest(),
+        )
+
+    def user_renders_cache_key(self, version, user_id):
+        """
+        Return the cache key pointing to the role renders last served to the
+        given user for the given race version.
+        """
+        return '%s/renders/%d/user/%d' % (self, version, user_id)
+
+    def render_role(self, role, user):
+        """
+        Render the user-specific parts of the race screen for a role.
+
+        The renders are made without a request, so CSRF tokens are left as
+        a placeholder to be filled in by fill_renders.
+        """
+        available_actions, can_edit, can_moderate, can_monitor, entrant_user_id = role
+        context = {
+            'csrf_token': self.CSRF_PLACEHOLDER,
+            'race': self,
+        }
 
         renders = {
             'actions': '',
@@ -869,32 +1064,44 @@ class Race(models.Model):
 
         if available_actions:
             renders['actions'] = render_to_string('racetime/race/actions.html', {
+                **context,
                 'available_actions': [
                     get_action_button(action, self.slug, self.category.slug)
                     for action in available_actions
                 ],
-                'race': self,
-            }, request)
+            })
         elif self.is_pending:
-            renders['actions'] = render_to_string('racetime/race/actions_pending.html', None, request)
+            renders['actions'] = render_to_string('racetime/race/actions_pending.html', context)
 
         if can_monitor:
             from ..forms import InviteForm
             renders['entrants_monitor'] = render_to_string('racetime/race/entrants_monitor.html', {
+                **context,
                 'can_edit': can_edit,
                 'can_moderate': can_moderate,
                 'can_monitor': can_monitor,
-                'race': self,
-            }, request)
+                'user': user if entrant_user_id else None,
+            })
             renders['monitor'] = render_to_string('racetime/race/monitor.html', {
+                **context,
                 'can_edit': can_edit,
                 'can_moderate': can_moderate,
                 'invite_form': InviteForm(),
-                'race': self,
-            }, request)
+            })
 
         return renders
 
+    @classmethod
+    def fill_renders(cls, renders, request):
+        """
+        Put the CSRF token for the given request into role renders.
+        """
+        token = get_token(request)
+        return {
+            segment: html.replace(cls.CSRF_PLACEHOLDER, token)
+            for segment, html in renders.items()
+        }
+
     def available_actions(self, user):
         """
         Return a list of actions the user can currently take.
@@ -1056,8 +1263,10 @@ class Race(models.Model):
 
     @property
     def can_partition(self):
+        # Only entrants who still have an account can be paired.
         entrants = self.entrant_set.filter(
             state=EntrantStates.joined.value,
+            user__isnull=False,
         )
         return (
             self.partitionable
@@ -1165,78 +1374,40 @@ class Race(models.Model):
             )
 
     def partition(self):
+        """
+        Close this race and split its entrants into 1v1 pairings.
+
+        Race rooms for each pairing are opened in the background by the race
+        bot (see RacePartition), which reports its progress in this room.
+        """
         if not self.can_partition:
             raise SafeException('Race cannot be partitioned yet.')
 
-        entrants = list(self.entrant_set.filter(
+        user_ids = list(self.entrant_set.filter(
             state=EntrantStates.joined.value,
-        ).select_related('user').order_by('id'))
+            user__isnull=False,
+        ).values_list('user_id', flat=True))
+        if len(user_ids) < 2:
+            # Entrants may have left since can_partition was checked.
+            raise SafeException('Race cannot be partitioned yet.')
 
         # Collect existing ratings
+        ratings = dict.fromkeys(user_ids)
         if self.recordable:
             UserRanking = apps.get_model('racetime', 'UserRanking')
-            ratings = {
-                ranking.user_id: Rating(mu=ranking.score, sigma=ranking.confidence)
-                for ranking in UserRanking.objects.filter(
-                    user_id__in=(entrant.user_id for entrant in entrants),
-                )
-            }
-        else:
-            # Not a ranked race so we'll just pick at random
-            ratings = {}
+            for ranking in UserRanking.objects.filter(
+                user_id__in=user_ids,
+                category=self.category,
+                goal=self.goal,
+            ):
+                ratings[ranking.user_id] = Rating(mu=ranking.score, sigma=ranking.confidence)
+        # If this is not a ranked race, everyone has the default rating and
+        # so will be paired at random.
 
-        # Sort entrants by their current score (and randomly shuffle anyone
-        # on the same score)
-        ranked_entrants = sorted([
-            {
-                'entrant_id': entrant.id,
-                'rating': ratings.get(entrant.user_id, Rating()),
-                'random': random.random(),
-            }
-            for entrant in entrants
-        ], key=lambda x: (x['rating'], x['random']))
-
-        # Determine matchup quality for each potential opponent
-        env = TrueSkill(backend='mpmath')
-        for i, entrant in enumerate(ranked_entrants):
-            entrant['matchups'] = {
-                quality_1vs1(entrant['rating'], opponent['rating'], env): opponent['entrant_id']
-                for opponent in ranked_entrants[max(0, i-3):i+4]
-                if opponent['entrant_id'] != entrant['entrant_id']
-            }
-            entrant['best_match'] = max(entrant['matchups'].keys())
-
-        # Go through each entrant in turn, starting with the one who has the
-        # worst best_match score. Give each entrant the best opponent possible
-        # that has not yet been picked
-        remaining_entrants = {entrant.id: entrant for entrant in entrants}
-        pairings = []
-        for entrant in sorted(ranked_entrants, key=lambda x: x['best_match']):
-            if entrant['entrant_id'] not in remaining_entrants:
-                continue
-            opponent_id = None
-            for quality, potential_opponent_id in sorted(entrant['matchups'].items(), key=lambda x: x[0], reverse=True):
-                if potential_opponent_id in remaining_entrants:
-                    opponent_id = potential_opponent_id
-                    break
-            if not opponent_id:
-                continue
-            entrant = remaining_entrants.pop(entrant['entrant_id'])
-            opponent = remaining_entrants.pop(opponent_id)
-            pairings.append([entrant, opponent])
-
-        # Randomly assign pairings for anyone who couldn't be matched
-        if remaining_entrants:
-            remaining_entrants = list(remaining_entrants.values())
-            random.shuffle(remaining_entrants)
-            for i in range(0, len(remaining_entrants), 2):
-                if i == len(remaining_entrants) - 1:
-                    # Only one entrant left
-                    random.choice(pairings).append(remaining_entrants[i])
-                else:
-                    pairings.append(tuple(remaining_entrants[i:i + 2]))
+        pairings = pair_entrants(ratings)
 
         # Close this race
+        RacePartition = apps.get_model('racetime', 'RacePartition')
         with atomic():
             self.deanonymise()
             self.entrant_set.all().update(state=EntrantStates.partitioned.value)
@@ -1247,55 +1418,15 @@ class Race(models.Model):
             self.update_entrant_ratings()
             self.version = F('version') + 1
             self.save()
-
-        # Open race rooms for each pairing
-        parent_race_url = settings.RT_SITE_URI + self.get_absolute_url()
-        for pairing in pairings:
-            race = Race.objects.create(
-                category=self.category,
-                goal=self.goal,
-                custom_goal=self.custom_goal,
-                info_bot=self.info_bot,
-                info_user=self.info_user,
-                slug=self.category.generate_race_slug(),
-                state=RaceStates.open.value,
-                team_race=self.team_race,
-                require_even_teams=self.require_even_teams,
-                ranked=self.ranked,
-                unlisted=self.unlisted,
-                partitionable=False,
-                recordable=not (self.custom_goal or not self.ranked),
-                start_delay=self.start_delay,
-                time_limit=self.time_limit,
-                time_limit_auto_complete=self.time_limit_auto_complete,
-                streaming_required=self.streaming_required,
-                auto_start=self.auto_start,
-                disqualify_unready=True,
-                allow_comments=self.allow_comments,
-                hide_comments=self.hide_comments,
-                hide_entrants=True,
-                allow_prerace_chat=False,
-                allow_midrace_chat=False,
-                allow_non_entrant_chat=False,
-                chat_message_delay=self.chat_message_delay,
+            RacePartition.objects.create(
+                race=self,
+                pairings=pairings,
             )
-            race.monitors.set(self.monitors.all())
-            race.add_message(f'Race partitioned from {parent_race_url}')
-            race_url = settings.RT_SITE_URI + race.get_absolute_url()
-            for entrant in pairing:
-                race.join(entrant.user)
-                message = self.message_set.create(
-                    direct_to=entrant.user,
-                    message=f'This is your race room: {race_url}',
-                )
-                message.broadcast()
-            race.state = RaceStates.invitational.value
-            race.version = F('version') + 1
-            race.save()
 
         self.add_message(
-            'Race has been partitioned. Entrants, follow the link in your DM '
-            'to continue.',
+            'Race has been partitioned into %(count)d race rooms. Entrants, '
+            'follow the link in your DM to continue (it may take a moment to '
+            'arrive).' % {'count': len(pairings)},
             highlight=True,
         )
 
@@ -1325,6 +1456,7 @@ class Race(models.Model):
             self.version = F('version') + 1
             self.save()
             self.__dnf_remaining_entrants()
+            self.update_user_stats()
 
         if self.state == RaceStates.finished.value:
             self.add_message(
@@ -1346,7 +1478,9 @@ class Race(models.Model):
         self.cancelled_at = None
         self.recordable = not self.custom_goal
         self.version = F('version') + 1
-        self.save()
+        with atomic():
+            self.save()
+            self.update_user_stats()
 
         self.add_message('Race timer restarted.', highlight=True)
 
@@ -1367,7 +1501,9 @@ class Race(models.Model):
             self.recorded_by = recorded_by
             self.unlisted = False
             self.version = F('version') + 1
-            self.save()
+            with atomic():
+                self.save()
+                self.update_user_stats()
 
             rate_race(self)
 
@@ -1391,7 +1527,9 @@ class Race(models.Model):
             self.recordable = False
             self.unlisted = False
             self.version = F('version') + 1
-            self.save()
+            with atomic():
+                self.save()
+                self.update_user_stats()
             self.add_message(
                 'Race set to not recorded by %(unrecorded_by)s'
                 % {'unrecorded_by': unrecorded_by},
@@ -1548,6 +1686,19 @@ class Race(models.Model):
         else:
             self.entrant_set.update(rating=None)
 
+    def update_user_stats(self):
+        """
+        Update the profile stats rollup for every user entered in this race.
+
+        This needs to be done whenever the race finishes, or the results of a
+        finished race change.
+        """
+        UserStats = apps.get_model('racetime', 'UserStats')
+        UserStats.objects.refresh(
+            self.category,
+            self.entrant_set.filter(user__isnull=False).values_list('user_id', flat=True),
+        )
+
     def join(self, user):
         """
         Enter the given user into this race.
@@ -1742,6 +1893,7 @@ class Race(models.Model):
         self.update_entrant_ratings()
         self.version = F('version') + 1
         self.save()
+        self.update_user_stats()
 
     def get_absolute_url(self):
         """
@@ -2434,6 +2586,8 @@ class Entrant(models.Model):
             )
             if self.finish_time:
                 self.race.recalculate_places()
+            if self.race.is_done:
+                self.race.update_user_stats()
         else:
             raise SyncError('You cannot disqualify ths entrant at this time. Refresh to continue.')
 
@@ -2505,17 +2659,366 @@ class Entrant(models.Model):
 
     def update_split(self, split_name, split_time, is_finish):
         """
-        Sends live split data to racers including undos and finishes.
+        Record a live split, including undos and finishes.
+
+        While the race is in progress, the split is queued and its race bot
+        broadcasts it in a batch with any others (see RaceBot.broadcast_splits).
+        Otherwise the split is sent out straight away.
         """
-        split = {
-            'split_name': split_name.lower(),
-            'split_time': split_time,
-            'is_undo': split_time == '-',
-            'is_finish': is_finish,
-            'user_id': self.user_display.hashid,
-        }
+        split_name = split_name.lower()
+        is_undo = split_time == '-'
+        try:
+            duration = None if is_undo else parse_duration(split_time)
+        except OverflowError:
+            raise SafeException('Split time is too large.')
+        queued = self.race.is_in_progress and self.race.bot_pid is not None
+
+        delta = None
+        if duration is not None:
+            # Compare against the fastest time to this split by any other
+            # entrant, ignoring splits they have since undone.
+            times = {}
+            for other in self.race.split_set.filter(
+                name=split_name,
+            ).exclude(entrant=self).order_by('id'):
+                times[other.entrant_id] = None if other.is_undo else other.duration
+            leader = min((time for time in times.values() if time is not None), default=None)
+            if leader is not None:
+                delta = duration - leader
+
+        with atomic():
+            # Lock the entrant so that concurrent splits get distinct indexes.
+            Entrant.objects.select_for_update().get(pk=self.pk)
+            index = self.split_set.aggregate(Max('index'))['index__max']
+            split = Split.objects.create(
+                race=self.race,
+                entrant=self,
+                index=0 if index is None else index + 1,
+                name=split_name,
+                split_time=split_time,
+                duration=duration,
+                delta=delta,
+                is_undo=is_undo,
+                is_finish=is_finish,
+                queued=queued,
+            )
+            if queued:
+                on_commit(lambda: cache.set(self.race.splits_queued_key, True))
+
+        if not queued:
+            self.race.broadcast_splits([split])
+
+    def cache_dependencies(self):
+        """
+        Return CacheKeys for cached data that includes this entrant.
 
-        self.race.broadcast_split(split)
+        Entrants only show up in category data through the race's summary,
+        so the category data is left to expire rather than being rebuilt on
+        every entrant change.
+        """
+        return self.race.cache_dependencies(include_category=False)
 
     def __str__(self):
         return str(self.user_display)
+
+
+class Split(models.Model):
+    """
+    A live split reported by a race entrant, e.g. from LiveSplit.
+
+    Splits form an append-only log for each race, so that anyone joining
+    part-way through can catch up on the splits they missed. Undos are
+    recorded as splits too.
+    """
+    race = models.ForeignKey(
+        'Race',
+        on_delete=models.CASCADE,
+    )
+    entrant = models.ForeignKey(
+        'Entrant',
+        on_delete=models.CASCADE,
+    )
+    index = models.PositiveIntegerField(
+        help_text='Order in which this entrant reported their splits.',
+    )
+    name = models.CharField(
+        max_length=255,
+    )
+    split_time = models.CharField(
+        max_length=64,
+        help_text='Split time as reported by the entrant.',
+    )
+    duration = models.DurationField(
+        null=True,
+        help_text='Split time, if it could be understood.',
+    )
+    delta = models.DurationField(
+        null=True,
+        help_text='Difference from the fastest time to this split by another entrant.',
+    )
+    is_undo = models.BooleanField(
+        default=False,
+    )
+    is_finish = models.BooleanField(
+        default=False,
+    )
+    queued = models.BooleanField(
+        default=False,
+        help_text='Waiting for the race bot to broadcast it.',
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=('entrant', 'index'),
+                name='unique_entrant_split_index',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=('race', 'queued')),
+        ]
+
+    def as_dict(self):
+        return {
+            'split_name': self.name,
+            'split_time': self.split_time,
+            'is_undo': self.is_undo,
+            'is_finish': self.is_finish,
+            'user_id': self.entrant.user_display.hashid,
+            'delta': (
+                ('+' if self.delta >= timedelta(0) else '') + timer_str(self.delta)
+                if self.delta is not None else None
+            ),
+        }
+
+    def __str__(self):
+        return '%s: %s' % (self.entrant, self.name)
+
+
+class RacePartitionManager(models.Manager):
+    """
+    Default manager for the RacePartition model.
+    """
+    def process_batch(self, partition_id, batch_size=50):
+        """
+        Open the next batch of race rooms for the given partition, in its own
+        transaction.
+
+        Returns True if there is more work to do. Returns False once the
+        partition is complete, or if another worker is processing it.
+        """
+        with atomic():
+            partition = self.select_for_update(skip_locked=True).filter(
+                id=partition_id,
+                completed_at__isnull=True,
+            ).first()
+            if not partition:
+                return False
+            dms = partition.open_races(batch_size)
+            partition.save()
+        partition.broadcast_progress(dms)
+        return partition.completed_at is None
+
+
+class RacePartition(models.Model):
+    """
+    Tracks the progress of opening race rooms for a partitioned race.
+
+    Pairings are decided as soon as the race is partitioned. The race rooms
+    for them are then opened by the race bot in batches, each one recording
+    how far it got, so that an interrupted partition can resume where it left
+    off.
+    """
+    race = models.OneToOneField(
+        'Race',
+        on_delete=models.CASCADE,
+    )
+    pairings = models.JSONField(
+        help_text='List of pairings, each a list of user IDs.',
+    )
+    cursor = models.PositiveIntegerField(
+        default=0,
+        help_text='Number of pairings that have race rooms.',
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+    )
+    completed_at = models.DateTimeField(
+        null=True,
+        db_index=True,
+    )
+
+    objects = RacePartitionManager()
+
+    def new_race(self, slug):
+        """
+        Return an unsaved race room for a pairing, inheriting its settings
+        from the partitioned race.
+        """
+        race = self.race
+        return Race(
+            category=race.category,
+            goal=race.goal,
+            custom_goal=race.custom_goal,
+            info_bot=race.info_bot,
+            info_user=race.info_user,
+            slug=slug,
+            state=RaceStates.invitational.value,
+            team_race=race.team_race,
+            require_even_teams=race.require_even_teams,
+            ranked=race.ranked,
+            unlisted=race.unlisted,
+            partitionable=False,
+            recordable=not (race.custom_goal or not race.ranked),
+            start_delay=race.start_delay,
+            time_limit=race.time_limit,
+            time_limit_auto_complete=race.time_limit_auto_complete,
+            streaming_required=race.streaming_required,
+            auto_start=race.auto_start,
+            disqualify_unready=True,
+            allow_comments=race.allow_comments,
+            hide_comments=race.hide_comments,
+            hide_entrants=True,
+            allow_prerace_chat=False,
+            allow_midrace_chat=False,
+            allow_non_entrant_chat=False,
+            chat_message_delay=race.chat_message_delay,
+        )
+
+    def open_races(self, batch_size):
+        """
+        Open race rooms for the next batch of pairings, creating the races,
+        their entrants and chat messages in bulk.
+
+        Returns the DMs sent to entrants in the partitioned race, which need
+        to be broadcast once the transaction is committed.
+        """
+        Message = apps.get_model('racetime', 'Message')
+        MessageLink = apps.get_model('racetime', 'MessageLink')
+        User = apps.get_model('racetime', 'User')
+        UserRanking = apps.get_model('racetime', 'UserRanking')
+
+        parent = self.race
+        pairings = self.pairings[self.cursor:self.cursor + batch_size]
+        user_ids = [user_id for pairing in pairings for user_id in pairing]
+        users = User.objects.in_bulk(user_ids)
+
+        slugs = parent.category.generate_race_slugs(len(pairings))
+        races = [self.new_race(slug) for slug in slugs]
+        Race.objects.bulk_create(races)
+        set_bulk_ids(races, parent.category.race_set.filter(slug__in=slugs))
+
+        monitor_ids = list(parent.monitors.values_list('id', flat=True))
+        Race.monitors.through.objects.bulk_create([
+            Race.monitors.through(race_id=race.id, user_id=user_id)
+            for race in races
+            for user_id in monitor_ids
+        ])
+
+        ratings = {}
+        if races[0].recordable:
+            ratings = dict(UserRanking.objects.filter(
+                user_id__in=user_ids,
+                category=parent.category,
+                goal=parent.goal,
+            ).values_list('user_id', 'rating'))
+        entrants = [
+            Entrant(
+                race=race,
+                user=users[user_id],
+                rating=ratings.get(user_id),
+            )
+            for race, pairing in zip(races, pairings)
+            for user_id in pairing
+            if user_id in users
+        ]
+        Entrant.objects.bulk_create(entrants)
+        set_bulk_ids(entrants, Entrant.objects.filter(race__in=races))
+
+        # Chat messages for each new room, the same as if everyone had
+        # joined normally.
+        parent_race_url = settings.RT_SITE_URI + parent.get_absolute_url()
+        messages = []
+        links = []
+        for race in races:
+            messages.append(Message(
+                race=race,
+                message=f'Race partitioned from {parent_race_url}',
+            ))
+        for entrant in entrants:
+            message = Message(
+                race=entrant.race,
+                message='%(user)s joins the race.' % {'user': entrant.user_display},
+            )
+            messages.append(message)
+            links.append(MessageLink(
+                message=message,
+                user=entrant.user,
+                anonymised_message='(deleted user) joins the race.',
+            ))
+        Message.objects.bulk_create(messages)
+        set_bulk_ids(messages, Message.objects.filter(race__in=races))
+        for link in links:
+            link.message_id = link.message.pk
+        MessageLink.objects.bulk_create(links)
+
+        # DMs in the partitioned race, pointing each entrant to their room.
+        last_message_id = parent.message_set.aggregate(Max('id'))['id__max'] or 0
+        dms = [
+            Message(
+                race=parent,
+                direct_to=entrant.user,
+                message=f'This is your race room: {settings.RT_SITE_URI}{entrant.race.get_absolute_url()}',
+            )
+            for entrant in entrants
+        ]
+        Message.objects.bulk_create(dms)
+        set_bulk_ids(dms, parent.message_set.filter(
+            id__gt=last_message_id,
+            direct_to__in=[dm.direct_to for dm in dms],
+            user=None,
+            bot=None,
+        ))
+
+        caching.schedule(parent.category.data_cache_keys('current_races'))
+
+        self.cursor += len(pairings)
+        if self.cursor >= len(self.pairings):
+            self.completed_at = timezone.now()
+        return dms
+
+    def broadcast_progress(self, dms):
+        """
+        Send out DMs for the last batch of race rooms, and report progress in
+        the partitioned race.
+        """
+        if dms:
+            channel_layer = get_channel_layer()
+            async_to_sync(channel_layer.group_send)(self.race.slug, {
+                'type': 'chat.dms',
+                'messages': [
+                    {
+                        'from_user': None,
+                        'from_bot': None,
+                        'to': dm.direct_to.api_dict_minimal(),
+                        'message': dm.hashid,
+                    }
+                    for dm in dms
+                ],
+            })
+        if self.completed_at:
+            self.race.add_message(
+                'All %(count)d race rooms are open.' % {'count': len(self.pairings)},
+                highlight=True,
+            )
+        else:
+            self.race.add_message(
+                'Opened %(done)d of %(count)d race rooms…'
+                % {'done': self.cursor, 'count': len(self.pairings)},
+            )
+
+    def __str__(self):
+        return str(self.race)
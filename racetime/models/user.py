@@ -1,17 +1,23 @@
+import random
+
 import requests
+from django.apps import apps
 from django.conf import settings
 from django.contrib.auth.base_user import AbstractBaseUser, BaseUserManager
 from django.contrib.auth.models import PermissionsMixin
+from django.core.mail import send_mail
 from django.core.validators import MinLengthValidator, RegexValidator
 from django.db import models
-from django.db.models import Q
+from django.db.models import Count, Q
+from django.db.transaction import atomic, on_commit
 from django.urls import reverse
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.utils.functional import cached_property
 from django.utils.text import slugify
 
 from .choices import EntrantStates, RaceStates
-from ..utils import determine_ip, get_hashids, timer_html
+from ..utils import determine_ip, get_hashids, notice_exception, timer_html
 from ..validators import UsernameValidator
 
 
@@ -49,6 +55,32 @@ class UserManager(BaseUserManager):
 
         return self._create_user(email, password, **extra_fields)
 
+    def allocate_discriminator(self, name, exclude_id=None, candidates=20):
+        """
+        Return a random discriminator (scrim) that no other user with the
+        given name is using.
+
+        A handful of random candidates are checked with a single query first,
+        so this stays fast no matter how common the name is. Only if they are
+        all taken is every scrim in use for the name looked up.
+        """
+        others = self.filter(name=name)
+        if exclude_id:
+            others = others.exclude(id=exclude_id)
+
+        choices = ['%04d' % i for i in random.sample(range(1, 9999), candidates)]
+        taken = set(others.filter(
+            discriminator__in=choices,
+        ).values_list('discriminator', flat=True))
+        for choice in choices:
+            if choice not in taken:
+                return choice
+
+        taken = set(others.values_list('discriminator', flat=True))
+        return random.choice(sorted(
+            {'%04d' % i for i in range(1, 9999)} - taken
+        ))
+
     def filter_active(self):
         """
         Filter users to active accounts, excluding the system user.
@@ -244,6 +276,7 @@ class User(AbstractBaseUser, PermissionsMixin):
     class Meta:
         indexes = [
             models.Index(fields=('is_supporter', 'patreon_id')),
+            models.Index(fields=('name', 'discriminator')),
         ]
 
     objects = UserManager()
@@ -252,6 +285,25 @@ class User(AbstractBaseUser, PermissionsMixin):
     REQUIRED_FIELDS = ['name']
     SYSTEM_USER = 'system@racetime.gg'
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the saved name and scrim, see name_changed.
+        instance._saved_name = (
+            instance.__dict__.get('name'),
+            instance.__dict__.get('discriminator'),
+        )
+        return instance
+
+    @property
+    def name_changed(self):
+        """
+        Determine if the user's name or scrim has changed since they were
+        loaded from the database. New users are always considered changed.
+        """
+        saved_name = getattr(self, '_saved_name', None)
+        return saved_name is None or saved_name != (self.name, self.discriminator)
+
     @cached_property
     def active_race_entrant(self):
         """
@@ -567,6 +619,117 @@ class UserRanking(models.Model):
         return timer_html(self.best_time, False) if self.best_time else None
 
 
+class UserStatsManager(models.Manager):
+    """
+    Default manager for the UserStats model.
+    """
+    def calculate(self, category, user_ids=None):
+        """
+        Calculate (but do not save) the stats rollup for the given users in
+        a category.
+
+        If no user IDs are given, every user who has entered a race in the
+        category will be calculated.
+        """
+        Entrant = apps.get_model('racetime', 'Entrant')
+        entrants = Entrant.objects.filter(
+            user__isnull=False,
+            race__category=category,
+            race__state=RaceStates.finished.value,
+            race__unlisted=False,
+        )
+        if user_ids is not None:
+            entrants = entrants.filter(user_id__in=user_ids)
+
+        return [
+            self.model(category=category, **values)
+            for values in entrants.values('user_id').annotate(
+                times_entered=Count('id'),
+                times_first=Count('id', filter=Q(place=1)),
+                times_second=Count('id', filter=Q(place=2)),
+                times_third=Count('id', filter=Q(place=3)),
+                times_forfeited=Count('id', filter=Q(dnf=True) | Q(dq=True)),
+            ).order_by()
+        ]
+
+    def refresh(self, category, user_ids=None):
+        """
+        Recalculate and save the stats rollup for the given users in a
+        category.
+        """
+        existing = self.filter(category=category)
+        if user_ids is not None:
+            user_ids = list(user_ids)
+            existing = existing.filter(user_id__in=user_ids)
+
+        stats = self.calculate(category, user_ids)
+
+        with atomic():
+            existing.delete()
+            self.bulk_create(stats)
+
+        return stats
+
+
+class UserStats(models.Model):
+    """
+    A rollup of a user's race results within a category.
+
+    These figures are shown on the user's profile, and are recalculated
+    whenever a race finishes or has its results changed. Use the
+    update_user_stats management command to rebuild them from scratch.
+    """
+    user = models.ForeignKey(
+        'User',
+        on_delete=models.CASCADE,
+    )
+    category = models.ForeignKey(
+        'Category',
+        on_delete=models.CASCADE,
+    )
+    times_entered = models.PositiveIntegerField(
+        default=0,
+    )
+    times_first = models.PositiveIntegerField(
+        default=0,
+    )
+    times_second = models.PositiveIntegerField(
+        default=0,
+    )
+    times_third = models.PositiveIntegerField(
+        default=0,
+    )
+    times_forfeited = models.PositiveIntegerField(
+        default=0,
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+    )
+
+    objects = UserStatsManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'category'),
+                name='unique_user_category_stats',
+            ),
+        ]
+        verbose_name_plural = 'User stats'
+
+    def as_tuple(self):
+        """
+        Return the stat counts as a tuple, for easy comparison.
+        """
+        return (
+            self.times_entered,
+            self.times_first,
+            self.times_second,
+            self.times_third,
+            self.times_forfeited,
+        )
+
+
 class Ban(models.Model):
     """
     A user ban. There are many like it but this one is theirs.
@@ -687,3 +850,236 @@ class UserAction(models.Model):
         db_index=True,
         null=True,
     )
+
+
+class UserDeletionManager(models.Manager):
+    """
+    Default manager for the UserDeletion model.
+    """
+    def process_batch(self, deletion_id, batch_size=500):
+        """
+        Run the next batch of work for the given deletion, in its own
+        transaction.
+
+        Returns True if there is more work to do. Returns False once the
+        deletion is complete, or if another worker is processing it.
+        """
+        with atomic():
+            deletion = self.select_for_update(skip_locked=True).filter(
+                id=deletion_id,
+                completed_at__isnull=True,
+            ).first()
+            if not deletion:
+                return False
+            getattr(deletion, 'process_' + deletion.stage)(batch_size)
+            deletion.save()
+        return deletion.completed_at is None
+
+
+class UserDeletion(models.Model):
+    """
+    Tracks the progress of an account deletion.
+
+    The user is deactivated as soon as they ask for their account to be
+    deleted. Their data is then anonymised in a series of small batches (see
+    UserDeletionManager.process_batch), each one recording how far it got, so
+    that an interrupted deletion can resume where it left off. Rows that
+    refer to the user are then deleted (or unlinked) in batches too, leaving
+    little for deleting the account itself to do.
+
+    Finally the deletion is marked complete, the user's details are cleared
+    from it, and the user is notified by email once that is committed.
+    """
+    STAGES = (
+        'comments',
+        'message_links',
+        'messages',
+        'related',
+        'user',
+        'email',
+    )
+
+    user = models.ForeignKey(
+        'User',
+        on_delete=models.SET_NULL,
+        null=True,
+    )
+    stage = models.CharField(
+        max_length=16,
+        choices=[(stage, stage) for stage in STAGES],
+        default=STAGES[0],
+    )
+    cursor = models.PositiveIntegerField(
+        default=0,
+        help_text='ID of the last object processed in the current stage.',
+    )
+    name_map = models.JSONField(
+        help_text=(
+            'Names the user has had, and when they stopped being used. Used '
+            'to anonymise older system messages.'
+        ),
+    )
+    name_window = models.PositiveSmallIntegerField(
+        default=0,
+    )
+    email = models.EmailField(
+        max_length=255,
+    )
+    email_subject = models.TextField()
+    email_message = models.TextField()
+    email_html = models.TextField()
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+    )
+    completed_at = models.DateTimeField(
+        null=True,
+        db_index=True,
+    )
+
+    objects = UserDeletionManager()
+
+    def next_stage(self):
+        self.stage = self.STAGES[self.STAGES.index(self.stage) + 1]
+        self.cursor = 0
+
+    def process_comments(self, batch_size):
+        """
+        Delete the user's race comments.
+        """
+        Entrant = apps.get_model('racetime', 'Entrant')
+        ids = list(Entrant.objects.filter(
+            user_id=self.user_id,
+            id__gt=self.cursor,
+        ).order_by('id').values_list('id', flat=True)[:batch_size])
+        if ids:
+            Entrant.objects.filter(id__in=ids).update(comment=None)
+            self.cursor = ids[-1]
+        else:
+            self.next_stage()
+
+    def process_message_links(self, batch_size):
+        """
+        Anonymise system messages that mention the user.
+        """
+        Message = apps.get_model('racetime', 'Message')
+        MessageLink = apps.get_model('racetime', 'MessageLink')
+        links = list(MessageLink.objects.filter(
+            user_id=self.user_id,
+            id__gt=self.cursor,
+        ).select_related('message').order_by('id')[:batch_size])
+        if links:
+            messages = []
+            for link in links:
+                link.message.message = link.anonymised_message
+                messages.append(link.message)
+            Message.objects.bulk_update(messages, ['message'])
+            self.cursor = links[-1].id
+        else:
+            self.next_stage()
+
+    def process_messages(self, batch_size):
+        """
+        Anonymise older system messages, from before messages were linked to
+        the users they mention, by replacing each name the user had at the
+        time.
+        """
+        if self.name_window >= len(self.name_map):
+            self.next_stage()
+            return
+
+        Message = apps.get_model('racetime', 'Message')
+        date_to, name = self.name_map[self.name_window]
+        messages = Message.objects.filter(
+            user=None,
+            bot=None,
+            posted_at__lte=parse_datetime(date_to),
+            message__contains=name,
+            id__gt=self.cursor,
+        )
+        if self.name_window > 0:
+            messages = messages.filter(
+                posted_at__gte=parse_datetime(self.name_map[self.name_window - 1][0]),
+            )
+        messages = list(messages.order_by('id')[:batch_size])
+        if messages:
+            for message in messages:
+                message.message = message.message.replace(name, '(deleted user)')
+            Message.objects.bulk_update(messages, ['message'])
+            self.cursor = messages[-1].id
+        else:
+            self.name_window += 1
+            self.cursor = 0
+
+    def process_related(self, batch_size):
+        """
+        Delete rows that would be deleted along with the user, and unlink
+        those that would be kept, a batch at a time.
+        """
+        if self.user_id is None:
+            self.next_stage()
+            return
+
+        User = apps.get_model('racetime', 'User')
+        for relation in User._meta.related_objects:
+            if (
+                relation.many_to_many
+                or relation.related_model is UserDeletion
+                or relation.on_delete not in (models.CASCADE, models.SET_NULL)
+            ):
+                continue
+            manager = relation.related_model._base_manager
+            ids = list(manager.filter(**{
+                relation.field.name: self.user_id,
+            }).order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if ids:
+                if relation.on_delete is models.CASCADE:
+                    manager.filter(pk__in=ids).delete()
+                else:
+                    manager.filter(pk__in=ids).update(**{relation.field.name: None})
+                return
+        self.next_stage()
+
+    def process_user(self, batch_size):
+        """
+        Delete the user account.
+        """
+        if self.user:
+            self.user.delete()
+            self.user = None
+        self.next_stage()
+
+    def process_email(self, batch_size):
+        """
+        Mark the deletion complete and forget the user's details, then let
+        them know their account has been deleted once that is committed.
+
+        The email is only ever sent once. If sending it fails, it is not
+        retried.
+        """
+        email = {
+            'subject': self.email_subject,
+            'message': self.email_message,
+            'html_message': self.email_html,
+            'from_email': settings.EMAIL_FROM,
+            'recipient_list': [self.email],
+        }
+        on_commit(lambda: self.send_email(email))
+        self.email = ''
+        self.email_subject = ''
+        self.email_message = ''
+        self.email_html = ''
+        self.name_map = []
+        self.completed_at = timezone.now()
+
+    @staticmethod
+    def send_email(email):
+        try:
+            send_mail(**email)
+        except Exception as ex:
+            notice_exception(ex)
+
+    def __str__(self):
+        return '#%d (%s)' % (self.id, 'complete' if self.completed_at else self.stage)
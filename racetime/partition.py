@@ -0,0 +1,140 @@
+"""
+Pairing of entrants for partitioned (1v1 ladder) races.
+
+Entrants are sorted by rating, and each one may only be paired with someone
+within WINDOW places of them. Within that band, pairings are chosen as a
+maximum-weight matching, where the weight of a pairing is its TrueSkill match
+quality. Good matchups are only ever found between closely rated entrants,
+so restricting the search to a band loses nothing in practice, and keeps the
+matching fast enough for races with several hundred entrants.
+"""
+import math
+import random
+
+from trueskill import Rating, TrueSkill
+
+# How many places apart (in rating order) two entrants can be and still be
+# paired together.
+WINDOW = 6
+
+
+def quality(rating1, rating2, beta):
+    """
+    Return the TrueSkill match quality of a 1v1 between the two ratings.
+
+    This is the closed form of trueskill.quality_1vs1, which is otherwise
+    computed with general-purpose matrix maths.
+    """
+    variance = 2 * beta ** 2 + rating1.sigma ** 2 + rating2.sigma ** 2
+    return (
+        math.sqrt(2 * beta ** 2 / variance)
+        * math.exp(-(rating1.mu - rating2.mu) ** 2 / (2 * variance))
+    )
+
+
+def quality_band(ratings, window=WINDOW, env=None):
+    """
+    Return match qualities for a list of ratings, sorted by mu.
+
+    The result is a list of rows, where row[i][j - 1] is the quality of a
+    matchup between ratings[i] and ratings[i + j], for j from 1 to window.
+    """
+    beta = (env or TrueSkill()).beta
+    return [
+        [
+            quality(rating, opponent, beta)
+            for opponent in ratings[i + 1:i + 1 + window]
+        ]
+        for i, rating in enumerate(ratings)
+    ]
+
+
+def pair_entrants(ratings, window=WINDOW, env=None):
+    """
+    Split entrants into pairings.
+
+    ratings should be a dict of entrant key (e.g. user ID) to Rating, with
+    entrants that have no rating mapped to None. Returns a list of pairings,
+    each a list of entrant keys. If there is an odd number of entrants, the
+    one left over is added to whichever pairing they have the best matchups
+    with, making it a three-way race.
+    """
+    env = env or TrueSkill()
+    if len(ratings) < 2:
+        raise ValueError('Cannot pair fewer than two entrants.')
+
+    # Sort entrants by score, shuffling anyone on the same score.
+    entrants = sorted(
+        ((rating or Rating(), random.random(), key) for key, rating in ratings.items()),
+        key=lambda x: (x[0].mu, x[1]),
+    )
+    keys = [key for _, _, key in entrants]
+    sorted_ratings = [rating for rating, _, _ in entrants]
+    band = quality_band(sorted_ratings, window, env)
+
+    matches, leftover = _match(band, window)
+    pairings = [[keys[i], keys[j]] for i, j in matches]
+
+    if leftover is not None:
+        beta = env.beta
+        best = max(range(len(matches)), key=lambda m: (
+            sum(
+                quality(sorted_ratings[leftover], sorted_ratings[i], beta)
+                for i in matches[m]
+            ),
+            random.random(),
+        ))
+        pairings[best].append(keys[leftover])
+
+    random.shuffle(pairings)
+    return pairings
+
+
+def _match(band, window):
+    """
+    Find the pairings with the highest total quality, as a list of (i, j)
+    index tuples. If there is an odd number of entrants, one of them is left
+    out, and their index is returned as well.
+
+    This is dynamic programming over entrants in rating order. The state is
+    a bitmask of which of the next few entrants have already been paired up
+    (bit 0 being the current entrant), plus whether anyone has been left out
+    yet.
+    """
+    n = len(band)
+    can_skip = n % 2 == 1
+    # Each layer maps state -> (total quality, previous state, action), where
+    # action is the offset of the opponent picked, 0 if the entrant was left
+    # out, or None if they had already been paired.
+    layers = [{(0, False): (0.0, None, None)}]
+    for i in range(n):
+        layer = {}
+
+        def offer(state, score, previous, action):
+            if state not in layer or layer[state][0] < score:
+                layer[state] = (score, previous, action)
+
+        for state, (score, _, _) in layers[-1].items():
+            mask, skipped = state
+            if mask & 1:
+                offer((mask >> 1, skipped), score, state, None)
+                continue
+            for j in range(1, min(window, n - 1 - i) + 1):
+                if not mask & (1 << j):
+                    offer(((mask | (1 << j)) >> 1, skipped), score + band[i][j - 1], state, j)
+            if can_skip and not skipped:
+                offer((mask >> 1, True), score, state, 0)
+        layers.append(layer)
+
+    matches = []
+    leftover = None
+    state = (0, can_skip)
+    for i in range(n, 0, -1):
+        _, previous, action = layers[i][state]
+        if action == 0:
+            leftover = i - 1
+        elif action:
+            matches.append((i - 1, i - 1 + action))
+        state = previous
+    matches.reverse()
+    return matches, leftover
@@ -1,26 +1,153 @@
 import logging
 import os
+from bisect import bisect_left
+from contextlib import contextmanager
 from datetime import timedelta
 from itertools import chain
-from time import sleep
+from time import perf_counter, sleep
 
 import requests
 from django.conf import settings
+from django.core.cache import cache
 from django.db.models import F
 from django.utils import timezone
 
-from . import models
+from . import instrumentation, models
 from .utils import chunkify, notice_exception
 
 
+class BotStats:
+    """
+    Timings collected by a race bot process.
+
+    Two things are measured: how long each phase of the bot loop takes, and
+    scheduling lag, which is how late a timed action (a countdown message,
+    the race start, a time limit) happened relative to when it was due.
+    Lag is kept as a histogram for each kind of action and for each race.
+
+    Stats are published to the cache every PUBLISH_INTERVAL, and expire if
+    the process stops. See get_all().
+    """
+    # Upper bounds of the lag histogram buckets, in seconds. The last bucket
+    # counts everything above these.
+    BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    PUBLISH_INTERVAL = timedelta(seconds=10)
+    PIDS_KEY = 'racebot/stats/pids'
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.started_at = timezone.now()
+        self.last_publish = None
+        self.phases = {}
+        self.lag = {}
+
+    @classmethod
+    def new_histogram(cls):
+        return {
+            'count': 0,
+            'total': 0.0,
+            'max': 0.0,
+            'buckets': [0] * (len(cls.BUCKETS) + 1),
+        }
+
+    @classmethod
+    def add_to_histogram(cls, histogram, seconds):
+        histogram['count'] += 1
+        histogram['total'] += seconds
+        histogram['max'] = max(histogram['max'], seconds)
+        histogram['buckets'][bisect_left(cls.BUCKETS, seconds)] += 1
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Time the block as one run of the named loop phase.
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = perf_counter() - start
+            if name not in self.phases:
+                self.phases[name] = {'count': 0, 'total': 0.0, 'max': 0.0}
+            phase = self.phases[name]
+            phase['count'] += 1
+            phase['total'] += elapsed
+            phase['max'] = max(phase['max'], elapsed)
+
+    def record_lag(self, action, race, due):
+        """
+        Record how late an action on the given race happened, given the
+        datetime it was due at.
+        """
+        seconds = max(0.0, (timezone.now() - due).total_seconds())
+        if action not in self.lag:
+            self.lag[action] = self.new_histogram()
+        self.add_to_histogram(self.lag[action], seconds)
+        if 'lag' not in race:
+            race['lag'] = self.new_histogram()
+        self.add_to_histogram(race['lag'], seconds)
+
+    def publish(self, races):
+        """
+        Write this process's stats to the cache, if due.
+        """
+        now = timezone.now()
+        if self.last_publish and now - self.last_publish < self.PUBLISH_INTERVAL:
+            return
+        self.last_publish = now
+        timeout = int(self.PUBLISH_INTERVAL.total_seconds()) * 6
+        cache.set(self.key(self.pid), {
+            'pid': self.pid,
+            'started_at': self.started_at,
+            'updated_at': now,
+            'races': len(races),
+            'phases': self.phases,
+            'lag': self.lag,
+            'race_lag': {
+                str(race['object']): race['lag']
+                for race in races
+                if 'lag' in race
+            },
+        }, timeout)
+        pids = cache.get(self.PIDS_KEY, [])
+        if self.pid not in pids:
+            cache.set(self.PIDS_KEY, pids + [self.pid], None)
+
+    @classmethod
+    def get_all(cls):
+        """
+        Return a list of the stats last published by each running bot
+        process.
+        """
+        pids = cache.get(cls.PIDS_KEY, [])
+        stats = cache.get_many([cls.key(pid) for pid in pids])
+        running = [pid for pid in pids if cls.key(pid) in stats]
+        if running != pids:
+            cache.set(cls.PIDS_KEY, running, None)
+        return [stats[cls.key(pid)] for pid in running]
+
+    @staticmethod
+    def key(pid):
+        return 'racebot/stats/%d' % pid
+
+
 class RaceBot:
     logger = logging.getLogger('racebot')
     pid = None
     last_adoption = None
+    last_partition_check = None
+    partitions = []
     last_twitch_refresh = None
     twitch_token = None
     twitch_token_refresh = None
     races = []
+    last_split_poll = None
+    # How often to check for queued splits, and broadcast them, for each
+    # race. Races are only checked in the database when their queued flag is
+    # set in the cache, or when SPLIT_RECHECK has passed in case a flag was
+    # lost.
+    SPLIT_INTERVAL = timedelta(milliseconds=250)
+    SPLIT_RECHECK = timedelta(seconds=5)
     queryset = models.Race.objects.filter(
         state__in=[
             models.RaceStates.open.value,
@@ -32,33 +159,57 @@ class RaceBot:
 
     def __init__(self, process_id):
         self.pid = process_id
+        self.stats = BotStats(process_id)
 
     def handle(self):
+        with self.stats.phase('handle'):
+            self.run_loop()
+        self.stats.publish(self.races)
+        sleep(0.01)
+
+    def run_loop(self):
         if (
             not self.twitch_token
             or not self.twitch_token_refresh
             or self.twitch_token_refresh < timezone.now()
         ):
-            self.update_twitch_token()
+            with self.stats.phase('update_twitch_token'):
+                self.update_twitch_token()
+
+        if not self.last_split_poll or timezone.now() - self.last_split_poll >= self.SPLIT_INTERVAL:
+            with self.stats.phase('poll_splits'):
+                self.poll_splits()
+            self.last_split_poll = timezone.now()
+
+        with self.stats.phase('handle_races'):
+            for race in self.races:
+                if timezone.now() - race['last_refresh'] > timedelta(milliseconds=100):
+                    race['last_refresh'] = timezone.now()
+                    with instrumentation.measure('racebot', 'handle_race'):
+                        race['object'].refresh_from_db()
+                        self.handle_race(race)
 
-        for race in self.races:
-            if timezone.now() - race['last_refresh'] > timedelta(milliseconds=100):
-                race['last_refresh'] = timezone.now()
-                race['object'].refresh_from_db()
-                self.handle_race(race)
+        if (
+            self.partitions
+            or not self.last_partition_check
+            or timezone.now() - self.last_partition_check > timedelta(seconds=1)
+        ):
+            with self.stats.phase('process_partitions'):
+                self.process_partitions()
 
         if not self.last_adoption or timezone.now() - self.last_adoption > timedelta(seconds=10):
-            self.adopt_race()
-            self.unorphan_races()
+            with self.stats.phase('adopt_race'):
+                self.adopt_race()
+            with self.stats.phase('unorphan_races'):
+                self.unorphan_races()
             self.last_adoption = timezone.now()
 
         if not self.last_twitch_refresh or timezone.now() - self.last_twitch_refresh > timedelta(seconds=10):
             self.logger.debug('[Twitch] Refreshing stream statuses.')
-            self.update_live_status()
+            with self.stats.phase('update_live_status'):
+                self.update_live_status()
             self.last_twitch_refresh = timezone.now()
 
-        sleep(0.01)
-
     def adopt_race(self):
         """
         Search for any orphan races this process can adopt.
@@ -74,12 +225,41 @@ class RaceBot:
             race.save()
             self.races.append({
                 'last_refresh': timezone.now(),
+                'last_split_broadcast': timezone.now(),
+                # Check straight away for splits left queued by a previous
+                # bot process.
+                'splits_queued': True,
                 'object': race,
                 'cancel_warning_posted': False,
                 'limit_warning_posted': False,
             })
             self.logger.info('[Bot] Adopted race %(race)s.' % {'race': race})
 
+    def process_partitions(self):
+        """
+        Open the next batch of race rooms for any partitioned races.
+
+        Only one batch is done for each partition per loop, so that ongoing
+        races are not held up.
+        """
+        if not self.partitions:
+            self.last_partition_check = timezone.now()
+            self.partitions = list(models.RacePartition.objects.filter(
+                completed_at__isnull=True,
+            ).values_list('id', flat=True))
+
+        for partition_id in list(self.partitions):
+            try:
+                more = models.RacePartition.objects.process_batch(partition_id)
+            except Exception as ex:
+                # Leave it to be retried on the next check.
+                notice_exception(ex)
+                self.partitions.remove(partition_id)
+                continue
+            if not more:
+                self.partitions.remove(partition_id)
+                self.logger.info('[Bot] Done with partition #%(id)d.' % {'id': partition_id})
+
     def unorphan_races(self):
         """
         Search for active races whose bot process is no longer running, and
@@ -122,6 +302,7 @@ class RaceBot:
         elif race['object'].is_in_progress:
             self.handle_in_progress_race(race)
         else:
+            self.broadcast_splits(race, force=True)
             race['object'].bot_pid = None
             race['object'].save()
             self.races.remove(race)
@@ -142,9 +323,48 @@ class RaceBot:
         self.check_countdown(race)
 
     def handle_in_progress_race(self, race):
+        self.broadcast_splits(race)
         self.check_time_limit(race)
         race['object'].finish_if_none_remaining()
 
+    def poll_splits(self):
+        """
+        Find which in-progress races have had splits queued since the last
+        poll, with one cache lookup for all of them.
+
+        Flags are cleared before the splits are read, so a split queued
+        in between is picked up on the next poll.
+        """
+        keys = {
+            race['object'].splits_queued_key: race
+            for race in self.races
+            if race['object'].is_in_progress
+        }
+        if not keys:
+            return
+        flagged = cache.get_many(keys.keys())
+        if flagged:
+            cache.delete_many(flagged.keys())
+            for key in flagged:
+                keys[key]['splits_queued'] = True
+
+    def broadcast_splits(self, race, force=False):
+        """
+        Broadcast any splits queued for the race.
+
+        Splits are sent out at most once per SPLIT_INTERVAL for each race, so
+        that a burst of splits reaches consumers as one message.
+        """
+        if not (
+            force
+            or race['splits_queued']
+            or timezone.now() - race['last_split_broadcast'] >= self.SPLIT_RECHECK
+        ):
+            return
+        race['splits_queued'] = False
+        race['last_split_broadcast'] = timezone.now()
+        race['object'].broadcast_queued_splits()
+
     def check_countdown(self, race):
         time_to_start = timezone.now() - race['object'].started_at
         for s in chain([10], range(5, 0, -1)):
@@ -156,6 +376,9 @@ class RaceBot:
                     broadcast=False,
                 )
                 race[scp] = True
+                self.stats.record_lag(
+                    'countdown', race, race['object'].started_at - timedelta(seconds=s),
+                )
         if time_to_start >= timedelta(0):
             race['object'].state = models.RaceStates.in_progress.value
             race['object'].version = F('version') + 1
@@ -164,6 +387,7 @@ class RaceBot:
                 'The race has begun! Good luck and have fun.',
                 highlight=True,
             )
+            self.stats.record_lag('start', race, race['object'].started_at)
             self.logger.info('[Race] Started %(race)s.' % {'race': race['object']})
 
     def check_readiness(self, race):
@@ -190,6 +414,9 @@ class RaceBot:
             race['object'].add_message(
                 'This race has been cancelled. Reason: dead race room.'
             )
+            self.stats.record_lag(
+                'open_time_limit', race, race['object'].opened_at + race['object'].OPEN_TIME_LIMIT,
+            )
             self.logger.info('[Race] Cancelled %(race)s (dead race room).' % {'race': race['object']})
 
     def check_open_time_limit_lowentrants(self, race):
@@ -200,6 +427,9 @@ class RaceBot:
                 'This race has been cancelled. Reason: less than 2 '
                 'entrants joined.'
             )
+            self.stats.record_lag(
+                'open_time_limit', race, race['object'].opened_at + race['object'].OPEN_TIME_LIMIT_LOWENTRANTS,
+            )
             self.logger.info('[Race] Cancelled %(race)s (<2 entrants).' % {'race': race['object']})
         elif (
             open_for >= (race['object'].OPEN_TIME_LIMIT_LOWENTRANTS - timedelta(minutes=5))
@@ -211,6 +441,11 @@ class RaceBot:
                 highlight=True,
             )
             race['cancel_warning_posted'] = True
+            self.stats.record_lag(
+                'open_time_limit_warning',
+                race,
+                race['object'].opened_at + race['object'].OPEN_TIME_LIMIT_LOWENTRANTS - timedelta(minutes=5),
+            )
             self.logger.info('[Race] Low entrant warning for %(race)s.' % {'race': race['object']})
 
     def check_time_limit(self, race):
@@ -221,6 +456,9 @@ class RaceBot:
                 'will now be expunged.'
             )
             race['object'].finish()
+            self.stats.record_lag(
+                'time_limit', race, race['object'].started_at + race['object'].time_limit,
+            )
             self.logger.info('[Race] Race time limit exceeded for %(race)s.' % {'race': race['object']})
         elif (
             in_progress_for >= (race['object'].time_limit - timedelta(minutes=5))
@@ -232,6 +470,11 @@ class RaceBot:
                 highlight=True,
             )
             race['limit_warning_posted'] = True
+            self.stats.record_lag(
+                'time_limit_warning',
+                race,
+                race['object'].started_at + race['object'].time_limit - timedelta(minutes=5),
+            )
             self.logger.info('[Race] Race time limit warning for %(race)s.' % {'race': race['object']})
 
     def update_twitch_token(self):
@@ -0,0 +1,106 @@
+"""
+Read replica routing.
+
+Reads made inside a replica_reads() block go to one of the databases in
+settings.RT_REPLICAS, chosen at random. Everything else (all writes, and
+reads anywhere else or inside a transaction) goes to the default database.
+
+Replicas lag behind the primary, so a user who has just changed something
+must not be shown stale data. Whenever a user writes (a POST request or a
+race action), their reads stick to the primary for RT_REPLICA_STICKY_SECONDS
+afterwards. This is kept in the cache so it applies to every web and
+WebSocket process.
+
+Views opt in by setting read_from_replica = True (see ReplicaMiddleware),
+and WebSocket consumers use replica_reads() directly.
+
+Anything that fills a shared cache must read from the primary, inside
+primary_reads(). Cached data is cleared once a change commits on the primary,
+and a replica that has yet to catch up would otherwise fill it again with
+the old data, to be served to everyone until it expires.
+
+Settings:
+    RT_REPLICAS: aliases of replica databases from DATABASES. If empty,
+        everything uses the default database.
+    RT_REPLICA_STICKY_SECONDS: how long a user's reads stay on the primary
+        after they write.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+_reads = ContextVar('replica_reads', default=False)
+
+
+def is_sticky(user_id):
+    """
+    Return True if the given user's reads should stay on the primary.
+    """
+    return bool(user_id) and cache.get(_sticky_key(user_id)) is not None
+
+
+def stick_to_primary(user_id):
+    """
+    Keep the given user's reads on the primary for a while, so that they
+    see their own writes.
+    """
+    if settings.RT_REPLICAS and user_id:
+        cache.set(_sticky_key(user_id), True, settings.RT_REPLICA_STICKY_SECONDS)
+
+
+@contextmanager
+def replica_reads(user_id=None):
+    """
+    Send reads in the block to a replica, unless the given user (by ID) has
+    written recently.
+    """
+    if not settings.RT_REPLICAS or is_sticky(user_id):
+        yield
+        return
+    token = _reads.set(True)
+    try:
+        yield
+    finally:
+        _reads.reset(token)
+
+
+@contextmanager
+def primary_reads():
+    """
+    Send reads in the block to the primary, even inside replica_reads().
+    """
+    token = _reads.set(False)
+    try:
+        yield
+    finally:
+        _reads.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Database router that sends reads to a replica inside replica_reads().
+    """
+    def db_for_read(self, model, **hints):
+        if not settings.RT_REPLICAS:
+            return None
+        if _reads.get() and not connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return random.choice(settings.RT_REPLICAS)
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        # Objects read from a replica must still be saved to the primary.
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in settings.RT_REPLICAS
+
+
+def _sticky_key(user_id):
+    return 'replicas/sticky/%d' % user_id
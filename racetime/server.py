@@ -0,0 +1,95 @@
+"""
+Daphne server that negotiates permessage-deflate for WebSockets, and tells
+consumers when a WebSocket's send buffer is full.
+
+Race messages are repetitive JSON and HTML, so compressing them with the
+deflate context kept between messages cuts bandwidth by far more than it
+costs in CPU. Compression is only used when the client offers it, which all
+browsers do.
+
+Daphne writes outgoing messages straight into the connection's transport,
+so a consumer's send() never waits for a slow client. Instead, a SendBuffer
+is registered as the transport's producer, and given to consumers in
+scope["extensions"]["racetime.send_buffer"]. Twisted pauses it while the
+transport has more buffered than it can write, and resumes it once drained.
+
+Each connection keeps its own compressor and decompressor, so their window
+sizes and memory levels are capped to keep the memory held for thousands of
+spectators down.
+
+Settings:
+    RT_WS_DEFLATE: set to False to turn compression off.
+    RT_WS_DEFLATE_WINDOW_BITS: deflate window size, as a power of 2. Applies
+        to both directions, when the client allows it.
+    RT_WS_DEFLATE_MEM_LEVEL: zlib memory level for compressing.
+    RT_WS_DEFLATE_NO_CONTEXT_TAKEOVER: set to True to compress each message
+        on its own.
+"""
+import asyncio
+
+from autobahn.websocket.compress import PerMessageDeflateOffer, PerMessageDeflateOfferAccept
+from daphne.server import Server as BaseServer
+from daphne.ws_protocol import WebSocketProtocol
+from django.conf import settings
+
+
+def accept_deflate(offers):
+    """
+    Accept the client's first permessage-deflate offer, if it made one, with
+    the window size and memory level capped by settings.
+    """
+    for offer in offers:
+        if isinstance(offer, PerMessageDeflateOffer):
+            window_bits = settings.RT_WS_DEFLATE_WINDOW_BITS
+            if offer.request_max_window_bits:
+                window_bits = min(window_bits, offer.request_max_window_bits)
+            return PerMessageDeflateOfferAccept(
+                offer,
+                request_max_window_bits=window_bits if offer.accept_max_window_bits else 0,
+                no_context_takeover=(
+                    settings.RT_WS_DEFLATE_NO_CONTEXT_TAKEOVER
+                    or offer.request_no_context_takeover
+                ),
+                window_bits=window_bits,
+                mem_level=settings.RT_WS_DEFLATE_MEM_LEVEL,
+            )
+    return None
+
+
+class SendBuffer:
+    """
+    Streaming producer that tracks whether a WebSocket's transport can take
+    more data. Await writable.wait() before sending.
+    """
+    def __init__(self):
+        self.writable = asyncio.Event()
+        self.writable.set()
+
+    def pauseProducing(self):
+        self.writable.clear()
+
+    def resumeProducing(self):
+        self.writable.set()
+
+    def stopProducing(self):
+        # The connection is gone, so nothing should wait on it.
+        self.writable.set()
+
+
+class Server(BaseServer):
+    def listen_success(self, port):
+        # The WebSocket factory is only created once the server starts
+        # running, but before it starts accepting connections.
+        if settings.RT_WS_DEFLATE:
+            self.ws_factory.setProtocolOptions(perMessageCompressionAccept=accept_deflate)
+        super().listen_success(port)
+
+    def create_application(self, protocol, scope):
+        if isinstance(protocol, WebSocketProtocol) and protocol.transport:
+            send_buffer = SendBuffer()
+            # The HTTP channel that handed over the connection is still
+            # registered as its producer, but has no more use for it.
+            protocol.transport.unregisterProducer()
+            protocol.transport.registerProducer(send_buffer, True)
+            scope.setdefault('extensions', {})['racetime.send_buffer'] = send_buffer
+        return super().create_application(protocol, scope)
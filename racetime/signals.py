@@ -1,51 +1,54 @@
-import random
-from datetime import timedelta
-
-from django.core.cache import cache
+from django.apps import apps
 from django.db.models import signals
 from django.dispatch import receiver
-from django.utils import timezone
 
-from . import models
+from . import caching, models
 
 
 @receiver(signals.pre_save, sender=models.User)
-def set_discriminator(sender, instance, **kwargs):
-    others = models.User.objects.filter(name=instance.name)
-    others = others.exclude(id=instance.id)
+def set_discriminator(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not {'name', 'discriminator'} & set(update_fields):
+        return
+    if instance.discriminator and not instance.name_changed:
+        # Any conflict would have been caught when the name was last saved.
+        return
 
-    if instance.discriminator and not others.filter(
+    if instance.discriminator and not models.User.objects.filter(
+        name=instance.name,
         discriminator=instance.discriminator,
-    ).exists():
+    ).exclude(id=instance.id).exists():
         # The profile's current scrim does not conflict with any other user's
         # profile.
         return
 
     # Assign a random, unused scrim.
-    others = [o.discriminator for o in others.all()]
-    scrims = [i for i in range(1, 9999) if i not in others]
-    instance.discriminator = '%04d' % random.choice(scrims)
-
-
-@receiver(signals.post_save)
-def invalidate_caches(sender, instance, **kwargs):
-    cache_window = timezone.now() - timedelta(days=1)
-    if sender == models.Category:
-        races = instance.race_set.filter(opened_at__gte=cache_window).select_related('category')
-    elif sender == models.Entrant:
-        races = [instance.race]
-    elif sender == models.Goal:
-        races = instance.category.race_set.filter(
-            goal=instance,
-            opened_at__gte=cache_window,
-        ).select_related('category')
-    elif sender == models.Race:
-        races = [instance]
-    else:
-        races = []
-
-    cache.delete_many(
-        [str(race) + '/data' for race in races]
-        + [str(race) + '/renders' for race in races]
-        + [category.slug + '/data' for category in set(race.category for race in races)]
+    instance.discriminator = models.User.objects.allocate_discriminator(
+        instance.name,
+        exclude_id=instance.id,
     )
+
+
+def invalidate_caches(sender, instance, signal, **kwargs):
+    cache_keys = instance.cache_dependencies()
+    if signal == signals.post_delete:
+        cache_keys = [cache_key._replace(refresh=None) for cache_key in cache_keys]
+    caching.schedule(cache_keys)
+
+
+for model in apps.get_app_config('racetime').get_models():
+    if hasattr(model, 'cache_dependencies'):
+        signals.post_save.connect(invalidate_caches, sender=model)
+        signals.post_delete.connect(invalidate_caches, sender=model)
+
+
+@receiver(signals.m2m_changed, sender=models.Category.owners.through)
+@receiver(signals.m2m_changed, sender=models.Category.moderators.through)
+def invalidate_category_staff(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        categories = models.Category.objects.filter(id__in=pk_set or [])
+    else:
+        categories = [instance]
+    for category in categories:
+        caching.schedule(category.data_cache_keys('staff'))
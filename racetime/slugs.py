@@ -0,0 +1,120 @@
+"""
+Allocation of race slugs.
+
+A race slug is made of an adjective, a noun and a four-digit number, e.g.
+"fancy-diddy-0593". Every possible slug for a category maps to a number in
+its SlugSpace, and the slugs already used by its races are tracked in a
+UsedSlugs Bloom filter. New slugs are drawn at random from the space,
+skipping any the filter says have been used, so a draw only needs to touch
+the database once to confirm its picks - however many races the category
+has had.
+"""
+import hashlib
+import random
+
+from .utils import slug_adjectives, slug_nouns
+
+# Slugs end with a number from 1 to 9999.
+NUMBERS = 9999
+
+
+class SlugSpace:
+    """
+    All of the race slugs that can be made from a set of words.
+    """
+    def __init__(self, nouns=None):
+        self.adjectives = slug_adjectives
+        self.nouns = list(dict.fromkeys(nouns)) if nouns else slug_nouns
+        self.adjective_index = {word: i for i, word in enumerate(self.adjectives)}
+        self.noun_index = {word: i for i, word in enumerate(self.nouns)}
+        self.size = len(self.adjectives) * len(self.nouns) * NUMBERS
+
+    @property
+    def signature(self):
+        """
+        Return a short hash that identifies the words in this space.
+        """
+        return hashlib.md5('\n'.join(self.nouns).encode()).hexdigest()[:12]
+
+    def slug(self, index):
+        """
+        Return the slug at the given position in this space.
+        """
+        index, number = divmod(index, NUMBERS)
+        adjective, noun = divmod(index, len(self.nouns))
+        return '%s-%s-%04d' % (self.adjectives[adjective], self.nouns[noun], number + 1)
+
+    def index(self, slug):
+        """
+        Return the position of a slug in this space, or None if it's not
+        part of it (e.g. if the category's slug words have changed since).
+        """
+        try:
+            adjective, noun, number = slug.split('-')
+            adjective = self.adjective_index[adjective]
+            noun = self.noun_index[noun]
+            number = int(number)
+        except (KeyError, ValueError):
+            return None
+        if not 1 <= number <= NUMBERS:
+            return None
+        return (adjective * len(self.nouns) + noun) * NUMBERS + number - 1
+
+    def draw(self, used, count, max_tries=1000):
+        """
+        Pick up to count random slugs that are not in the given UsedSlugs
+        filter, adding them to it.
+
+        Fewer slugs will be returned if the space is so full that no free
+        slug turns up after max_tries random picks.
+        """
+        slugs = []
+        for _ in range(count):
+            for _ in range(max_tries):
+                index = random.randrange(self.size)
+                if index not in used:
+                    used.add(index)
+                    slugs.append(self.slug(index))
+                    break
+            else:
+                break
+        return slugs
+
+
+class UsedSlugs:
+    """
+    A Bloom filter of slug indexes.
+
+    A Bloom filter can wrongly claim that a slug has been used (about 1% of
+    the time, until it holds more than its capacity), but never the reverse.
+    This only means that an unused slug is occasionally skipped.
+    """
+    HASHES = 7
+    BITS_PER_ITEM = 10
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.bits = capacity * self.BITS_PER_ITEM
+        self.array = bytearray((self.bits + 7) // 8)
+        self.count = 0
+
+    def __contains__(self, index):
+        return all(
+            self.array[position >> 3] & (1 << (position & 7))
+            for position in self.positions(index)
+        )
+
+    def add(self, index):
+        for position in self.positions(index):
+            self.array[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    @property
+    def is_full(self):
+        return self.count > self.capacity
+
+    def positions(self, index):
+        digest = hashlib.blake2b(index.to_bytes(8, 'little'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.HASHES)]
@@ -47,14 +47,9 @@ function Race() {
         if (this.vars.user.name) {
             this.vars.user.name_quoted = this.regquote(this.vars.user.name);
         }
-        var server_date = new Date(this.vars.server_time_utc);
-        if ($('.race-chat').length) {
-            for (var i in this.vars.chat_history) {
-                if (!this.vars.chat_history.hasOwnProperty(i)) continue;
-                this.addMessage(this.vars.chat_history[i], server_date, true);
-            }
-            this.scrollToBottom();
-        }
+        // The page may have been served from cache, so the chat backlog is
+        // only shown once the socket tells us the server time.
+        this.pendingHistory = this.vars.chat_history;
         this.open();
     } catch (e) {
         if ('notice_exception' in window) {
@@ -471,6 +466,10 @@ Race.prototype.onSocketMessage = function(event) {
     this.heartbeat();
 
     var server_date = new Date(data.date);
+    if (this.pendingHistory) {
+        this.showHistory(this.pendingHistory, server_date);
+        this.pendingHistory = null;
+    }
     switch (data.type) {
         case 'race.data':
             this.vars.hide_comments = data.race.hide_comments;
@@ -530,7 +529,7 @@ Race.prototype.onSocketMessage = function(event) {
             }
             this.handleRenders(data.renders, data.version);
             if (this.vars.user.can_moderate || this.vars.user.can_monitor || !('actions' in data.renders)) {
-                this.raceTick();
+                this.raceTick(data.version);
             }
             break;
         case 'chat.history':
@@ -579,6 +578,19 @@ Race.prototype.onSocketMessage = function(event) {
 
 Race.prototype.onSocketOpen = function(event) {
     $('.race-chat').removeClass('disconnected');
+    // The page's chat backlog may have been cached, so catch up on anything
+    // posted since.
+    this.getHistory();
+};
+
+Race.prototype.showHistory = function(messages, server_date) {
+    if ($('.race-chat').length) {
+        for (var i in messages) {
+            if (!messages.hasOwnProperty(i)) continue;
+            this.addMessage(messages[i], server_date, true);
+        }
+        this.scrollToBottom();
+    }
 };
 
 Race.prototype.open = function() {
@@ -650,9 +662,11 @@ Race.prototype.handleRenders = function(renders, version) {
     });
 };
 
-Race.prototype.raceTick = function() {
+Race.prototype.raceTick = function(version) {
     var self = this;
-    $.get(self.vars.urls.renders, function(data, status, xhr) {
+    // Passing the version we were just told about makes sure we aren't
+    // answered from an older cached copy.
+    $.get(self.vars.urls.renders, {version: version}, function(data, status, xhr) {
         if (xhr.getResponseHeader('X-Date-Exact')) {
             window.globalLatency = new Date(xhr.getResponseHeader('X-Date-Exact')) - new Date();
         }
@@ -0,0 +1,107 @@
+import tracemalloc
+from statistics import median
+from time import perf_counter
+
+from django.core.cache import cache
+from django.db import connection, reset_queries, transaction
+from django.test.utils import CaptureQueriesContext
+
+from .. import models
+from ..rating import rate_race
+from ..utils import get_chat_history
+from .utils import BenchmarkTestCase
+
+
+class RaceBenchmarkTestCase(BenchmarkTestCase):
+    """
+    Measure time, queries and memory allocated for race serialization,
+    rendering and rating with different numbers of entrants.
+
+    Any increase in queries fails. Allocations and times may exceed the
+    baseline by 25%.
+    """
+    sizes = (2, 20, 200)
+    messages = 200
+    repeat = 5
+    thresholds = {'time_ms': 0.25, 'alloc_kib': 0.25}
+    time_metrics = ('time_ms',)
+
+    def measure(self, setup):
+        """
+        Run a benchmarked path, returning the median time taken, and the
+        number of queries made and peak memory allocated by a single run.
+
+        setup is called before each run, and returns the function to run.
+        """
+        timings = []
+        for _ in range(self.repeat):
+            func = setup()
+            start = perf_counter()
+            func()
+            timings.append((perf_counter() - start) * 1000)
+
+        func = setup()
+        # The query log is capped, so empty it to make sure the run fits.
+        reset_queries()
+        with CaptureQueriesContext(connection) as queries:
+            func()
+
+        func = setup()
+        tracemalloc.start()
+        try:
+            func()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        return {
+            'time_ms': round(median(timings), 3),
+            'queries': len(queries),
+            'alloc_kib': round(peak / 1024, 1),
+        }
+
+    def benchmark(self, path, setup):
+        for size, race in self.races.items():
+            name = '%s/%d' % (path, size)
+            with self.subTest(name):
+                cache.clear()
+                self.assertWithinBaseline(name, self.measure(lambda: setup(race)))
+
+    def test_as_dict(self):
+        def setup(race):
+            instance = self.fresh(race)
+            return lambda: instance.as_dict
+        self.benchmark('as_dict', setup)
+
+    def test_entrants_dicts(self):
+        def setup(race):
+            return self.fresh(race).entrants_dicts
+        self.benchmark('entrants_dicts', setup)
+
+    def test_get_renders_stateless(self):
+        def setup(race):
+            return self.fresh(race).get_renders_stateless
+        self.benchmark('get_renders_stateless', setup)
+
+    def test_get_chat_history(self):
+        def setup(race):
+            return lambda: get_chat_history(race.id)
+        self.benchmark('get_chat_history', setup)
+
+    def test_rate_race(self):
+        def setup(race):
+            instance = self.fresh(race)
+
+            def run():
+                # Roll back the new ratings so each run starts from scratch.
+                with transaction.atomic():
+                    rate_race(instance)
+                    transaction.set_rollback(True)
+            return run
+        self.benchmark('rate_race', setup)
+
+    def test_dump_json_data(self):
+        def setup(race):
+            cache.clear()
+            return models.Category.objects.get(pk=race.category_id).dump_json_data
+        self.benchmark('dump_json_data', setup)
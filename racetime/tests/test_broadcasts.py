@@ -0,0 +1,132 @@
+import copy
+import zlib
+from statistics import mean
+from time import perf_counter
+
+from django.conf import settings
+from django.utils import timezone
+
+from ..consumers import RaceConsumer
+from ..utils import get_chat_history
+from .utils import BenchmarkTestCase
+
+
+class BroadcastBenchmarkTestCase(BenchmarkTestCase):
+    """
+    Measure the bytes sent and CPU time spent per race WebSocket message for
+    each encoding (JSON or MessagePack), with and without permessage-deflate,
+    for races with different numbers of entrants.
+
+    Sizes are averages per message. "deflate" keeps its context between
+    messages, as negotiated by default, and "no_context" does not. Sizes may
+    exceed the baseline by 10%, and times by 25%.
+    """
+    sizes = (10, 100)
+    # Number of successive messages of each type to send.
+    messages = 20
+    repeat = 5
+    encodings = ('json', 'msgpack')
+    thresholds = {
+        'bytes': 0.1,
+        'deflate': 0.1,
+        'no_context': 0.1,
+        'encode_us': 0.25,
+        'deflate_us': 0.25,
+    }
+    time_metrics = ('encode_us', 'deflate_us')
+
+    def get_messages(self, race):
+        """
+        Return lists of successive messages of each type, as broadcast while
+        the race goes on. Each race.data update changes one entrant.
+        """
+        race = self.fresh(race)
+        race_dict = race.as_dict
+        renders = race.get_renders_stateless()
+        chat = list(get_chat_history(race.id).values())
+
+        data_messages = []
+        renders_messages = []
+        for i in range(self.messages):
+            update = copy.deepcopy(race_dict)
+            update['version'] += i
+            entrant = update['entrants'][i % len(update['entrants'])]
+            entrant['stream_live'] = not entrant['stream_live']
+            data_messages.append(self.message('race.data', race=update, version=update['version']))
+            renders_messages.append(self.message('race.renders', renders=renders, version=update['version']))
+        return {
+            'race.data': data_messages,
+            'race.renders': renders_messages,
+            'chat.message': [
+                self.message('chat.message', message=message)
+                for message in chat
+            ],
+        }
+
+    @staticmethod
+    def message(message_type, **kwargs):
+        return {'type': message_type, 'date': timezone.now().isoformat(), **kwargs}
+
+    def measure_messages(self, messages, encoding):
+        """
+        Encode and compress a run of messages the way RaceConsumer and the
+        server would, returning average sizes and timings per message.
+        """
+        consumer = RaceConsumer()
+        consumer.encoding = encoding
+        encode_times = []
+        deflate_times = []
+        for _ in range(self.repeat):
+            start = perf_counter()
+            payloads = []
+            for message in messages:
+                text_data, bytes_data = consumer.encode(message)
+                payloads.append(bytes_data or text_data.encode('utf-8'))
+            encode_times.append(perf_counter() - start)
+
+            start = perf_counter()
+            compressed = self.deflate(payloads, context_takeover=True)
+            deflate_times.append(perf_counter() - start)
+        no_context = self.deflate(payloads, context_takeover=False)
+
+        return {
+            'bytes': round(mean(len(payload) for payload in payloads), 1),
+            'deflate': round(mean(len(payload) for payload in compressed), 1),
+            'no_context': round(mean(len(payload) for payload in no_context), 1),
+            'encode_us': round(min(encode_times) / len(messages) * 1_000_000, 1),
+            'deflate_us': round(min(deflate_times) / len(messages) * 1_000_000, 1),
+        }
+
+    @staticmethod
+    def deflate(payloads, context_takeover):
+        """
+        Compress payloads as permessage-deflate frames, with the window size
+        and memory level the server negotiates. Each one is flushed and has
+        its empty final block removed, as RFC 7692 requires.
+        """
+        def compressobj():
+            return zlib.compressobj(
+                zlib.Z_DEFAULT_COMPRESSION,
+                zlib.DEFLATED,
+                -settings.RT_WS_DEFLATE_WINDOW_BITS,
+                settings.RT_WS_DEFLATE_MEM_LEVEL,
+            )
+
+        compressor = compressobj()
+        compressed = []
+        for payload in payloads:
+            if not context_takeover:
+                compressor = compressobj()
+            data = compressor.compress(payload) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            compressed.append(data[:-4])
+        return compressed
+
+    def test_message_sizes(self):
+        for size, race in self.races.items():
+            for message_type, messages in self.get_messages(race).items():
+                for encoding in self.encodings:
+                    name = 'broadcast/%s/%s/%d' % (message_type, encoding, size)
+                    with self.subTest(name):
+                        result = self.measure_messages(messages, encoding)
+                        self.assertLess(result['deflate'], result['bytes'])
+                        self.assertWithinBaseline(name, result)
@@ -0,0 +1,69 @@
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from ..models import Bulletin
+
+
+class BulletinCacheTestCase(TestCase):
+    def setUp(self):
+        cache.delete(Bulletin.objects.cache_key)
+        now = timezone.now()
+        with self.captureOnCommitCallbacks(execute=True):
+            Bulletin.objects.create(
+                visible_from=now - timedelta(hours=1),
+                visible_to=now + timedelta(hours=1),
+                message='Scheduled maintenance tonight.',
+            )
+
+    def tearDown(self):
+        cache.delete(Bulletin.objects.cache_key)
+
+    def get_home(self):
+        """
+        Render the home page, returning the response and the SQL of any
+        bulletin queries made.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.get(reverse('home'))
+        bulletin_queries = [
+            query['sql'] for query in queries
+            if Bulletin._meta.db_table in query['sql']
+        ]
+        return resp, bulletin_queries
+
+    def test_cached_render_makes_no_bulletin_queries(self):
+        Bulletin.objects.get_visible()
+
+        resp, bulletin_queries = self.get_home()
+        self.assertEqual(resp.status_code, 200)
+        self.assertContains(resp, 'Scheduled maintenance tonight.')
+        self.assertEqual(bulletin_queries, [])
+
+    def test_uncached_render_queries_bulletins_once(self):
+        resp, bulletin_queries = self.get_home()
+        self.assertContains(resp, 'Scheduled maintenance tonight.')
+        self.assertTrue(bulletin_queries)
+
+        resp, bulletin_queries = self.get_home()
+        self.assertContains(resp, 'Scheduled maintenance tonight.')
+        self.assertEqual(bulletin_queries, [])
+
+    def test_saving_a_bulletin_clears_the_cache(self):
+        Bulletin.objects.get_visible()
+        now = timezone.now()
+        with self.captureOnCommitCallbacks(execute=True):
+            Bulletin.objects.create(
+                visible_from=now - timedelta(minutes=1),
+                visible_to=now + timedelta(hours=1),
+                message='Servers are back up.',
+            )
+
+        resp, bulletin_queries = self.get_home()
+        self.assertContains(resp, 'Servers are back up.')
+        self.assertTrue(bulletin_queries)
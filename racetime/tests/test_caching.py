@@ -0,0 +1,59 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import transaction
+from django.test import TransactionTestCase
+
+from .. import caching
+from ..caching import CacheKey
+
+
+class ScheduleTestCase(TransactionTestCase):
+    def setUp(self):
+        cache.set_many({'a': 1, 'b': 1, 'c': 1})
+
+    def tearDown(self):
+        cache.delete_many(['a', 'b', 'c'])
+
+    def assertCached(self, *keys):
+        self.assertEqual(sorted(cache.get_many(['a', 'b', 'c'])), sorted(keys))
+
+    def test_flushes_immediately_outside_a_transaction(self):
+        caching.schedule([CacheKey('race_data', 'a')])
+        self.assertCached('b', 'c')
+
+    def test_flushes_once_on_commit(self):
+        refresh = mock.Mock()
+        with mock.patch.object(caching, 'flush', wraps=caching.flush) as flush:
+            with transaction.atomic():
+                caching.schedule([CacheKey('race_data', 'a')])
+                caching.schedule([CacheKey('race_summary', 'b', refresh)])
+                caching.schedule([CacheKey('race_summary', 'b')])
+                self.assertCached('a', 'b', 'c')
+        flush.assert_called_once()
+        refresh.assert_called_once_with()
+        self.assertCached('b', 'c')
+
+    def test_discards_keys_on_rollback(self):
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                caching.schedule([CacheKey('race_data', 'a')])
+                raise ValueError
+        with transaction.atomic():
+            caching.schedule([CacheKey('race_data', 'b')])
+        self.assertCached('a', 'c')
+
+    def test_discards_keys_on_savepoint_rollback(self):
+        with transaction.atomic():
+            with self.assertRaises(ValueError):
+                with transaction.atomic():
+                    caching.schedule([CacheKey('race_data', 'a')])
+                    raise ValueError
+            caching.schedule([CacheKey('race_data', 'b')])
+        self.assertCached('a', 'c')
+
+    def test_keys_scheduled_after_commit_are_flushed(self):
+        with transaction.atomic():
+            caching.schedule([CacheKey('race_data', 'a')])
+        caching.schedule([CacheKey('race_data', 'b')])
+        self.assertCached('c')
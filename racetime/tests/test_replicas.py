@@ -0,0 +1,114 @@
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .. import models, replicas
+
+
+@override_settings(
+    CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'replicas',
+        },
+    },
+    RT_REPLICAS=('replica',),
+)
+class ReplicaRouterTestCase(TransactionTestCase):
+    """
+    The "replica" database mirrors the default one in tests, so these check
+    which connection queries are made on. A TransactionTestCase is used
+    because reads inside a transaction always go to the primary.
+    """
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        cache.clear()
+        self.user = models.User.objects.create_user(
+            email='replica@example.com',
+            password='pass',
+            name='replica',
+            discriminator='0001',
+        )
+        category = models.Category.objects.create(
+            name='Replica test',
+            short_name='RT',
+            slug='replica-test',
+        )
+        # Moderators have public profiles.
+        category.moderators.add(self.user)
+        self.race = models.Race.objects.create(
+            category=category,
+            goal=models.Goal.objects.create(category=category, name='Any%'),
+            slug='replica-test-race',
+            opened_by=self.user,
+        )
+
+    def capture(self):
+        """
+        Return query capturing contexts for the primary and the replica.
+        """
+        return (
+            CaptureQueriesContext(connections['default']),
+            CaptureQueriesContext(connections['replica']),
+        )
+
+    def test_router(self):
+        queryset = models.Race.objects.all()
+        self.assertEqual(queryset.db, 'default')
+        with replicas.replica_reads():
+            self.assertEqual(queryset.all().db, 'replica')
+            with replicas.primary_reads():
+                self.assertEqual(queryset.all().db, 'default')
+            with transaction.atomic():
+                self.assertEqual(queryset.all().db, 'default')
+            race = queryset.get(pk=self.race.pk)
+            self.assertEqual(race._state.db, 'replica')
+            race.save()
+            self.assertEqual(race._state.db, 'default')
+
+    @override_settings(RT_REPLICAS=())
+    def test_router_without_replicas(self):
+        with replicas.replica_reads():
+            self.assertEqual(models.Race.objects.all().db, 'default')
+
+    def test_views_read_from_replica(self):
+        primary, replica = self.capture()
+        with primary, replica:
+            resp = self.client.get(self.user.get_absolute_url())
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(replica.captured_queries)
+
+    def test_sticks_to_primary_after_post(self):
+        self.client.force_login(self.user)
+        self.client.post(self.user.get_absolute_url())
+        self.assertTrue(replicas.is_sticky(self.user.id))
+
+        with replicas.replica_reads(self.user.id):
+            self.assertEqual(models.Race.objects.all().db, 'default')
+        with replicas.replica_reads():
+            self.assertEqual(models.Race.objects.all().db, 'replica')
+
+        primary, replica = self.capture()
+        with primary, replica:
+            resp = self.client.get(self.user.get_absolute_url())
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(primary.captured_queries)
+        self.assertFalse(replica.captured_queries)
+
+    def test_shared_cache_fills_read_from_primary(self):
+        url = reverse('race_data', args=(self.race.category.slug, self.race.slug))
+        primary, replica = self.capture()
+        with primary, replica:
+            resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(primary.captured_queries)
+        self.assertFalse(replica.captured_queries)
+
+        primary, replica = self.capture()
+        with primary, replica:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertFalse(primary.captured_queries)
+        self.assertFalse(replica.captured_queries)
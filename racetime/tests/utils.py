@@ -0,0 +1,151 @@
+import json
+import os
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from .. import models
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'benchmarks.json')
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'benchmarks',
+    },
+})
+class BenchmarkTestCase(TestCase):
+    """
+    Base for tests that measure races of different sizes, and compare the
+    results against the baseline in benchmarks.json.
+
+    Times depend on the machine, so they are only compared when
+    RT_BENCHMARK_TIMES is set in the environment. Set RT_BENCHMARK_SAVE to
+    write a new baseline instead of comparing.
+
+    A private local memory cache is used, so that clearing cached race data
+    between runs never touches a shared cache.
+    """
+    # Numbers of race entrants to benchmark with.
+    sizes = ()
+    # Number of chat messages in each race.
+    messages = 0
+    # Fraction by which a result may exceed the baseline, by metric. Metrics
+    # not listed here must not exceed the baseline at all.
+    thresholds = {}
+    time_metrics = ()
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.results = {}
+
+    @classmethod
+    def tearDownClass(cls):
+        if os.environ.get('RT_BENCHMARK_SAVE') and cls.results:
+            baseline = cls.load_baseline()
+            baseline.update(cls.results)
+            with open(BASELINE, 'w') as f:
+                json.dump(baseline, f, indent=2, sort_keys=True)
+                f.write('\n')
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        users = cls.create_users(max(cls.sizes))
+        cls.races = {
+            size: cls.create_race(size, users)
+            for size in cls.sizes
+        }
+
+    @classmethod
+    def load_baseline(cls):
+        try:
+            with open(BASELINE) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    @classmethod
+    def create_users(cls, count):
+        password = make_password(None)
+        return models.User.objects.bulk_create([
+            models.User(
+                email='benchmark%d@example.com' % i,
+                password=password,
+                name='benchmark%d' % i,
+                discriminator='0001',
+            )
+            for i in range(count)
+        ])
+
+    @classmethod
+    def create_race(cls, size, users):
+        """
+        Create a category with an in-progress race, where the given number of
+        entrants have finished (apart from a few forfeits), and the race chat
+        has some messages.
+        """
+        category = models.Category.objects.create(
+            name='Benchmark %d' % size,
+            short_name='BM%d' % size,
+            slug='benchmark-%d' % size,
+        )
+        goal = models.Goal.objects.create(category=category, name='Benchmark')
+        race = models.Race.objects.create(
+            category=category,
+            goal=goal,
+            slug='benchmark-race-%04d' % size,
+            state=models.RaceStates.in_progress.value,
+            started_at=timezone.now() - timedelta(hours=2),
+            opened_by=users[0],
+        )
+        entrants = []
+        for place, user in enumerate(users[:size], start=1):
+            finished = place <= size - size // 10
+            entrants.append(models.Entrant(
+                user=user,
+                race=race,
+                state=models.EntrantStates.joined.value,
+                ready=True,
+                dnf=not finished,
+                finish_time=timedelta(minutes=30, seconds=place) if finished else None,
+                place=place if finished else None,
+            ))
+        models.Entrant.objects.bulk_create(entrants)
+        models.Message.objects.bulk_create([
+            models.Message(
+                user=users[i % size],
+                race=race,
+                message='Benchmark message %d' % i,
+            )
+            for i in range(cls.messages)
+        ])
+        return race
+
+    def fresh(self, race):
+        """
+        Return the race as newly loaded from the database, so that nothing is
+        cached on the instance.
+        """
+        return models.Race.objects.get(pk=race.pk)
+
+    def assertWithinBaseline(self, name, result):
+        """
+        Record a result, and check it against the baseline.
+        """
+        type(self).results[name] = result
+        previous = self.load_baseline().get(name)
+        if os.environ.get('RT_BENCHMARK_SAVE') or previous is None:
+            return
+        for metric, value in result.items():
+            if metric in self.time_metrics and not os.environ.get('RT_BENCHMARK_TIMES'):
+                continue
+            self.assertLessEqual(
+                value,
+                previous[metric] * (1 + self.thresholds.get(metric, 0)),
+                '%s %s' % (name, metric),
+            )
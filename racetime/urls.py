@@ -39,6 +39,7 @@ urlpatterns = [
         path('userinfo', views.OAuthUserInfo.as_view(), name='oauth2_userinfo'),
         path('<str:category>/data', views.OAuthCategoryData.as_view(), name='oauth2_category_data'),
         path('<str:category>/startrace', views.OAuthCreateRace.as_view(), name='oauth2_create_race'),
+        path('<str:category>/startraces', views.OAuthCreateRaces.as_view(), name='oauth2_create_races'),
         path('<str:category>/<str:race>/edit', views.OAuthEditRace.as_view(), name='oauth2_edit_race'),
         path('<str:category>/<str:race>/monitor/pin/<str:message>', views.OAuthRaceChatPin.as_view(), name='oauth2_chat_pin'),
         path('<str:category>/<str:race>/monitor/unpin/<str:message>', views.OAuthRaceChatUnpin.as_view(), name='oauth2_chat_unpin'),
@@ -70,6 +71,7 @@ urlpatterns = [
 
     path('', views.Home.as_view(), name='home'),
     path('search', views.Search.as_view(), name='search'),
+    path('metrics', views.Metrics.as_view(), name='metrics'),
     path('request_category', views.RequestCategory.as_view(), name='request_category'),
     path('races/data', views.RaceListData.as_view(), name='race_list_data'),
     path('races.json', views.RaceListData.as_view()),
@@ -90,6 +92,8 @@ urlpatterns = [
         path('data', views.CategoryData.as_view(), name='category_data'),
         path('races/data', views.CategoryRaceData.as_view(), name='category_race_list_data'),
         path('races.json', views.CategoryRaceData.as_view()),
+        path('races/csv', views.CategoryRaceCSV.as_view(), name='category_race_csv'),
+        path('races.csv', views.CategoryRaceCSV.as_view()),
         path('manage/', include([
             path('edit', views.EditCategory.as_view(), name='edit_category'),
             path('deactivate', views.DeactivateCategory.as_view(), name='category_deactivate'),
@@ -1,17 +1,31 @@
+import asyncio
+import csv
 import datetime
 import colorsys
+import hashlib
+import io
 import json
 import random
+from bisect import bisect
 from collections import OrderedDict
+from itertools import islice
 from urllib.parse import urlencode
 
 import requests
+from asgiref.sync import sync_to_async
 from channels_redis.core import RedisChannelLayer as BaseRedisChannelLayer
+from channels_redis.pubsub import (
+    RedisPubSubChannelLayer as BaseRedisPubSubChannelLayer,
+    RedisPubSubLoopLayer,
+    RedisSingleShardConnection,
+)
 from channels_redis.serializers import JSONSerializer as BaseJSONSerializer, registry
+from channels_redis.utils import _wrap_close, decode_hosts
 from django.apps import apps
 from django.conf import settings
-from django.core.mail import send_mail
+from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
 from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
 from django.db.transaction import atomic
 from django.template.loader import render_to_string
 from django.urls import NoReverseMatch, reverse
@@ -19,11 +33,15 @@ from django.utils.module_loading import import_string
 from hashids import Hashids
 
 __all__ = [
+    'HashRing',
+    'KeysetPaginator',
     'RedisChannelLayer',
+    'RedisPubSubChannelLayer',
     'SafeException',
     'ShieldedUser',
     'SyncError',
     'chunkify',
+    'csv_lines',
     'delete_user',
     'determine_ip',
     'exception_to_msglist',
@@ -35,6 +53,8 @@ __all__ = [
     'notice_exception',
     'patreon_auth_url',
     'patreon_update_memberships',
+    'set_bulk_ids',
+    'stream_content',
     'timer_html',
     'timer_str',
     'twitch_auth_url',
@@ -547,6 +567,128 @@ class JSONSerializer(BaseJSONSerializer):
 registry.register_serializer('json', JSONSerializer)
 
 
+class KeysetPaginator(Paginator):
+    """
+    Paginator that can also fetch pages by an (ended_at, id) cursor.
+
+    Cursor pages are fetched with a keyset filter rather than an OFFSET, so
+    a deep page costs the same as the first one. The object list must be
+    ordered by both fields, descending.
+
+    If count is given it will be used instead of running a COUNT query,
+    which allows callers to supply a cached or approximate count. Such a
+    count is only used to number pages: each page is sliced by the per-page
+    size instead, and the count is corrected to agree with what it finds.
+    """
+    epoch = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+    def __init__(self, object_list, per_page, ended_at_field='ended_at',
+                 id_field='id', count=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.ended_at_field = ended_at_field
+        self.id_field = id_field
+        self.approximate = count is not None
+        if self.approximate:
+            self.set_count(count)
+
+    def set_count(self, count):
+        self.__dict__['count'] = count
+        self.__dict__.pop('num_pages', None)
+
+    def validate_number(self, number):
+        """
+        Validate the given 1-based page number.
+
+        If the count is approximate, pages past the end of it are allowed, as
+        there may be more objects than it says.
+        """
+        try:
+            return super().validate_number(number)
+        except EmptyPage:
+            if self.approximate and int(number) > 1:
+                return int(number)
+            raise
+
+    def page(self, number):
+        """
+        Return a Page object for the given 1-based page number.
+
+        If the count is approximate, one more object than fits on the page is
+        fetched to tell if there is a next page. Asking for a page beyond the
+        end runs a COUNT query, so that the real last page can be found.
+        """
+        if not self.approximate:
+            return super().page(number)
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        objects = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if len(objects) > self.per_page:
+            objects = objects[:self.per_page]
+            self.set_count(max(self.count, bottom + self.per_page + 1))
+        elif objects or number == 1:
+            self.set_count(bottom + len(objects))
+        else:
+            self.set_count(self.object_list.count())
+            raise EmptyPage(self.error_messages['no_results'])
+        return self._get_page(objects, number, self)
+
+    def get_page(self, number):
+        try:
+            return super().get_page(number)
+        except EmptyPage:
+            return self.page(self.num_pages)
+
+    def cursor_page(self, cursor=None):
+        """
+        Return a tuple of (objects, next_cursor) for the page that follows
+        the given cursor, or the first page if no cursor is given.
+
+        next_cursor will be None if there are no more pages.
+        """
+        queryset = self.object_list
+        if cursor:
+            ended_at, obj_id = self.decode_cursor(cursor)
+            queryset = queryset.filter(
+                Q(**{self.ended_at_field + '__lt': ended_at})
+                | Q(**{self.ended_at_field: ended_at, self.id_field + '__lt': obj_id})
+            )
+        objects = list(queryset[:self.per_page + 1])
+        if len(objects) > self.per_page:
+            objects = objects[:self.per_page]
+            return objects, self.encode_cursor(objects[-1])
+        return objects, None
+
+    def next_cursor(self, page):
+        """
+        Return the cursor for the page following the given numbered page,
+        allowing clients to switch from page numbers to cursors.
+        """
+        if page.has_next():
+            return self.encode_cursor(page[-1])
+        return None
+
+    def encode_cursor(self, obj):
+        ended_at = self._resolve(obj, self.ended_at_field)
+        obj_id = self._resolve(obj, self.id_field)
+        return get_hashids(self.__class__).encode(
+            (ended_at - self.epoch) // datetime.timedelta(microseconds=1),
+            obj_id,
+        )
+
+    def decode_cursor(self, cursor):
+        try:
+            timestamp, obj_id = get_hashids(self.__class__).decode(cursor)
+        except ValueError:
+            raise PageNotAnInteger('That cursor is not valid.')
+        return self.epoch + datetime.timedelta(microseconds=timestamp), obj_id
+
+    @staticmethod
+    def _resolve(obj, field):
+        for attr in field.split('__'):
+            obj = getattr(obj, attr)
+        return obj
+
+
 class RedisChannelLayer(BaseRedisChannelLayer):
     """
     Custom channel layer that correctly serializes Django-ey data.
@@ -556,6 +698,118 @@ class RedisChannelLayer(BaseRedisChannelLayer):
         super().__init__(*args, **kwargs)
 
 
+class HashRing:
+    """
+    Consistent hash ring, mapping names onto one of a list of nodes.
+
+    Each node is placed on the ring many times so that names are spread
+    evenly. Adding or removing a node only moves the names that map to it,
+    rather than reshuffling everything.
+    """
+    def __init__(self, nodes, replicas=160):
+        self.nodes = list(nodes)
+        points = sorted(
+            (self.hash('%s#%d' % (node, replica)), index)
+            for index, node in enumerate(self.nodes)
+            for replica in range(replicas)
+        )
+        self.points = [point for point, _ in points]
+        self.indexes = [index for _, index in points]
+
+    @staticmethod
+    def hash(name):
+        return int.from_bytes(hashlib.md5(name.encode('utf-8')).digest()[:8], 'big')
+
+    def get_index(self, name):
+        """
+        Return the index of the node that the given name maps to.
+        """
+        if len(self.nodes) == 1:
+            return 0
+        position = bisect(self.points, self.hash(name)) % len(self.points)
+        return self.indexes[position]
+
+
+class FanOutShardConnection(RedisSingleShardConnection):
+    """
+    Connection to one Redis host, which decodes each group message once and
+    hands the result to every local channel in the group.
+    """
+    def _receive_message(self, message):
+        if message is None:
+            return
+        name = message['channel']
+        if isinstance(name, bytes):
+            name = name.decode()
+        group_channels = self.channel_layer.groups.get(name)
+        if group_channels:
+            data = self.channel_layer.channel_layer.deserialize(message['data'])
+            for channel_name in group_channels:
+                queue = self.channel_layer.channels.get(channel_name)
+                if queue:
+                    queue.put_nowait(data)
+        else:
+            super()._receive_message(message)
+
+
+class ShardedPubSubLoopLayer(RedisPubSubLoopLayer):
+    """
+    Pub/sub layer for one event loop, which spreads channels and groups over
+    its Redis hosts with a HashRing.
+    """
+    def __init__(self, hosts=None, *args, **kwargs):
+        super().__init__(hosts, *args, **kwargs)
+        hosts = decode_hosts(hosts)
+        self._shards = [FanOutShardConnection(host, self) for host in hosts]
+        self.ring = HashRing(
+            host.get('address') or '%(host)s:%(port)s' % host
+            for host in hosts
+        )
+
+    def _get_shard(self, channel_or_group_name):
+        return self._shards[self.ring.get_index(channel_or_group_name)]
+
+
+class RedisPubSubChannelLayer(BaseRedisPubSubChannelLayer):
+    """
+    Channel layer that fans out group messages through Redis pub/sub.
+
+    A group_send is published once, to the Redis host that owns the group,
+    and arrives once at each ASGI worker with a member of the group. The
+    worker then delivers it to its own consumers, so a race room with
+    thousands of viewers costs one publish per message, not one per viewer.
+    Groups are spread over all configured hosts by consistent hashing, so
+    that busy races don't all land on the same host.
+
+    Unlike RedisChannelLayer, messages are not stored: anything sent to a
+    channel or group with no subscribers is dropped.
+    """
+    def __init__(self, *args, **kwargs):
+        kwargs['serializer_format'] = 'json'
+        super().__init__(*args, **kwargs)
+
+    def deserialize(self, message):
+        # Group messages are decoded once per worker by FanOutShardConnection,
+        # each consumer gets its own copy of the top level.
+        if isinstance(message, dict):
+            return dict(message)
+        return super().deserialize(message)
+
+    def _get_layer(self):
+        loop = asyncio.get_running_loop()
+        try:
+            layer = self._layers[loop]
+        except KeyError:
+            layer = ShardedPubSubLoopLayer(
+                *self._args,
+                **self._kwargs,
+                channel_layer=self,
+            )
+            self._layers[loop] = layer
+            _wrap_close(self, loop)
+        return layer
+
+
 class ShieldedUser:
     active = True
     is_shielded = True
@@ -626,66 +880,60 @@ def chunkify(items, size=100):
         n += size
 
 
+def csv_lines(rows):
+    """
+    Generator that yields each of the given rows as a line of CSV.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
 def delete_user(request, user, protect=True):
+    """
+    Deactivate the given user and queue their account for deletion.
+
+    The deletion itself is carried out in the background, see the
+    process_user_deletions management command.
+    """
     if protect and (user.is_system or user.is_superuser or user.is_staff):
         raise Exception('Cannot delete protected user.')
     if user.active_race_entrant:
         raise Exception('User is currently racing.')
 
-    user_email = user.email
     email_context = {
         'home_url': settings.RT_SITE_URI + reverse('home'),
         'name': user.name,
     }
 
+    # System messages from before this date are not linked to the users they
+    # mention, so must be found by the names the user had at the time.
+    MESSAGE_LINK_MIGRATION = datetime.datetime(2025, 3, 25, tzinfo=datetime.timezone.utc)
+    UserLog = apps.get_model('racetime', 'UserLog')
+    name_map = OrderedDict()
+    for user_log in UserLog.objects.filter(
+        user=user,
+        changed_at__lte=MESSAGE_LINK_MIGRATION,
+    ).order_by('changed_at'):
+        name_map[user_log.changed_at] = user_log.user_str
+    name_map[MESSAGE_LINK_MIGRATION] = str(user)
+
+    UserDeletion = apps.get_model('racetime', 'UserDeletion')
     with atomic():
-        # Delete comments
-        Entrant = apps.get_model('racetime', 'Entrant')
-        Entrant.objects.filter(user=user).update(comment=None)
-
-        # Anonymise system messages that mention the user
-        MessageLink = apps.get_model('racetime', 'MessageLink')
-        for message_link in MessageLink.objects.filter(user=user).select_related('message'):
-            message_link.message.message = message_link.anonymised_message
-            message_link.message.save()
-
-        # Anonymise older system messages
-        MESSAGE_LINK_MIGRATION = datetime.datetime(2025, 3, 25, tzinfo=datetime.timezone.utc)
-        Message = apps.get_model('racetime', 'Message')
-        UserLog = apps.get_model('racetime', 'UserLog')
-
-        name_map = OrderedDict()
-        for user_log in UserLog.objects.filter(
+        user.active = False
+        user.save()
+        return UserDeletion.objects.create(
             user=user,
-            changed_at__lte=MESSAGE_LINK_MIGRATION,
-        ).order_by('changed_at'):
-            name_map[user_log.changed_at] = user_log.user_str
-        name_map[MESSAGE_LINK_MIGRATION] = str(user)
-
-        date_from = None
-        for date_to, name in name_map.items():
-            messages = Message.objects.filter(
-                user=None,
-                bot=None,
-                posted_at__lte=date_to,
-                message__contains=name,
-            )
-            if date_from:
-                messages = messages.filter(posted_at__gte=date_from)
-            for message in messages:
-                message.message = message.message.replace(name, '(deleted user)')
-                message.save()
-            date_from = date_to
-
-        user.delete()
-
-    send_mail(
-        subject=render_to_string('racetime/email/delete_account_subject.txt', email_context, request),
-        message=render_to_string('racetime/email/delete_account_email.txt', email_context, request),
-        html_message=render_to_string('racetime/email/delete_account_email.html', email_context, request),
-        from_email=settings.EMAIL_FROM,
-        recipient_list=[user_email],
-    )
+            name_map=[[date_to.isoformat(), name] for date_to, name in name_map.items()],
+            email=user.email,
+            email_subject=render_to_string('racetime/email/delete_account_subject.txt', email_context, request),
+            email_message=render_to_string('racetime/email/delete_account_email.txt', email_context, request),
+            email_html=render_to_string('racetime/email/delete_account_email.html', email_context, request),
+        )
 
 
 def determine_ip(request):
@@ -866,6 +1114,36 @@ def patreon_update_memberships(**user_filter):
     return added, removed
 
 
+def set_bulk_ids(objs, queryset):
+    """
+    Set primary keys on objects created by bulk_create, for databases (i.e.
+    MySQL) that do not return them. The queryset must match exactly the rows
+    that were created.
+    """
+    if objs and objs[0].pk is None:
+        ids = queryset.order_by('id').values_list('id', flat=True)
+        for obj, pk in zip(objs, ids):
+            obj.pk = pk
+
+
+async def stream_content(lines, size=500):
+    """
+    Asynchronously yield chunks of the given lines, for use as the content
+    of a StreamingHttpResponse.
+
+    Under ASGI, Django reads a synchronous iterator fully into memory before
+    sending any of it. This instead pulls a chunk of lines at a time from the
+    iterator (which may be reading from the database) in a sync thread.
+    """
+    lines = iter(lines)
+    read_chunk = sync_to_async(lambda: ''.join(islice(lines, size)))
+    while True:
+        chunk = await read_chunk()
+        if not chunk:
+            break
+        yield chunk
+
+
 def timer_html(delta, deciseconds=True):
     if deciseconds:
         return _format_timer(delta, '{}{:01}:{:02}:{:02}<small>.{}</small>')
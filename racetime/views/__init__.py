@@ -28,6 +28,7 @@ from .category import (
     CategoryListData,
     CategoryManageEmotes,
     CategoryModerators,
+    CategoryRaceCSV,
     CategoryRaceData,
     CategoryRecorder,
     CategoryTeams,
@@ -48,10 +49,12 @@ from .goal import (
     GoalList,
 )
 from .home import Home
+from .metrics import Metrics
 from .race import (
     CreateRace,
     EditRace,
     OAuthCreateRace,
+    OAuthCreateRaces,
     OAuthEditRace,
     EditRaceResult,
     Race,
@@ -179,6 +182,7 @@ __all__ = [
     'CategoryListData',
     'CategoryManageEmotes',
     'CategoryModerators',
+    'CategoryRaceCSV',
     'CategoryRaceData',
     'CategoryRecorder',
     'CategoryTeams',
@@ -198,10 +202,13 @@ __all__ = [
     'GoalList',
     # home
     'Home',
+    # metrics
+    'Metrics',
     # race
     'CreateRace',
     'EditRace',
     'OAuthCreateRace',
+    'OAuthCreateRaces',
     'OAuthEditRace',
     'EditRaceResult',
     'Race',
@@ -1,13 +1,21 @@
+import gzip
+import hashlib
+import json
 import re
 
 from django import http
 from django.contrib.auth.mixins import UserPassesTestMixin
+from django.core.cache import cache
+from django.core.paginator import EmptyPage, PageNotAnInteger
+from django.core.serializers.json import DjangoJSONEncoder
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from django.utils.cache import patch_vary_headers
 from django.utils.functional import cached_property
+from django.utils.http import parse_etags
 from django.views import generic
 
+from .. import replicas
 from ..models import Bot, Race, User
 from ..utils import SafeException, exception_to_msglist
 
@@ -32,6 +40,10 @@ class BotMixin:
 
 
 class PublicAPIMixin:
+    read_from_replica = True
+    # Content shorter than this is not worth compressing.
+    min_compress_length = 200
+
     def options(self, request, *args, **kwargs):
         return self.prepare_response(super().options(request, *args, **kwargs))
 
@@ -40,10 +52,120 @@ class PublicAPIMixin:
         origin = self.request.headers.get('Origin')
         if origin:
             resp['Access-Control-Allow-Origin'] = origin
-            resp['Access-Control-Expose-Headers'] = 'X-Date-Exact'
+            resp['Access-Control-Expose-Headers'] = 'ETag, X-Date-Exact'
             patch_vary_headers(resp, ('Origin',))
         return resp
 
+    def content_entry(self, content):
+        """
+        Return a dict of JSON content (str or bytes), its ETag and a gzipped
+        copy of it (if it's long enough to be worth compressing).
+        """
+        if isinstance(content, str):
+            content = content.encode()
+        return {
+            'content': content,
+            'etag': hashlib.md5(content).hexdigest(),
+            'gzip': (
+                gzip.compress(content, mtime=0)
+                if len(content) >= self.min_compress_length else None
+            ),
+        }
+
+    def cached_response(self, key, get_content, age):
+        """
+        Return a response for JSON content held in cache under the given key,
+        calling get_content to produce it if it's missing.
+
+        The cache holds the content entry (see content_entry), so neither a
+        304 nor a gzipped response needs the content to be built again.
+        """
+        entry = cache.get(key)
+        if entry is None:
+            with replicas.primary_reads():
+                entry = self.content_entry(get_content())
+            cache.set(key, entry, age)
+        resp = self.entry_response(entry)
+        if age and resp.status_code == 200:
+            resp['Cache-Control'] = 'public, max-age=%d, must-revalidate' % age
+        return resp
+
+    def json_response(self, data):
+        """
+        Return a response for the given JSON-serializable data, with an ETag
+        derived from its content.
+        """
+        return self.entry_response(self.content_entry(
+            json.dumps(data, cls=DjangoJSONEncoder)
+        ))
+
+    def entry_response(self, entry):
+        """
+        Return a response for a content entry.
+
+        The response is gzipped if the client accepts it, and is a 304 if
+        the client already has the same content.
+        """
+        accepts_gzip = re.search(r'\bgzip\b', self.request.headers.get('Accept-Encoding', ''))
+        if entry['gzip'] and accepts_gzip:
+            # Each representation gets its own strong ETag.
+            content = entry['gzip']
+            etag = '"%s-gzip"' % entry['etag']
+        else:
+            content = entry['content']
+            etag = '"%s"' % entry['etag']
+
+        if_none_match = parse_etags(self.request.headers.get('If-None-Match', ''))
+        if etag in if_none_match or '*' in if_none_match:
+            resp = http.HttpResponseNotModified()
+        else:
+            resp = http.HttpResponse(content=content, content_type='application/json')
+            if content is entry['gzip']:
+                resp['Content-Encoding'] = 'gzip'
+        resp['ETag'] = etag
+        patch_vary_headers(resp, ('Accept-Encoding',))
+        return resp
+
+    def paginate(self, paginator):
+        """
+        Fetch a page of results from a KeysetPaginator, using either the
+        "cursor" or "page" query parameter.
+
+        Returns a dict of page data (with results under "objects"), or None
+        if the requested page or cursor is invalid. Cursor pages only include
+        a count if requested with "count=true", as it may be approximate.
+        """
+        cursor = self.request.GET.get('cursor')
+        try:
+            if cursor is not None:
+                objects, next_cursor = paginator.cursor_page(cursor)
+                data = {}
+                if self.request.GET.get('count', 'false').lower() in ['true', 'yes', '1']:
+                    data['count'] = paginator.count
+                    data['num_pages'] = paginator.num_pages
+            else:
+                page = paginator.page(self.request.GET.get('page', 1))
+                next_cursor = paginator.next_cursor(page)
+                objects = list(page)
+                data = {
+                    'count': paginator.count,
+                    'num_pages': paginator.num_pages,
+                }
+        except PageNotAnInteger:
+            return None
+        except EmptyPage:
+            objects = []
+            next_cursor = None
+            data = {
+                'count': paginator.count,
+                'num_pages': paginator.num_pages,
+            }
+        return {
+            **data,
+            'next_cursor': next_cursor,
+            'objects': objects,
+        }
+
 
 class UserMixin:
     @cached_property
@@ -1,3 +1,4 @@
+import datetime
 import json
 
 from django import http
@@ -8,8 +9,7 @@ from django.contrib.humanize.templatetags.humanize import ordinal
 from django.core.cache import cache
 from django.core.exceptions import PermissionDenied
 from django.core.mail import send_mail
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from django.core.serializers.json import DjangoJSONEncoder
+from django.core.paginator import Paginator
 from django.db import models as db_models
 from django.db.transaction import atomic
 from django.shortcuts import get_object_or_404
@@ -22,11 +22,13 @@ from django.views import generic
 from oauth2_provider.views import ScopedProtectedResourceView
 
 from .base import BotMixin, PublicAPIMixin, UserMixin
-from .. import forms, models
+from .. import forms, models, replicas
+from ..utils import KeysetPaginator, csv_lines, stream_content
 
 
 class Category(UserMixin, generic.DetailView):
     model = models.Category
+    read_from_replica = True
     slug_url_kwarg = 'category'
     queryset = models.Category.objects.filter(
         active=True,
@@ -35,7 +37,11 @@ class Category(UserMixin, generic.DetailView):
     def get_context_data(self, **kwargs):
         can_moderate = self.object.can_moderate(self.user)
 
-        paginator = Paginator(self.past_races(can_moderate=can_moderate), 10)
+        paginator = KeysetPaginator(
+            self.past_races(can_moderate=can_moderate),
+            10,
+            count=None if can_moderate else self.past_race_count(),
+        )
         return {
             **super().get_context_data(**kwargs),
             'can_edit': self.object.can_edit(self.user),
@@ -87,7 +93,7 @@ class Category(UserMixin, generic.DetailView):
     def past_races(self, can_moderate=False, filter_recordable=False):
         queryset = self.object.race_set.filter(state__in=[
             models.RaceStates.finished,
-        ]).order_by('-ended_at')
+        ]).order_by('-ended_at', '-id')
         if filter_recordable:
             queryset = queryset.filter(
                 recordable=True,
@@ -97,6 +103,20 @@ class Category(UserMixin, generic.DetailView):
             queryset = queryset.filter(unlisted=False)
         return queryset
 
+    def past_race_count(self):
+        """
+        Return the number of listed past races in this category.
+
+        The count is cached, so may be slightly out of date.
+        """
+        key = '%s/race_count' % self.object.slug
+        count = cache.get(key)
+        if count is None:
+            with replicas.primary_reads():
+                count = self.past_races().count()
+            cache.set(key, count, settings.RT_CACHE_TIMEOUT.get('CategoryRaceCount', 0))
+        return count
+
 
 class CategoryRecorder(UserPassesTestMixin, Category):
     template_name = 'racetime/category_recorder.html'
@@ -116,19 +136,11 @@ class CategoryRecorder(UserPassesTestMixin, Category):
 class CategoryData(Category, PublicAPIMixin):
     cache_key = '%s/data'
     def get(self, request, *args, **kwargs):
-        age = settings.RT_CACHE_TIMEOUT.get('CategoryData', 0)
-        content = cache.get_or_set(
+        resp = self.cached_response(
             self.cache_key % slugify(self.kwargs.get('category')),
             self.get_json_data,
-            age,
-        )
-        resp = http.HttpResponse(
-            content=content,
-            content_type='application/json',
+            settings.RT_CACHE_TIMEOUT.get('CategoryData', 0),
         )
-        if age:
-            resp['Cache-Control'] = 'public, max-age=%d, must-revalidate' % age
-
         return self.prepare_response(resp)
 
     def get_json_data(self):
@@ -138,6 +150,8 @@ class CategoryData(Category, PublicAPIMixin):
 class OAuthCategoryData(ScopedProtectedResourceView, BotMixin, CategoryData):
     cache_key = 'o/%s/data'
     required_scopes = []
+    # Access tokens may be brand new, so must be checked on the primary.
+    read_from_replica = False
 
     def get_json_data(self):
         category = self.get_object()
@@ -148,18 +162,11 @@ class OAuthCategoryData(ScopedProtectedResourceView, BotMixin, CategoryData):
 
 class CategoryListData(generic.View, PublicAPIMixin):
     def get(self, request):
-        age = settings.RT_CACHE_TIMEOUT.get('CategoryListData', 0)
-        content = cache.get_or_set(
+        resp = self.cached_response(
             'categories/data',
             self.get_json_data,
-            age,
-        )
-        resp = http.HttpResponse(
-            content=content,
-            content_type='application/json',
+            settings.RT_CACHE_TIMEOUT.get('CategoryListData', 0),
         )
-        if age:
-            resp['Cache-Control'] = 'public, max-age=%d, must-revalidate' % age
         return self.prepare_response(resp)
 
     def get_json_data(self):
@@ -177,22 +184,103 @@ class CategoryRaceData(Category, PublicAPIMixin):
             per_page = min(int(self.request.GET.get('per_page', 10)), 100)
         except ValueError:
             per_page = 10
-        paginator = Paginator(self.past_races(), per_page)
-        try:
-            page = paginator.page(self.request.GET.get('page', 1))
-        except PageNotAnInteger:
+        paginator = KeysetPaginator(self.past_races(), per_page, count=self.past_race_count())
+        data = self.paginate(paginator)
+        if data is None:
             return http.HttpResponseBadRequest()
-        except EmptyPage:
-            page = []
         show_entrants = self.request.GET.get('show_entrants', 'false').lower() in ['true', 'yes', '1']
-        resp = http.JsonResponse({
-            'count': paginator.count,
-            'num_pages': paginator.num_pages,
-            'races': [race.api_dict_summary(include_entrants=show_entrants) for race in page],
+        races = data.pop('objects')
+        resp = self.json_response({
+            **data,
+            'races': [race.api_dict_summary(include_entrants=show_entrants) for race in races],
         })
         return self.prepare_response(resp)
 
 
+class CategoryRaceCSV(Category):
+    """
+    Export results of every past race in a category within a date range.
+    """
+    max_days = 366
+
+    def get(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        try:
+            date_to = datetime.date.fromisoformat(self.request.GET['to'])
+        except KeyError:
+            date_to = timezone.now().date()
+        except ValueError:
+            return http.HttpResponseBadRequest()
+        try:
+            date_from = datetime.date.fromisoformat(self.request.GET['from'])
+        except KeyError:
+            date_from = date_to - datetime.timedelta(days=30)
+        except ValueError:
+            return http.HttpResponseBadRequest()
+        if date_from > date_to or (date_to - date_from).days > self.max_days:
+            return http.HttpResponseBadRequest()
+
+        entrants = models.Entrant.objects.filter(
+            race__in=self.past_races(),
+            race__ended_at__gte=datetime.datetime.combine(
+                date_from, datetime.time.min, datetime.timezone.utc,
+            ),
+            race__ended_at__lt=datetime.datetime.combine(
+                date_to + datetime.timedelta(days=1), datetime.time.min, datetime.timezone.utc,
+            ),
+            state=models.EntrantStates.joined.value,
+        ).select_related(
+            'race', 'race__category', 'race__goal', 'user',
+        ).order_by(
+            'race__ended_at', 'race_id', 'dnf', 'dq', 'place', 'finish_time',
+        )
+
+        filename = '%s_%s_%s.csv' % (self.object.slug, date_from, date_to)
+        response = http.StreamingHttpResponse(
+            streaming_content=stream_content(csv_lines(self.get_rows(entrants))),
+            content_type='text/csv',
+        )
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+    def get_rows(self, entrants):
+        """
+        Generator that yields each row of the CSV output.
+        """
+        yield [
+            'Race',
+            'URL',
+            'Goal',
+            'Started at (UTC)',
+            'Ended at (UTC)',
+            'Place',
+            'Entrant',
+            'Pronouns',
+            'Status',
+            'Finish time',
+            'Original score',
+            'Score change',
+            'Comment',
+        ]
+        for entrant in entrants.iterator(chunk_size=2000):
+            race = entrant.race
+            yield [
+                race.slug,
+                settings.RT_SITE_URI + race.get_absolute_url(),
+                race.goal_str,
+                race.started_at.strftime('%Y-%m-%d %H:%M:%S') if race.started_at else '',
+                race.ended_at.strftime('%Y-%m-%d %H:%M:%S'),
+                entrant.place_ordinal,
+                entrant.user or '(deleted user)',
+                (entrant.user.pronouns or '') if entrant.user else '',
+                entrant.summary[1],
+                entrant.finish_time_str or 'n/a',
+                entrant.rating or 'n/a',
+                entrant.rating_change or '0',
+                entrant.comment or '',
+            ]
+
+
 class CategoryLeaderboards(Category):
     template_name_suffix = '_leaderboards'
 
@@ -243,12 +331,9 @@ class CategoryLeaderboards(Category):
 class CategoryLeaderboardsData(CategoryLeaderboards, PublicAPIMixin):
     def get(self, request, *args, **kwargs):
         self.object = self.get_object()
-        resp = http.HttpResponse(
-            content=json.dumps({
-                'leaderboards': list(self.leaderboards(self.get_sort())),
-            }, cls=DjangoJSONEncoder),
-            content_type='application/json',
-        )
+        resp = self.json_response({
+            'leaderboards': list(self.leaderboards(self.get_sort())),
+        })
         return self.prepare_response(resp)
 
     def leaderboards(self, sort='score'):
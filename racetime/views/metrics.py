@@ -0,0 +1,83 @@
+from django import http
+from django.conf import settings
+from django.views import generic
+
+from .. import caching, dbpool, instrumentation
+from ..utils import determine_ip
+
+
+class Metrics(generic.View):
+    """
+    Expose instrumentation and cache metrics in the Prometheus text format.
+
+    Only available to the addresses in settings.RT_METRICS_IPS (as seen
+    through any proxy, see REAL_IP_HEADER).
+
+    Figures from every process are merged through the cache, so if it is not
+    shared (see caching.is_shared) only this process's are included, and
+    racetime_cache_shared is 0.
+    """
+    counters = (
+        ('calls', 'racetime_calls_total', 'Number of calls measured.', 1),
+        ('queries', 'racetime_queries_total', 'Number of SQL queries made.', 1),
+        ('db_us', 'racetime_db_seconds_total', 'Time spent running SQL queries.', 1_000_000),
+        ('render_us', 'racetime_render_seconds_total', 'Time spent rendering templates.', 1_000_000),
+        ('bytes', 'racetime_payload_bytes_total', 'Bytes of response or message content sent.', 1),
+        ('over_budget', 'racetime_query_budget_violations_total', 'Number of calls that made more queries than their budget.', 1),
+    )
+    pool_gauges = (
+        ('threads', 'racetime_db_pool_threads', 'Number of threads in the consumer database pool.'),
+        ('busy', 'racetime_db_pool_busy', 'Number of pool threads in use.'),
+        ('waiting', 'racetime_db_pool_waiting', 'Number of calls waiting for a pool thread.'),
+        ('peak_busy', 'racetime_db_pool_peak_busy', 'Most pool threads in use at once since last published.'),
+        ('peak_waiting', 'racetime_db_pool_peak_waiting', 'Most calls waiting at once since last published.'),
+        ('max_wait', 'racetime_db_pool_max_wait_seconds', 'Longest wait for a pool thread since last published.'),
+    )
+
+    def get(self, request, *args, **kwargs):
+        if determine_ip(request) not in settings.RT_METRICS_IPS:
+            raise http.Http404
+
+        instrumentation.flush()
+        metrics = sorted(instrumentation.get_metrics().items())
+        lines = []
+        for field, metric, help_text, divisor in self.counters:
+            lines.append('# HELP %s %s' % (metric, help_text))
+            lines.append('# TYPE %s counter' % metric)
+            for (kind, name), totals in metrics:
+                lines.append('%s{kind="%s",name="%s"} %s' % (
+                    metric,
+                    self.escape(kind),
+                    self.escape(name),
+                    totals[field] / divisor if divisor > 1 else totals[field],
+                ))
+
+        lines.append('# HELP racetime_cache_keys_total Number of cache keys invalidated or refreshed.')
+        lines.append('# TYPE racetime_cache_keys_total counter')
+        for family, counts in caching.get_metrics().items():
+            for action, value in counts.items():
+                lines.append('racetime_cache_keys_total{family="%s",action="%s"} %d' % (
+                    family,
+                    action,
+                    value,
+                ))
+
+        pools = dbpool.get_stats()
+        for field, metric, help_text in self.pool_gauges:
+            lines.append('# HELP %s %s' % (metric, help_text))
+            lines.append('# TYPE %s gauge' % metric)
+            for stats in pools:
+                lines.append('%s{pid="%d"} %s' % (metric, stats['pid'], stats[field]))
+
+        lines.append('# HELP racetime_cache_shared Whether other processes\' metrics can be seen through the cache.')
+        lines.append('# TYPE racetime_cache_shared gauge')
+        lines.append('racetime_cache_shared %d' % caching.is_shared())
+
+        return http.HttpResponse(
+            '\n'.join(lines) + '\n',
+            content_type='text/plain; version=0.0.4; charset=utf-8',
+        )
+
+    @staticmethod
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
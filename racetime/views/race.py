@@ -1,4 +1,3 @@
-import csv
 import json
 
 from asgiref.sync import async_to_sync
@@ -7,8 +6,10 @@ from django import http
 from django.conf import settings
 from django.contrib.auth.mixins import UserPassesTestMixin
 from django.contrib.auth.decorators import login_required
+from django.contrib.messages import get_messages
 from django.core.cache import cache
 from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError
 from django.db.models import F, Q
 from django.db.transaction import atomic
 from django.shortcuts import get_object_or_404
@@ -22,8 +23,11 @@ from django.views.generic.detail import SingleObjectMixin
 from oauth2_provider.views import ScopedProtectedResourceView
 
 from .base import BotMixin, CanModerateRaceMixin, CanMonitorRaceMixin, PublicAPIMixin, UserMixin
-from .. import forms, models
-from ..utils import get_action_button, get_hashids, twitch_auth_url
+from .. import caching, forms, instrumentation, models, replicas
+from ..utils import (
+    SafeException, csv_lines, get_action_button, get_hashids, set_bulk_ids,
+    stream_content, twitch_auth_url,
+)
 
 
 class RaceMixin(SingleObjectMixin):
@@ -40,19 +44,94 @@ class RaceMixin(SingleObjectMixin):
 
 
 class Race(RaceMixin, UserMixin, generic.DetailView):
+    """
+    The race page.
+
+    The parts of the page that are the same for every visitor (emotes and
+    the chat backlog) are cached per race. Anything that depends on who is
+    looking at it, such as their available actions, monitor controls and
+    DMs, is rendered for each request.
+
+    Pages for anonymous visitors are cached whole, and served without
+    touching the database at all. Nothing time-dependent goes into the
+    page for this reason: the client takes the server time from its first
+    socket message instead.
+    """
+    read_from_replica = True
+
+    def get(self, request, *args, **kwargs):
+        if not self.page_is_cacheable():
+            return super().get(request, *args, **kwargs)
+
+        key = '%s/%s/page%s' % (
+            slugify(self.kwargs.get('category')),
+            slugify(self.kwargs.get('race')),
+            self.template_name_suffix,
+        )
+        content = cache.get(key)
+        if content is None:
+            with replicas.primary_reads():
+                resp = super().get(request, *args, **kwargs)
+                with instrumentation.rendering():
+                    resp.render()
+            cache.set(key, resp.content, settings.RT_CACHE_TIMEOUT.get('RacePage', 0))
+            return resp
+        return http.HttpResponse(content)
+
+    def page_is_cacheable(self):
+        """
+        Determine if this request can be served a cached page.
+        """
+        return (
+            self.template_name_suffix in models.Race.CACHED_PAGES
+            and not self.user.is_authenticated
+            and not self.request.GET
+            and not len(get_messages(self.request))
+        )
+
     def get_chat_form(self, race):
         return forms.ChatForm(chat_restricted=race.chat_restricted)
 
     def get_invite_form(self):
         return forms.InviteForm()
 
+    def get_shell(self, race):
+        """
+        Return the parts of the page context that are the same for everyone,
+        from cache if possible.
+        """
+        shell = cache.get(race.shell_cache_key)
+        if shell is None:
+            with replicas.primary_reads():
+                category = models.Category.objects.get(id=race.category_id)
+                shell = {
+                    'chat_history': race.chat_history(),
+                    'emotes': {
+                        emote.name: emote.image.url
+                        for emote in category.emote_set.all().order_by('name')
+                    },
+                    'meta_image': category.image.url if category.image else None,
+                }
+            cache.set(race.shell_cache_key, shell, settings.RT_CACHE_TIMEOUT.get('RacePage', 0))
+        return shell
+
     def get_context_data(self, **kwargs):
         race = self.get_object()
-        can_moderate = race.category.can_moderate(self.user)
-        can_monitor = can_moderate or race.can_monitor(self.user)
+        shell = self.get_shell(race)
+        chat_history = shell['chat_history']
         if self.user.is_authenticated:
+            can_moderate = race.category.can_moderate(self.user)
+            can_monitor = can_moderate or race.can_monitor(self.user)
             entrant = race.entrant_set.filter(user=self.user).first()
+            # The cached chat backlog leaves out DMs, so fetch the user's own
+            # backlog if they have any.
+            if race.message_set.filter(
+                Q(direct_to=self.user) | Q(user=self.user, direct_to__isnull=False),
+            ).exists():
+                chat_history = race.chat_history(self.user)
         else:
+            can_moderate = False
+            can_monitor = False
             entrant = None
 
         return {
@@ -64,19 +143,16 @@ class Race(RaceMixin, UserMixin, generic.DetailView):
             ],
             'can_moderate': can_moderate,
             'can_monitor': can_monitor,
-            'emotes': {
-                emote.name: emote.image.url
-                for emote in race.category.emote_set.all().order_by('name')
-            },
+            'emotes': shell['emotes'],
             'invite_form': self.get_invite_form(),
-            'meta_image': race.category.image.url if race.category.image else None,
+            'meta_image': shell['meta_image'],
             'js_vars': {
-                'chat_history': race.chat_history(self.user),
+                'chat_history': chat_history,
                 'hide_comments': race.hide_comments,
                 'room': str(race),
-                'server_time_utc': timezone.now().isoformat(),
                 'urls': {
-                    'chat': race.get_ws_url(),
+                    # Race pages don't show live splits.
+                    'chat': race.get_ws_url() + '?channels=chat,data,dms,renders',
                     'renders': race.get_renders_url(),
                     'available_teams': reverse('available_teams', args=(race.category.slug, race.slug)),
                     'message': reverse('message', args=(race.category.slug, race.slug)),
@@ -140,18 +216,22 @@ class RaceChatMixin(CanModerateRaceMixin, RaceMixin, generic.View):
 
 class OAuthRaceMixin:
     def get_form_kwargs(self):
-        # Set default values if they are missing from POST data.
         kwargs = super().get_form_kwargs()
         if self.request.method in ('POST', 'PUT'):
-            data = kwargs['data'].copy()
-            form_class = self.get_form_class()
-            model = self.model()
-            for name, field in form_class.base_fields.items():
-                if hasattr(model, name) and name not in data:
-                    data[name] = field.prepare_value(getattr(model, name))
-            kwargs['data'] = data
+            kwargs['data'] = self.fill_defaults(kwargs['data'].copy())
         return kwargs
 
+    def fill_defaults(self, data):
+        """
+        Set default values for any fields missing from the given form data.
+        """
+        form_class = self.get_form_class()
+        model = self.model()
+        for name, field in form_class.base_fields.items():
+            if hasattr(model, name) and name not in data:
+                data[name] = field.prepare_value(getattr(model, name))
+        return data
+
 
 class RaceChatDM(RaceChatMixin):
     def get(self, request, *args, **kwargs):
@@ -328,10 +408,10 @@ class RaceChatLog(RaceMixin, UserMixin, generic.View):
         else:
             messages = messages.filter(direct_to__isnull=True)
 
-        content = '\n'.join(self.message_to_str(msg) for msg in messages)
+        messages = messages.select_related('user', 'bot', 'deleted_by', 'direct_to')
 
-        resp = http.HttpResponse(
-            content=content,
+        resp = http.StreamingHttpResponse(
+            streaming_content=stream_content(self.get_lines(messages)),
             content_type='text/plain; charset=utf-8',
         )
 
@@ -348,6 +428,13 @@ class RaceChatLog(RaceMixin, UserMixin, generic.View):
 
         return resp
 
+    def get_lines(self, messages):
+        """
+        Generator that yields each message as a line of the chat log.
+        """
+        for n, msg in enumerate(messages.iterator(chunk_size=2000)):
+            yield ('\n' if n else '') + self.message_to_str(msg)
+
     def message_to_str(self, msg):
         """
         Format a Message object as a string for the chat log output.
@@ -391,21 +478,14 @@ class RaceAvailableTeams(RaceMixin, UserMixin, generic.View):
 
 class RaceData(RaceMixin, PublicAPIMixin, generic.View):
     def get(self, request, *args, **kwargs):
-        age = settings.RT_CACHE_TIMEOUT.get('RaceData', 0)
-        content = cache.get_or_set(
+        resp = self.cached_response(
             '%s/%s/data' % (
                 slugify(self.kwargs.get('category')),
                 slugify(self.kwargs.get('race')),
             ),
             self.get_json_data,
-            age,
+            settings.RT_CACHE_TIMEOUT.get('RaceData', 0),
         )
-        resp = http.HttpResponse(
-            content=content,
-            content_type='application/json',
-        )
-        if age:
-            resp['Cache-Control'] = 'public, max-age=%d, must-revalidate' % age
         return self.prepare_response(resp)
 
     def get_json_data(self):
@@ -420,26 +500,34 @@ class RaceCSV(RaceMixin, generic.View):
             self.object.category.slug,
             self.object.slug,
         )
-        response = http.HttpResponse(content_type='text/csv')
+        response = http.StreamingHttpResponse(
+            streaming_content=stream_content(csv_lines(self.get_rows())),
+            content_type='text/csv',
+        )
         response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
 
-        writer = csv.writer(response)
-        writer.writerow(['Category', self.object.category])
-        writer.writerow(['Room name', self.object])
-        writer.writerow(['URL', settings.RT_SITE_URI + self.object.get_absolute_url()])
-        writer.writerow(['Goal' + (' (custom)' if not self.object.goal else ''), self.object.goal_str])
-        writer.writerow(['Info', self.object.info])
-        writer.writerow(['Total entrants', self.object.entrants_count])
-        writer.writerow(['Of which inactive', self.object.entrants_count_inactive])
-        writer.writerow(['Opened at (UTC)', self.object.opened_at.strftime('%Y-%m-%d %H:%M:%S')])
-        if self.object.started_at:
-            writer.writerow(['Started at (UTC)', self.object.started_at.strftime('%Y-%m-%d %H:%M:%S')])
-        if self.object.ended_at:
-            writer.writerow(['Ended at (UTC)', self.object.ended_at.strftime('%Y-%m-%d %H:%M:%S')])
-        if self.object.cancelled_at:
-            writer.writerow(['Cancelled at (UTC)', self.object.cancelled_at.strftime('%Y-%m-%d %H:%M:%S')])
-        writer.writerow([])
-        writer.writerow([
+    def get_rows(self):
+        """
+        Generator that yields each row of the CSV output.
+        """
+        race = self.object
+        yield ['Category', race.category]
+        yield ['Room name', race]
+        yield ['URL', settings.RT_SITE_URI + race.get_absolute_url()]
+        yield ['Goal' + (' (custom)' if not race.goal else ''), race.goal_str]
+        yield ['Info', race.info]
+        yield ['Total entrants', race.entrants_count]
+        yield ['Of which inactive', race.entrants_count_inactive]
+        yield ['Opened at (UTC)', race.opened_at.strftime('%Y-%m-%d %H:%M:%S')]
+        if race.started_at:
+            yield ['Started at (UTC)', race.started_at.strftime('%Y-%m-%d %H:%M:%S')]
+        if race.ended_at:
+            yield ['Ended at (UTC)', race.ended_at.strftime('%Y-%m-%d %H:%M:%S')]
+        if race.cancelled_at:
+            yield ['Cancelled at (UTC)', race.cancelled_at.strftime('%Y-%m-%d %H:%M:%S')]
+        yield []
+        yield [
             'Place',
             'Entrant',
             'Pronouns',
@@ -448,41 +536,39 @@ class RaceCSV(RaceMixin, generic.View):
             'Original score',
             'Score change',
             'Comment',
-        ])
-        for entrant in self.object.ordered_entrants:
-            writer.writerow([
+        ]
+        for entrant in race.ordered_entrants.iterator():
+            yield [
                 entrant.place_ordinal,
-                entrant.user,
-                entrant.user.pronouns or '',
+                entrant.user or '(deleted user)',
+                (entrant.user.pronouns or '') if entrant.user else '',
                 entrant.summary[1],
                 entrant.finish_time_str or 'n/a',
                 entrant.rating or 'n/a',
                 entrant.rating_change or '0',
-                (entrant.comment or '') if self.object.comments_visible else '',
-            ])
-
-        return response
+                (entrant.comment or '') if race.comments_visible else '',
+            ]
 
 
 class RaceRenders(RaceMixin, UserMixin, generic.View):
+    read_from_replica = True
+
     def get(self, request, *args, **kwargs):
-        if self.user.is_authenticated:
-            age = 0
-            self.object = self.get_object()
-            content = json.dumps({
-                'renders': self.object.get_renders(self.user, self.request),
-                'version': self.object.version,
-            }, cls=DjangoJSONEncoder)
-        else:
-            age = settings.RT_CACHE_TIMEOUT.get('RaceRenders', 0)
-            content = cache.get_or_set(
-                '%s/%s/renders' % (
-                    slugify(self.kwargs.get('category')),
-                    slugify(self.kwargs.get('race')),
-                ),
-                self.get_json_data,
-                age,
-            )
+        # Authenticating checks the session's hash, so a logged-out or
+        # changed-password session can't read a user's cached renders.
+        if request.user.is_authenticated:
+            return self.get_user_renders(request.user.id)
+
+        age = settings.RT_CACHE_TIMEOUT.get('RaceRenders', 0)
+        key = '%s/%s/renders' % (
+            slugify(self.kwargs.get('category')),
+            slugify(self.kwargs.get('race')),
+        )
+        content = cache.get(key)
+        if content is None:
+            with replicas.primary_reads():
+                content = self.get_json_data()
+            cache.set(key, content, age)
         resp = http.HttpResponse(
             content=content,
             content_type='application/json',
@@ -492,6 +578,64 @@ class RaceRenders(RaceMixin, UserMixin, generic.View):
         resp['X-Date-Exact'] = timezone.now().isoformat()
         return resp
 
+    def get_user_renders(self, user_id):
+        """
+        Return renders for a logged-in user.
+
+        Responses carry an ETag of the race version and user ID, so a client
+        that already has the current version gets a 304. Both that and
+        serving renders the user has already been given for this version are
+        done from cache and the authenticated user alone.
+
+        The cached version may lag behind the one the client was just sent
+        over its socket, so clients give that version in the query string.
+        If the cached version is older, the cache is bypassed.
+        """
+        race_key = '%s/%s' % (
+            slugify(self.kwargs.get('category')),
+            slugify(self.kwargs.get('race')),
+        )
+        try:
+            min_version = int(self.request.GET.get('version', 0))
+        except ValueError:
+            min_version = 0
+        version = cache.get(race_key + '/version')
+        renders = None
+        if version is not None and version >= min_version:
+            etag = '"%d-%d"' % (version, user_id)
+            if etag in self.request.headers.get('If-None-Match', ''):
+                resp = http.HttpResponseNotModified()
+                resp['ETag'] = etag
+                return resp
+            role_key = cache.get('%s/renders/%d/user/%d' % (race_key, version, user_id))
+            if role_key:
+                renders = cache.get(role_key)
+
+        if renders is None:
+            with replicas.primary_reads():
+                race = self.get_object()
+                version = race.version
+                cache.set(
+                    race.version_cache_key,
+                    version,
+                    settings.RT_CACHE_TIMEOUT.get('RaceVersion', 0),
+                )
+                renders = race.get_renders(self.user, self.request)
+        else:
+            renders = models.Race.fill_renders(renders, self.request)
+
+        resp = http.HttpResponse(
+            content=json.dumps({
+                'renders': renders,
+                'version': version,
+            }, cls=DjangoJSONEncoder),
+            content_type='application/json',
+        )
+        resp['Cache-Control'] = 'private, no-cache'
+        resp['ETag'] = '"%d-%d"' % (version, user_id)
+        resp['X-Date-Exact'] = timezone.now().isoformat()
+        return resp
+
     def get_json_data(self):
         return self.get_object().dump_json_renders()
 
@@ -646,6 +790,140 @@ class OAuthCreateRace(ScopedProtectedResourceView, BotMixin, OAuthRaceMixin, Bas
         return resp
 
 
+@method_decorator(csrf_exempt, name='dispatch')
+class OAuthCreateRaces(ScopedProtectedResourceView, BotMixin, OAuthRaceMixin, BaseCreateRace):
+    """
+    Open several race rooms at once, e.g. for a round of a tournament.
+
+    Expects a JSON body of {"races": [...]}, where each race is an object of
+    the same fields accepted by OAuthCreateRace. Either all of the races are
+    created, or none are.
+    """
+    form_class = forms.OAuthRaceCreationForm
+    model = models.Race
+    required_scopes = ['create_race']
+    max_races = 64
+    slug_attempts = 3
+
+    def post(self, request, *args, **kwargs):
+        category = self.get_category()
+
+        try:
+            specs = json.loads(request.body)['races']
+        except (ValueError, TypeError, KeyError):
+            return self.errors('Expected a JSON object with a list of races.')
+        if not isinstance(specs, list) or not all(isinstance(spec, dict) for spec in specs):
+            return self.errors('Expected a JSON object with a list of races.')
+        if not specs:
+            return self.errors('No races given.')
+        if len(specs) > self.max_races:
+            return self.errors('You can only create up to %d races at a time.' % self.max_races)
+
+        user = None
+        bot = None
+        if self.request.resource_owner:
+            user = self.request.resource_owner
+            if not category.can_start_race(user):
+                return http.HttpResponseForbidden()
+            if (
+                self.room_restriction_applies(category, user)
+                and (len(specs) > 1 or self.user_has_race(user))
+            ):
+                return self.errors('You can only have one open race room at a time.')
+        else:
+            bot = self.get_bot(category)
+            if not bot:
+                return http.HttpResponseForbidden()
+
+        race_forms = [
+            self.form_class(
+                category=category,
+                can_moderate=True,
+                data=self.fill_defaults(spec.copy()),
+            )
+            for spec in specs
+        ]
+        errors = {
+            index: form.errors
+            for index, form in enumerate(race_forms)
+            if not form.is_valid()
+        }
+        if errors:
+            return http.JsonResponse({'errors': errors}, status=422)
+
+        try:
+            races = self.create_races(category, race_forms, user, bot)
+        except SafeException as ex:
+            return self.errors(str(ex))
+
+        return http.JsonResponse({
+            'races': [
+                {
+                    'name': str(race),
+                    'url': race.get_absolute_url(),
+                    'data_url': race.get_data_url(),
+                }
+                for race in races
+            ],
+        }, status=201)
+
+    def create_races(self, category, race_forms, user, bot):
+        """
+        Create races from the given (valid) forms, along with their initial
+        chat messages, in bulk.
+
+        If another request takes some of the chosen slugs first, those slugs
+        are swapped for new ones and the races are created again, up to
+        slug_attempts times in all.
+        """
+        slugs = category.generate_race_slugs(len(race_forms))
+        for attempt in range(self.slug_attempts):
+            try:
+                return self.create_races_with_slugs(category, race_forms, user, bot, slugs)
+            except IntegrityError:
+                taken = set(category.race_set.filter(
+                    slug__in=slugs,
+                ).values_list('slug', flat=True))
+                if not taken:
+                    raise
+                slugs = [slug for slug in slugs if slug not in taken]
+                slugs += category.generate_race_slugs(len(taken), exclude=slugs)
+        raise SafeException('Could not open the race rooms just now. Please try again.')
+
+    def create_races_with_slugs(self, category, race_forms, user, bot, slugs):
+        races = []
+        with atomic():
+            for form, slug in zip(race_forms, slugs):
+                race = form.save(commit=False)
+                race.category = category
+                race.slug = slug
+                if form.cleaned_data.get('invitational'):
+                    race.state = models.RaceStates.invitational.value
+                if user:
+                    race.opened_by = user
+                elif bot:
+                    race.opened_by_bot = bot.name
+                races.append(race)
+            models.Race.objects.bulk_create(races)
+            set_bulk_ids(races, category.race_set.filter(slug__in=slugs))
+
+            messages = []
+            for race in races:
+                messages += race.get_partition_messages()
+                if bot:
+                    messages.append(models.Message(
+                        race=race,
+                        message='Race opened automatically by %(bot)s' % {'bot': bot},
+                    ))
+            models.Message.objects.bulk_create(messages)
+
+            caching.schedule(category.data_cache_keys('current_races'))
+        return races
+
+    def errors(self, *errors):
+        return http.JsonResponse({'errors': errors}, status=422)
+
+
 class BaseEditRace(RaceFormMixin, generic.UpdateView):
     form_class = forms.RaceEditForm
     form_class_started = forms.StartedRaceEditForm
@@ -814,20 +1092,13 @@ class RaceListData(generic.View, PublicAPIMixin):
         self.unlisted_filter = Q(unlisted=False)
         if self.request.user.is_authenticated:
             self.unlisted_filter |= Q(unlisted=True, entrant__user=self.request.user)
-            resp = http.HttpResponse(
-                content=self.get_json_data(),
-                content_type='application/json',
-            )
-            return resp
+            return self.entry_response(self.content_entry(self.get_json_data()))
         else:
-            age = settings.RT_CACHE_TIMEOUT.get('RaceListData', 0)
-            content = cache.get_or_set('races/data', self.get_json_data, age)
-            resp = http.HttpResponse(
-                content=content,
-                content_type='application/json',
+            resp = self.cached_response(
+                'races/data',
+                self.get_json_data,
+                settings.RT_CACHE_TIMEOUT.get('RaceListData', 0),
             )
-            if age:
-                resp['Cache-Control'] = 'public, max-age=%d, must-revalidate' % age
             return self.prepare_response(resp)
 
     def current_races(self):
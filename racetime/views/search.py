@@ -10,6 +10,7 @@ from .. import models
 class Search(generic.TemplateView):
     template_name = 'racetime/search.html'
     max_results = 10
+    read_from_replica = True
 
     def get(self, request, *args, **kwargs):
         query = str(self.request.GET.get('q', ''))
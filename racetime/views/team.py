@@ -2,7 +2,6 @@ from django import http
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
-from django.core.cache import cache
 from django.core.paginator import Paginator
 from django.db import models as db_models
 from django.db.transaction import atomic
@@ -35,18 +34,11 @@ class Team(UserMixin, generic.DetailView):
 
 class TeamData(Team, PublicAPIMixin):
     def get(self, request, *args, **kwargs):
-        age = settings.RT_CACHE_TIMEOUT.get('TeamData', 0)
-        content = cache.get_or_set(
+        resp = self.cached_response(
             'team/%s/data' % slugify(self.kwargs.get('team')),
             self.get_json_data,
-            age,
+            settings.RT_CACHE_TIMEOUT.get('TeamData', 0),
         )
-        resp = http.HttpResponse(
-            content=content,
-            content_type='application/json',
-        )
-        if age:
-            resp['Cache-Control'] = 'public, max-age=%d, must-revalidate' % age
         return self.prepare_response(resp)
 
     def get_json_data(self):
@@ -6,8 +6,7 @@ from django.contrib.auth import login, logout, update_session_auth_hash
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.core.exceptions import PermissionDenied
 from django.core.mail import send_mail
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from django.db.models import Count, Q
+from django.db.models import Q
 from django.db.transaction import atomic
 from django.forms import model_to_dict
 from django.shortcuts import resolve_url, get_object_or_404
@@ -15,6 +14,7 @@ from django.template.loader import render_to_string
 from django.urls import reverse, reverse_lazy
 from django.utils import timezone
 from django.utils.decorators import decorator_from_middleware, method_decorator
+from django.utils.functional import cached_property
 from django.utils.http import url_has_allowed_host_and_scheme
 from django.views import generic
 from django.views.decorators.csrf import csrf_protect
@@ -25,12 +25,13 @@ from oauth2_provider.views import AuthorizationView, ProtectedResourceView
 from .base import PublicAPIMixin, UserMixin
 from .. import forms, models
 from ..middleware import CsrfViewMiddlewareTwitch
-from ..utils import delete_user, notice_exception, patreon_auth_url, patreon_update_memberships, twitch_auth_url
+from ..utils import KeysetPaginator, delete_user, notice_exception, patreon_auth_url, patreon_update_memberships, twitch_auth_url
 
 
 class ViewProfile(UserMixin, generic.DetailView):
     context_object_name = 'profile'
     model = models.User
+    read_from_replica = True
 
     def get(self, request, *args, **kwargs):
         self.object = self.get_object()
@@ -42,15 +43,14 @@ class ViewProfile(UserMixin, generic.DetailView):
         return self.render_to_response(context)
 
     def get_context_data(self, **kwargs):
-        entrances = self.get_entrances()
-        paginator = Paginator(entrances, 10)
+        paginator = self.get_paginator(10)
 
         return {
             **super().get_context_data(**kwargs),
             'categories': self.get_favourite_categories(),
             'entrances': paginator.get_page(self.request.GET.get('page')),
             'mod_categories': self.get_mod_categories(),
-            'stats': self.get_stats(entrances),
+            'stats': self.get_stats(),
             'teams': self.get_teams(),
         }
 
@@ -80,19 +80,46 @@ class ViewProfile(UserMixin, generic.DetailView):
             race__unlisted=False,
         )
         queryset = queryset.select_related('race')
-        queryset = queryset.order_by('-race__ended_at')
+        queryset = queryset.order_by('-race__ended_at', '-race_id')
         return queryset
 
-    def get_favourite_categories(self):
-        queryset = models.Category.objects.filter(
-            active=True,
-            race__state=models.RaceStates.finished,
-            race__entrant__user=self.get_object(),
-            race__unlisted=False,
+    def get_paginator(self, per_page):
+        """
+        Return a KeysetPaginator over the profile user's race entrances.
+
+        The stats rollups already hold the number of entrances, so there is no
+        need for a separate COUNT query. The paginator checks that figure
+        against the entrances it actually finds.
+        """
+        return KeysetPaginator(
+            self.get_entrances(),
+            per_page,
+            ended_at_field='race__ended_at',
+            id_field='race_id',
+            count=self.get_stats()['joined'],
         )
-        queryset = queryset.annotate(times_entered=Count('race__entrant'))
-        queryset = queryset.order_by('-times_entered')
-        return queryset[:3]
+
+    @cached_property
+    def category_stats(self):
+        """
+        Return a list of the profile user's stats rollups for each active
+        category they have raced in.
+        """
+        return list(models.UserStats.objects.filter(
+            user=self.object,
+            category__active=True,
+        ).select_related('category'))
+
+    def get_favourite_categories(self):
+        categories = []
+        for stats in sorted(
+            self.category_stats,
+            key=lambda stats: stats.times_entered,
+            reverse=True,
+        )[:3]:
+            stats.category.times_entered = stats.times_entered
+            categories.append(stats.category)
+        return categories
 
     def get_mod_categories(self):
         """
@@ -114,13 +141,13 @@ class ViewProfile(UserMixin, generic.DetailView):
             teammember__invite=False,
         ).order_by('name')
 
-    def get_stats(self, entrances):
+    def get_stats(self):
         return {
-            'joined': entrances.count(),
-            'first': entrances.filter(place=1).count(),
-            'second': entrances.filter(place=2).count(),
-            'third': entrances.filter(place=3).count(),
-            'forfeits': entrances.filter(Q(dnf=True) | Q(dq=True)).count(),
+            'joined': sum(stats.times_entered for stats in self.category_stats),
+            'first': sum(stats.times_first for stats in self.category_stats),
+            'second': sum(stats.times_second for stats in self.category_stats),
+            'third': sum(stats.times_third for stats in self.category_stats),
+            'forfeits': sum(stats.times_forfeited for stats in self.category_stats),
         }
 
 
@@ -131,26 +158,22 @@ class UserRaceData(ViewProfile, PublicAPIMixin):
             per_page = min(int(self.request.GET.get('per_page', 10)), 100)
         except ValueError:
             per_page = 10
-        paginator = Paginator(self.get_entrances(), per_page)
-        try:
-            page = paginator.page(self.request.GET.get('page', 1))
-        except PageNotAnInteger:
+        data = self.paginate(self.get_paginator(per_page))
+        if data is None:
             return http.HttpResponseBadRequest()
-        except EmptyPage:
-            page = []
         show_entrants = (
             self.request.GET.get('show_entrants', 'false').lower()
             in ['true', 'yes', '1']
         )
-        resp = http.JsonResponse({
-            'count': paginator.count,
-            'num_pages': paginator.num_pages,
+        entrances = data.pop('objects')
+        resp = self.json_response({
+            **data,
             'races': [
                 entrance.race.api_dict_summary(
                     include_category=True,
                     include_entrants=show_entrants,
                 )
-                for entrance in page
+                for entrance in entrances
             ],
         })
         return self.prepare_response(resp)
@@ -160,10 +183,9 @@ class UserProfileData(ViewProfile, PublicAPIMixin):
     def get(self, request, *args, **kwargs):
         self.object = self.get_object()
         user = self.object.api_dict_summary()
-        entrances = self.get_entrances()
-        resp = http.JsonResponse({
+        resp = self.json_response({
             **user,
-            'stats': self.get_stats(entrances),
+            'stats': self.get_stats(),
             'teams': [
                 team.api_dict_summary()
                 for team in self.get_teams()
@@ -245,7 +267,7 @@ class DeleteAccount(LoginRequiredMixin, UserMixin, generic.TemplateView):
         user = self.user
         logout(request)
         delete_user(request, user)
-        messages.success(request, 'Your racetime.gg account has been deleted.')
+        messages.success(request, 'Your racetime.gg account has been deactivated, and will be deleted shortly.')
         return http.HttpResponseRedirect(reverse('home'))
 
 
@@ -13,6 +13,7 @@ setup(
         'django-recaptcha>=4.0,<5.0',
         'hashids>=1.3,<1.4',
         'mpmath>=1.3,<1.4',
+        'msgpack>=1.0,<2.0',
         'Pillow>=11.0,<12.0',
         'requests>=2.28,<3.0',
         'trueskill==0.4.5',